@@ -1,26 +1,37 @@
 """
 @file Admitad Integration Backend
-@version 3.1.0
+@version 3.5.0
 @description Этот файл представляет собой полностью автономный серверный API-шлюз для трекера Admitad.
 Его задачи:
 1. Принимать параметры визита от int_loader.js и устанавливать безопасные First-Party, HttpOnly cookie.
 2. Принимать данные о конверсиях, собранные на фронтенде.
 3. Проводить логику дедупликации по принципу Last Paid Click, решая, нужно ли атрибуцировать заказ Admitad.
-4. Формировать и асинхронно отправлять серверный (S2S) postback-запрос в Admitad.
+4. Формировать и асинхронно отправлять серверный (S2S) postback-запрос в Admitad
+   через диспетчер с пулом соединений, повторами и персистентным outbox.
 5. Отдавать клиентский скрипт int_loader.js под нейтральным именем для защиты от блокировщиков.
 6. Вести собственное изолированное логирование в отдельный файл, не затрагивая основное приложение.
+   Запись в файл идёт в фоновом потоке через очередь и не блокирует обработку запросов.
+7. Вести журнал визитов (admitad_uid, pid, utm_source, gclid, fbclid, время) для проверки
+   атрибуции. Визит кладётся в буфер в памяти, на диск журнал пишется пачками в фоне.
 """
 
+import hashlib
+import logging
 import logging.handlers
-import requests
 import json
 import os
-from fastapi import APIRouter, HTTPException, Request, BackgroundTasks, Response
-from fastapi.responses import FileResponse
+from email.utils import formatdate
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from dotenv import load_dotenv
 
+from .dedup_index import ConversionDedupIndex
+from .log_queue import attach_queue_handler
+from .postback_dispatcher import PostbackDispatcher
+from .visit_log import VisitLog
+
 # --- ⚙️ 1. ЗАГРУЗКА ИЗОЛИРОВАННОЙ КОНФИГУРАЦИИ ---
 # Определяем путь к .env файлу, который находится внутри этой же папки.
 # Это позволяет плагину иметь собственные, независимые настройки.
@@ -38,6 +49,8 @@ LOG_LEVEL = os.getenv("ADMITAD_LOG_LEVEL", "INFO").upper()
 LOG_FILENAME = os.getenv("ADMITAD_LOG_FILE", "admitad_tracker.log")
 LOG_MAX_BYTES = int(os.getenv("ADMITAD_LOG_MAX_BYTES", "5242880"))
 LOG_BACKUP_COUNT = int(os.getenv("ADMITAD_LOG_BACKUP_COUNT", "3"))
+# Доля DEBUG-записей, попадающих в лог (1.0 - все, 0.01 - каждая сотая).
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("ADMITAD_LOG_DEBUG_SAMPLE_RATE", "1.0"))
 
 # Создаем логгер с уникальным именем 'admitad_tracker',
 # чтобы не конфликтовать с логгерами рекламодателя.
@@ -55,8 +68,9 @@ handler = logging.handlers.RotatingFileHandler(
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 handler.setFormatter(formatter)
 
-# Добавляем наш файловый обработчик к логгеру.
-log.addHandler(handler)
+# Подключаем файловый обработчик через очередь: обработчики запросов только
+# ставят запись в очередь, а в файл её пишет отдельный поток.
+log_listener = attach_queue_handler(log, handler, LOG_DEBUG_SAMPLE_RATE)
 
 # ВАЖНО: отключаем "всплытие" логов к корневому логгеру.
 # Это гарантирует, что логи нашего плагина не попадут в общую консоль сервера.
@@ -76,6 +90,72 @@ DEFAULT_ACTION_CODE = os.getenv("DEFAULT_ACTION_CODE", "1")
 DEFAULT_TARIFF_CODE = os.getenv("DEFAULT_TARIFF_CODE", "1")
 DEFAULT_CURRENCY_CODE = os.getenv("DEFAULT_CURRENCY_CODE", "RUB")
 
+# Настройки доставки postback-запросов.
+POSTBACK_URL = os.getenv("ADMITAD_POSTBACK_URL", "https://ad.admitad.com/tt")
+POSTBACK_TIMEOUT = float(os.getenv("ADMITAD_POSTBACK_TIMEOUT", "10"))
+POSTBACK_CONCURRENCY = int(os.getenv("ADMITAD_POSTBACK_CONCURRENCY", "20"))
+POSTBACK_MAX_ATTEMPTS = int(os.getenv("ADMITAD_POSTBACK_MAX_ATTEMPTS", "8"))
+POSTBACK_RETRY_BASE_DELAY = float(os.getenv("ADMITAD_POSTBACK_RETRY_BASE_DELAY", "1"))
+POSTBACK_RETRY_MAX_DELAY = float(os.getenv("ADMITAD_POSTBACK_RETRY_MAX_DELAY", "300"))
+OUTBOX_FILENAME = os.getenv("ADMITAD_OUTBOX_FILE", "admitad_outbox.sqlite3")
+POSTBACK_BATCH_WINDOW_MS = float(os.getenv("ADMITAD_POSTBACK_BATCH_WINDOW_MS", "50"))
+POSTBACK_BATCH_MAX_SIZE = int(os.getenv("ADMITAD_POSTBACK_BATCH_MAX_SIZE", "100"))
+# Сколько секунд при остановке сервера ждать отправки постбэков в полёте.
+POSTBACK_DRAIN_TIMEOUT = float(os.getenv("ADMITAD_POSTBACK_DRAIN_TIMEOUT", "10"))
+
+# Заголовок Cache-Control для клиентского скрипта /s/main.js.
+SCRIPT_CACHE_CONTROL = os.getenv("ADMITAD_SCRIPT_CACHE_CONTROL", "public, max-age=3600")
+
+# Единый диспетчер postback-запросов: общий HTTP-клиент, ограничение
+# параллелизма, повторы и outbox, который переживает перезапуск сервера.
+# Секретный ключ в outbox не хранится - диспетчер подставляет его при отправке.
+dispatcher = PostbackDispatcher(
+    outbox_path=os.path.join(os.path.dirname(__file__), OUTBOX_FILENAME),
+    timeout=POSTBACK_TIMEOUT,
+    max_concurrency=POSTBACK_CONCURRENCY,
+    max_attempts=POSTBACK_MAX_ATTEMPTS,
+    retry_base_delay=POSTBACK_RETRY_BASE_DELAY,
+    retry_max_delay=POSTBACK_RETRY_MAX_DELAY,
+    batch_window=POSTBACK_BATCH_WINDOW_MS / 1000,
+    batch_max_size=POSTBACK_BATCH_MAX_SIZE,
+    drain_timeout=POSTBACK_DRAIN_TIMEOUT,
+    secret_params={"postback_key": ADMITAD_POSTBACK_KEY},
+)
+router.add_event_handler("startup", dispatcher.start)
+router.add_event_handler("shutdown", dispatcher.stop)
+
+# Индекс идемпотентности: повторная конверсия по тому же заказу
+# (или с тем же заголовком Idempotency-Key) не порождает второй postback.
+DEDUP_TTL_SECONDS = float(os.getenv("ADMITAD_DEDUP_TTL_SECONDS", str(7 * 86400)))
+DEDUP_MAX_ENTRIES = int(os.getenv("ADMITAD_DEDUP_MAX_ENTRIES", "1000000"))
+DEDUP_FILENAME = os.getenv("ADMITAD_DEDUP_FILE", "admitad_dedup.sqlite3")
+
+dedup_index = ConversionDedupIndex(
+    os.path.join(os.path.dirname(__file__), DEDUP_FILENAME),
+    ttl_seconds=DEDUP_TTL_SECONDS,
+    max_entries=DEDUP_MAX_ENTRIES,
+)
+
+# Журнал визитов /init-tracking: кольцевой буфер в памяти и фоновая
+# пакетная запись в SQLite (общий для всех воркеров файл).
+VISIT_LOG_FILENAME = os.getenv("ADMITAD_VISIT_LOG_FILE", "admitad_visits.sqlite3")
+VISIT_BUFFER_SIZE = int(os.getenv("ADMITAD_VISIT_BUFFER_SIZE", "10000"))
+VISIT_FLUSH_INTERVAL = float(os.getenv("ADMITAD_VISIT_FLUSH_INTERVAL", "1"))
+VISIT_FLUSH_BATCH_SIZE = int(os.getenv("ADMITAD_VISIT_FLUSH_BATCH_SIZE", "500"))
+VISIT_SAMPLE_RATE = float(os.getenv("ADMITAD_VISIT_SAMPLE_RATE", "1.0"))
+VISIT_RETENTION_DAYS = float(os.getenv("ADMITAD_VISIT_RETENTION_DAYS", str(COOKIE_LIFETIME_DAYS)))
+
+visit_log = VisitLog(
+    os.path.join(os.path.dirname(__file__), VISIT_LOG_FILENAME),
+    buffer_size=VISIT_BUFFER_SIZE,
+    flush_interval=VISIT_FLUSH_INTERVAL,
+    flush_batch_size=VISIT_FLUSH_BATCH_SIZE,
+    sample_rate=VISIT_SAMPLE_RATE,
+    retention_seconds=VISIT_RETENTION_DAYS * 86400,
+)
+router.add_event_handler("startup", visit_log.start)
+router.add_event_handler("shutdown", visit_log.stop)
+
 
 # --- 📦 4. МОДЕЛИ ДАННЫХ (PYDANTIC) ---
 # Модели Pydantic обеспечивают строгую валидацию
@@ -116,32 +196,7 @@ class TrackingEvent(BaseModel):
     currency: Optional[str] = Field(None, alias="currency")
 
 
-# --- 🛠️ 5. ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
-
-
-def send_postback_in_background(url: str, params: dict, order_id: str):
-    """
-    Отправляет GET-запрос (postback) в Admitad в фоновом режиме.
-    Это позволяет мгновенно отдать ответ пользователю,
-    не дожидаясь ответа от Admitad.
-    """
-    try:
-        params_for_log = params.copy()
-        if "postback_key" in params_for_log:
-            params_for_log["postback_key"] = "********"  # Маскируем ключ в логах
-        log.debug(f"ФОНОВАЯ ОТПРАВКА: URL: {url}, параметры: {params_for_log}")
-        # Для фоновых задач рекомендуется ставить более долгий таймаут
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()  # Вызовет ошибку, если HTTP-статус 4xx или 5xx
-        log.info(f"ФОНОВЫЙ ПОСТБЭК для заказа {order_id} успешно отправлен.")
-    except requests.exceptions.RequestException as e:
-        log.error(
-            f"ОШИБКА ФОНОВОГО ПОСТБЭКА: "
-            f"Не удалось отправить S2S Postback для заказа {order_id}: {e}"
-        )
-
-
-# --- 🚀 6. API-ЭНДПОИНТЫ ---
+# --- 🚀 5. API-ЭНДПОИНТЫ ---
 
 
 @router.post("/init-tracking", summary="Инициализация трекинга и установка cookie")
@@ -152,7 +207,8 @@ def initialize_tracking(params: TrackingParams, response: Response):
     Флаг HttpOnly делает cookie недоступными для чтения из JavaScript,
     что является ключевым элементом защиты от XSS-атак.
     """
-    log.debug(f"Инициализация трекинга с параметрами: {params.model_dump()}")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Инициализация трекинга с параметрами: %s", params.model_dump())
 
     # 1. Логика установки _adm_aid и _pid
     if params.admitad_uid:
@@ -189,19 +245,27 @@ def initialize_tracking(params: TrackingParams, response: Response):
             httponly=True,
             samesite="lax",
         )
-        log.info(f"Установлена cookie _last_source: {source}")
+        log.info("Установлена cookie _last_source: %s", source)
+
+    # 3. Журнал визитов: только запись в буфер, без обращения к диску.
+    visit_log.record(
+        admitad_uid=params.admitad_uid,
+        pid=params.pid,
+        utm_source=params.utm_source,
+        gclid=params.gclid,
+        fbclid=params.fbclid,
+        source=source,
+    )
 
     return {"status": "cookies initiated"}
 
 
-# --- 7. API-шлюз для приема данных от трекера ---
+# --- 6. API-шлюз для приема данных от трекера ---
 @router.post("/track-conversion", summary="API-шлюз для трекинга конверсий")
-async def track_conversion(
-    event: TrackingEvent, request: Request, background_tasks: BackgroundTasks
-):
+async def track_conversion(event: TrackingEvent, request: Request):
     """
     Принимает запрос, немедленно отвечает пользователю
-    и ставит отправку S2S Postback в фоновую очередь.
+    и ставит отправку S2S Postback в очередь диспетчера.
     """
     log.debug("--- Endpoint /api/track-conversion вызван ---")
     # 1. Извлекаем данные из безопасных HttpOnly cookie, установленных ранее.
@@ -209,17 +273,17 @@ async def track_conversion(
     source_from_cookie = request.cookies.get("_last_source")
     pid_from_cookie = request.cookies.get("_pid")
     log.debug(
-        f"Получены куки: "
-        f"_adm_aid='{uid_from_cookie}',"
-        f"_last_source='{source_from_cookie}',"
-        f"_pid='{pid_from_cookie}'"
+        "Получены куки: _adm_aid='%s',_last_source='%s',_pid='%s'",
+        uid_from_cookie,
+        source_from_cookie,
+        pid_from_cookie,
     )
 
     # 2. Формируем базовые параметры для postback-запроса.
-    postback_url = "https://ad.admitad.com/tt"
+    postback_url = POSTBACK_URL
     params = {
         "campaign_code": ADMITAD_CAMPAIGN_CODE,
-        "postback_key": ADMITAD_POSTBACK_KEY,
+        # postback_key добавляет диспетчер при отправке (см. secret_params)
         "channel": "admitad",
         "adm_method": "sr",
         "adm_method_name": "postback_sdk",
@@ -242,12 +306,11 @@ async def track_conversion(
         # Проверяем, переданы ли кастомные тарифы для каждого товара.
         if event.tariff_codes and len(event.tariff_codes) == position_count:
             final_tariff_codes = event.tariff_codes
-            log.debug(f"Используются кастомные тарифы: {final_tariff_codes}")
+            log.debug("Используются кастомные тарифы: %s", final_tariff_codes)
         else:
             final_tariff_codes = [DEFAULT_TARIFF_CODE] * position_count
             log.debug(
-                f"Используется дефолтное значение для тарифов: "
-                f"{final_tariff_codes}"
+                "Используется дефолтное значение для тарифов: %s", final_tariff_codes
             )
 
         admitad_basket = {
@@ -282,36 +345,112 @@ async def track_conversion(
                            and event.promocode.strip() else "cookie"
         )
         log.info(
-            f"Атрибуция Admitad подтверждена по "
-            f"{attribution_reason} для заказа {event.order_id}. "
-            f"Планирование постбэка..."
-        )
-        background_tasks.add_task(
-            send_postback_in_background, postback_url, params, event.order_id
+            "Атрибуция Admitad подтверждена по %s для заказа %s. "
+            "Планирование постбэка...",
+            attribution_reason,
+            event.order_id,
         )
+        # 5. ИДЕМПОТЕНТНОСТЬ: повторный запрос по тому же заказу
+        # завершается здесь, до любой исходящей работы.
+        idempotency_keys = [f"order:{event.order_id}"]
+        idempotency_header = request.headers.get("idempotency-key")
+        if idempotency_header:
+            idempotency_keys.append(f"key:{idempotency_header}")
+        # Проверка идёт в пуле потоков: BEGIN IMMEDIATE может ждать
+        # блокировку SQLite, занятую другим воркером.
+        if not await run_in_threadpool(dedup_index.claim, *idempotency_keys):
+            log.info(
+                "ИДЕМПОТЕНТНОСТЬ: постбэк для заказа %s уже был "
+                "запланирован ранее. Повторный запрос проигнорирован.",
+                event.order_id,
+            )
+            return {"status": "duplicate", "message": "Postback already scheduled."}
+        try:
+            await dispatcher.submit(postback_url, params, event.order_id)
+        except Exception:
+            # Постбэк не сохранён - освобождаем ключи, чтобы повтор клиента
+            # не был отброшен как дубль.
+            await run_in_threadpool(dedup_index.release, *idempotency_keys)
+            raise
         return {"status": "success", "message": "Postback scheduled."}
     else:
         # Если условие не выполнено, postback не отправляется.
         log.debug("Условие для отправки постбэка НЕ ВЫПОЛНЕНО.")
         log.info(
-            f"ДЕДУПЛИКАЦИЯ: "
-            f"Конверсия для UID '{uid_from_cookie}' "
-            f"атрибуцирована источнику '{source_from_cookie}'. "
-            f"Постбэк не отправлен."
+            "ДЕДУПЛИКАЦИЯ: Конверсия для UID '%s' атрибуцирована источнику '%s'. "
+            "Постбэк не отправлен.",
+            uid_from_cookie,
+            source_from_cookie,
         )
         return {"status": "deduplicated", "source": source_from_cookie}
 
 
+# --- Состояние очереди постбэков ---
+@router.get("/postback-stats", summary="Состояние очереди постбэков")
+def get_postback_stats():
+    """
+    Отдает глубину очереди, размер последней пачки и задержку её отправки,
+    а также число недоставленных запросов в outbox.
+    """
+    return {**dispatcher.stats(), "outbox_pending": dispatcher.pending_count()}
+
+
+# --- Журнал визитов ---
+@router.get("/visits/{admitad_uid}", summary="Визиты по admitad_uid")
+def get_visits(admitad_uid: str, limit: int = Query(100, ge=1, le=1000)):
+    """
+    Отдает визиты с этим admitad_uid от новых к старым: когда и с какими
+    pid / utm_source / gclid / fbclid пользователь приходил на сайт.
+    """
+    visits = visit_log.visits_for(admitad_uid, limit=limit)
+    return {"admitad_uid": admitad_uid, "count": len(visits), "visits": visits}
+
+
+@router.get("/visit-stats", summary="Состояние журнала визитов")
+def get_visit_stats():
+    """Отдает заполненность буфера, число вытесненных и записанных визитов."""
+    return visit_log.stats()
+
+
 # --- Эндпоинт для отдачи самого JS-трекера ---
+# Путь к файлу int_loader.js относительно текущего файла (admitad_integration.py)
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "assets", "int_loader.js")
+# Кэш скрипта в памяти: (mtime, содержимое, ETag). Перечитывается при изменении файла.
+_script_cache = None
+
+
+def _load_tracker_script():
+    """Возвращает содержимое int_loader.js и его ETag, перечитывая файл при изменении."""
+    global _script_cache
+    mtime = os.stat(SCRIPT_PATH).st_mtime
+    if _script_cache is None or _script_cache[0] != mtime:
+        with open(SCRIPT_PATH, "rb") as f:
+            content = f.read()
+        etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+        _script_cache = (mtime, content, etag)
+    return _script_cache
+
+
 @router.get("/main.js", summary="Отдача клиентского JS-трекера")
-def get_tracker_script():
+def get_tracker_script(request: Request):
     """
     Этот эндпоинт отдает файл int_loader.js. Размещение скрипта на том же домене,
     что и основной сайт (first-party), значительно повышает его устойчивость
     к блокировщикам рекламы и ITP-механизмам браузеров.
+    Ответ содержит ETag и Cache-Control; при совпадении If-None-Match
+    возвращается 304 без тела.
     """
-    # Путь к файлу int_loader.js относительно текущего файла (admitad_integration.py)
-    script_path = os.path.join(os.path.dirname(__file__), "assets", "int_loader.js")
-    if os.path.exists(script_path):
-        return FileResponse(script_path, media_type="application/javascript")
-    raise HTTPException(status_code=404, detail="int_loader.js not found")
+    try:
+        mtime, content, etag = _load_tracker_script()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="int_loader.js not found")
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": SCRIPT_CACHE_CONTROL,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content, media_type="application/javascript", headers=headers)
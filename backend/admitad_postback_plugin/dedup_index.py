@@ -0,0 +1,168 @@
+"""
+@file Admitad Conversion Dedup Index
+@description Индекс идемпотентности для /s/track-conversion.
+Хранит ключи уже принятых конверсий (order_id и, если передан, заголовок
+Idempotency-Key) с ограниченным сроком жизни, чтобы повторный запрос с тем же
+заказом не приводил к повторному postback-запросу в Admitad.
+Индекс хранится в SQLite и поэтому общий для всех воркеров сервера.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+log = logging.getLogger("admitad_tracker")
+
+
+class ConversionDedupIndex:
+    """
+    Ограниченный по размеру индекс ключей с TTL.
+
+    Перед SQLite стоит небольшой локальный кэш ключей, занятых этим
+    воркером, поэтому частые повторы (перезагрузка страницы подтверждения)
+    отсекаются без обращения к диску. Решение "ключ новый" принимается только атомарной
+    вставкой в SQLite, чтобы два воркера не приняли один заказ дважды.
+    """
+
+    # Как часто (в числе новых ключей) чистить просроченные и лишние записи.
+    EVICT_EVERY = 1000
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: float = 7 * 86400,
+        max_entries: int = 1_000_000,
+        local_cache_size: int = 10_000,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.local_cache_size = max(1, local_cache_size)
+        self._lock = threading.Lock()
+        self._local: "OrderedDict[str, float]" = OrderedDict()
+        self._claims_since_evict = 0
+        self._db = self._open()
+        if hasattr(os, "register_at_fork"):
+            # Соединение SQLite нельзя использовать в двух процессах:
+            # воркер после fork открывает собственное.
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _open(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS seen_keys ("
+            "key TEXT PRIMARY KEY, created_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS seen_keys_created ON seen_keys (created_at)")
+        return db
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._db = self._open()
+
+    def claim(self, *keys: str) -> bool:
+        """
+        Пытается занять все ключи. Возвращает False, если хотя бы один из
+        них уже занят и не просрочен (то есть запрос - дубликат).
+        """
+        now = time.time()
+        with self._lock:
+            if any(self._local_hit(key, now) for key in keys):
+                return False
+            try:
+                conflict = self._claim_in_store(keys, now)
+            except sqlite3.Error as e:
+                # При сбое хранилища пропускаем конверсию: потерять её хуже,
+                # чем отправить дубль (Admitad также сверяет order_id).
+                log.error("Ошибка индекса дедупликации: %s. Проверка пропущена.", e)
+                return True
+            if conflict is not None:
+                # Чужой ключ в локальный кэш не попадает: занявший его воркер
+                # может освободить ключ (release), а кэш этого воркера
+                # об этом не узнает.
+                return False
+            for key in keys:
+                self._remember(key, now)
+            self._claims_since_evict += 1
+            if self._claims_since_evict >= self.EVICT_EVERY:
+                self._evict(now)
+            return True
+
+    def release(self, *keys: str):
+        """
+        Освобождает ключи, занятые claim(), если конверсию не удалось
+        поставить в очередь: иначе повтор клиента считался бы дублем.
+        """
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+            try:
+                self._db.executemany(
+                    "DELETE FROM seen_keys WHERE key = ?", [(key,) for key in keys]
+                )
+            except sqlite3.Error as e:
+                log.error("Ошибка освобождения ключей дедупликации %s: %s", keys, e)
+
+    def _claim_in_store(self, keys, now: float) -> Optional[Tuple[str, float]]:
+        """
+        Атомарно занимает ключи. Возвращает None при успехе или
+        (ключ, время занятия) первого уже занятого ключа.
+        """
+        expired_before = now - self.ttl_seconds
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for key in keys:
+                row = self._db.execute(
+                    "SELECT created_at FROM seen_keys WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[0] >= expired_before:
+                    self._db.execute("ROLLBACK")
+                    return key, row[0]
+            self._db.executemany(
+                "INSERT OR REPLACE INTO seen_keys (key, created_at) VALUES (?, ?)",
+                [(key, now) for key in keys],
+            )
+            self._db.execute("COMMIT")
+            return None
+        except BaseException:
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+            raise
+
+    def _local_hit(self, key: str, now: float) -> bool:
+        seen_at = self._local.get(key)
+        if seen_at is None:
+            return False
+        if seen_at < now - self.ttl_seconds:
+            del self._local[key]
+            return False
+        self._local.move_to_end(key)
+        return True
+
+    def _remember(self, key: str, created_at: float):
+        self._local[key] = created_at
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_cache_size:
+            self._local.popitem(last=False)
+
+    def _evict(self, now: float):
+        """Удаляет просроченные ключи и самые старые ключи сверх лимита."""
+        self._claims_since_evict = 0
+        try:
+            self._db.execute(
+                "DELETE FROM seen_keys WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+            self._db.execute(
+                "DELETE FROM seen_keys WHERE key IN ("
+                "SELECT key FROM seen_keys ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        except sqlite3.Error as e:
+            log.error("Ошибка очистки индекса дедупликации: %s", e)
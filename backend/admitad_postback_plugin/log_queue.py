@@ -0,0 +1,54 @@
+"""
+@file Admitad Log Queue
+@description Неблокирующая запись лога плагина.
+Обработчики событий (track_conversion и др.) только кладут запись в очередь
+в памяти, а запись в файл с ротацией выполняет отдельный поток
+QueueListener. Так задержки диска не превращаются в задержку ответа.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+
+class DebugSampler(logging.Filter):
+    """
+    Пропускает только долю `rate` записей уровня DEBUG.
+    Записи уровня INFO и выше проходят всегда.
+    Этот же фильтр использует логирование приложения (logging_setup).
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = min(max(rate, 0.0), 1.0)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+def attach_queue_handler(
+    logger: logging.Logger, handler: logging.Handler, debug_sample_rate: float = 1.0
+) -> logging.handlers.QueueListener:
+    """
+    Подключает `handler` к логгеру через очередь и запускает фоновый поток
+    записи. Поток останавливается (с дозаписью очереди) при выходе из процесса
+    и перезапускается в дочернем процессе после fork.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(debug_sample_rate))
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(
+        log_queue, handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=listener.start)
+    return listener
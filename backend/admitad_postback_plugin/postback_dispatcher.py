@@ -0,0 +1,464 @@
+"""
+@file Admitad Postback Dispatcher
+@description Надёжная доставка S2S postback-запросов в Admitad.
+1. Все запросы идут через один общий httpx.AsyncClient с keep-alive соединениями.
+2. Количество одновременных запросов ограничено семафором.
+3. Неудачные запросы повторяются с экспоненциальной задержкой.
+4. Каждый postback сначала записывается в outbox (SQLite), поэтому
+   недоставленные запросы переживают перезапуск сервера. Секретные параметры
+   (postback_key) в outbox не сохраняются и подставляются при отправке.
+5. Запросы копятся в коротком окне (по времени или размеру) и отправляются
+   пачкой; повторы одного заказа внутри окна схлопываются в один запрос.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional, Set, Tuple
+
+import httpx
+
+log = logging.getLogger("admitad_tracker")
+
+
+def mask_params(params: dict) -> dict:
+    """Возвращает копию параметров с замаскированным секретным ключом."""
+    params_for_log = params.copy()
+    if "postback_key" in params_for_log:
+        params_for_log["postback_key"] = "********"
+    return params_for_log
+
+
+class PostbackDispatcher:
+    """
+    Диспетчер postback-запросов с персистентным outbox.
+
+    Запись в outbox имеет "аренду" (locked_by / locked_until): запрос берёт
+    в работу только тот процесс, который его арендовал, поэтому несколько
+    воркеров uvicorn могут работать с одним файлом outbox без дублей.
+    Аренда продлевается непосредственно перед отправкой (после ожидания
+    семафора); если за время ожидания её перехватил другой воркер, запрос
+    не отправляется. Из outbox процесс забирает не больше
+    `batch_max_size + max_concurrency` записей сверх тех, что уже в работе,
+    и никогда не арендует повторно свои же записи.
+
+    Отправка идёт микро-пачками: новые записи попадают в текущее окно,
+    которое сбрасывается через `batch_window` секунд после первой записи
+    или сразу при накоплении `batch_max_size` записей. Это сглаживает
+    всплески исходящих запросов во время пиков распродаж.
+
+    При остановке (stop) диспетчер досылает окно и записи outbox, срок
+    которых пришёл, и ждёт запросы в полёте не дольше `drain_timeout`
+    секунд. Всё, что не успело уйти, остаётся в outbox.
+
+    Параметры из `secret_params` (например, postback_key) не пишутся
+    в outbox: при сохранении они удаляются из запроса, а при отправке
+    подставляются текущие значения.
+
+    Если задан `on_attempt`, он вызывается после каждой попытки отправки
+    с результатом ("sent", "retry" или "dead") и её длительностью в секундах -
+    так приложение снимает метрики, не связывая плагин со своим кодом.
+    """
+
+    def __init__(
+        self,
+        outbox_path: str,
+        timeout: float = 10.0,
+        max_concurrency: int = 20,
+        max_attempts: int = 8,
+        retry_base_delay: float = 1.0,
+        retry_max_delay: float = 300.0,
+        poll_interval: float = 5.0,
+        batch_window: float = 0.05,
+        batch_max_size: int = 100,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        on_attempt: Optional[Callable[[str, float], None]] = None,
+        drain_timeout: Optional[float] = 10.0,
+        secret_params: Optional[Dict[str, str]] = None,
+    ):
+        self.outbox_path = outbox_path
+        self.timeout = timeout
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.poll_interval = poll_interval
+        self.batch_window = batch_window
+        self.batch_max_size = max(1, batch_max_size)
+        self.lease_seconds = timeout * 2 + batch_window + 5
+        self._transport = transport
+        self.on_attempt = on_attempt
+        self.drain_timeout = drain_timeout
+        self.secret_params = dict(secret_params or {})
+        self._token = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._db_lock = threading.Lock()
+        self._db = self._open_outbox()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._sweeper: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+        # ID записей outbox, которые этот процесс арендовал и ещё не завершил.
+        self._leased: Set[int] = set()
+        self.max_leased = self.batch_max_size + self.max_concurrency
+        # Текущее окно: order_id -> (id записи, url, параметры, попытки).
+        self._batch: Dict[str, Tuple[int, str, dict, int]] = {}
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._stats = {
+            "batches_flushed": 0,
+            "postbacks_attempted": 0,
+            "postbacks_coalesced": 0,
+            "last_batch_size": 0,
+            "last_flush_latency_ms": 0.0,
+            "max_batch_size": 0,
+        }
+
+    # --- Жизненный цикл ---
+
+    async def start(self):
+        """Создаёт общий HTTP-клиент и запускает фоновую досылку из outbox."""
+        self._ensure_running()
+
+    async def stop(self):
+        """
+        Досылает накопленное окно и записи outbox, срок которых пришёл,
+        дожидается запросов в полёте (не дольше drain_timeout) и закрывает
+        HTTP-клиент.
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        if self._client is not None:
+            try:
+                await self._dispatch_due()
+            except sqlite3.Error as e:
+                log.error("Ошибка чтения outbox постбэков: %s", e)
+        self._flush()
+        if self._inflight:
+            _, unfinished = await asyncio.wait(list(self._inflight), timeout=self.drain_timeout)
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                # Аренда записей истечёт, и их дошлёт следующий запуск.
+                log.warning(
+                    "Остановка: %d пачек постбэков не успели отправиться и остались в outbox.",
+                    len(unfinished),
+                )
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _after_fork(self):
+        """
+        В дочернем процессе (воркер после fork) нужны своё соединение
+        с outbox и свой токен аренды: иначе воркеры считали бы чужие
+        арендованные записи своими.
+        """
+        self._token = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._db_lock = threading.Lock()
+        self._db = self._open_outbox()
+
+    def _ensure_running(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                transport=self._transport,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+
+    # --- Публичный API ---
+
+    async def submit(self, url: str, params: dict, order_id: str) -> int:
+        """
+        Сохраняет postback в outbox и ставит его в текущее окно отправки.
+        Возвращает ID записи в outbox. Запись в outbox идёт в потоке:
+        SQLite может ждать блокировку другого воркера до busy_timeout.
+        """
+        self._ensure_running()
+        entry_id = await asyncio.to_thread(self._insert, url, params, str(order_id))
+        self._leased.add(entry_id)
+        await self._enqueue(entry_id, url, params, str(order_id), 0)
+        return entry_id
+
+    def _insert(self, url: str, params: dict, order_id: str) -> int:
+        now = time.time()
+        with self._db_lock:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (order_id, url, params, attempts, next_attempt_at, "
+                "created_at, locked_by, locked_until) VALUES (?, ?, ?, 0, ?, ?, ?, ?)",
+                (
+                    order_id,
+                    url,
+                    json.dumps(self._without_secrets(params), ensure_ascii=False),
+                    now,
+                    now,
+                    self._token,
+                    now + self.lease_seconds,
+                ),
+            )
+            return cursor.lastrowid
+
+    def pending_count(self) -> int:
+        """Количество недоставленных postback-запросов в outbox."""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status = 'pending'"
+            ).fetchone()
+        return row[0]
+
+    def stats(self) -> dict:
+        """Состояние очереди: глубина, размер пачек и задержка их отправки."""
+        return {
+            **self._stats,
+            "queue_depth": len(self._batch),
+            "inflight_batches": len(self._inflight),
+            "leased_entries": len(self._leased),
+        }
+
+    # --- Микро-пачки ---
+
+    async def _enqueue(
+        self, entry_id: int, url: str, params: dict, order_id: str, attempts: int
+    ):
+        """Добавляет запись в текущее окно, схлопывая повторы одного заказа."""
+        if order_id in self._batch:
+            # Тот же заказ уже ждёт отправки в этом окне - второй запрос не нужен.
+            self._leased.discard(entry_id)
+            self._stats["postbacks_coalesced"] += 1
+            await asyncio.to_thread(self._execute, "DELETE FROM outbox WHERE id = ?", (entry_id,))
+            return
+        self._batch[order_id] = (entry_id, url, params, attempts)
+        if len(self._batch) >= self.batch_max_size:
+            self._flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush
+            )
+
+    def _flush(self):
+        """Отправляет накопленное окно одной пачкой."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, {}
+        task = asyncio.get_running_loop().create_task(self._send_batch(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send_batch(self, batch: Dict[str, Tuple[int, str, dict, int]]):
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(
+                self._attempt(entry_id, url, params, order_id, attempts)
+                for order_id, (entry_id, url, params, attempts) in batch.items()
+            ),
+            return_exceptions=True,
+        )
+        latency_ms = (time.perf_counter() - started) * 1000
+        self._stats["batches_flushed"] += 1
+        self._stats["postbacks_attempted"] += len(batch)
+        self._stats["last_batch_size"] = len(batch)
+        self._stats["last_flush_latency_ms"] = round(latency_ms, 2)
+        self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(batch))
+        log.debug("Отправлена пачка постбэков: %d шт. за %.1f мс", len(batch), latency_ms)
+
+    # --- Доставка ---
+
+    async def _attempt(self, entry_id: int, url: str, params: dict, order_id: str, attempts: int):
+        """Одна попытка отправки. При ошибке планирует повтор в outbox."""
+        try:
+            await self._attempt_leased(entry_id, url, params, order_id, attempts)
+        finally:
+            self._leased.discard(entry_id)
+
+    async def _attempt_leased(
+        self, entry_id: int, url: str, params: dict, order_id: str, attempts: int
+    ):
+        query = {k: v for k, v in {**params, **self.secret_params}.items() if v is not None}
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("ФОНОВАЯ ОТПРАВКА: URL: %s, параметры: %s", url, mask_params(params))
+        retryable = True
+        started = time.perf_counter()
+        try:
+            async with self._semaphore:
+                if not await asyncio.to_thread(self._renew_lease, entry_id):
+                    log.warning(
+                        "Аренда постбэка для заказа %s истекла и перехвачена, "
+                        "отправка пропущена.",
+                        order_id,
+                    )
+                    return
+                response = await self._client.get(url, params=query)
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            retryable = status >= 500 or status == 429
+            error = f"HTTP {status}"
+        except httpx.HTTPError as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            await asyncio.to_thread(self._execute, "DELETE FROM outbox WHERE id = ?", (entry_id,))
+            self._report("sent", started)
+            log.info("ФОНОВЫЙ ПОСТБЭК для заказа %s успешно отправлен.", order_id)
+            return
+
+        attempts += 1
+        if not retryable or attempts >= self.max_attempts:
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ?, "
+                "locked_by = NULL, locked_until = NULL WHERE id = ?",
+                (attempts, error, entry_id),
+            )
+            self._report("dead", started)
+            log.error(
+                "ОШИБКА ФОНОВОГО ПОСТБЭКА: "
+                "Не удалось отправить S2S Postback для заказа %s "
+                "после %d попыток: %s. Запрос оставлен в outbox.",
+                order_id,
+                attempts,
+                error,
+            )
+            return
+
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempts - 1))
+        delay *= random.uniform(0.8, 1.2)
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, "
+            "locked_by = NULL, locked_until = NULL WHERE id = ?",
+            (attempts, time.time() + delay, error, entry_id),
+        )
+        self._report("retry", started)
+        log.warning(
+            "Постбэк для заказа %s не отправлен (%s), попытка %d/%d. Повтор через %.1f с.",
+            order_id,
+            error,
+            attempts,
+            self.max_attempts,
+            delay,
+        )
+
+    def _report(self, outcome: str, started: float):
+        if self.on_attempt is None:
+            return
+        try:
+            self.on_attempt(outcome, time.perf_counter() - started)
+        except Exception as e:
+            log.debug("Ошибка обработчика on_attempt: %s", e)
+
+    async def _sweep_loop(self):
+        """Периодически забирает из outbox запросы, время повтора которых пришло."""
+        while True:
+            try:
+                await self._dispatch_due()
+            except sqlite3.Error as e:
+                log.error("Ошибка чтения outbox постбэков: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _dispatch_due(self):
+        """Арендует записи outbox, срок которых пришёл, и ставит их в окно отправки."""
+        free_slots = self.max_leased - len(self._leased)
+        if free_slots <= 0:
+            return
+        # Запросы к SQLite - в потоке: под нагрузкой они ждут блокировку
+        # других воркеров и не должны останавливать цикл событий.
+        rows = await asyncio.to_thread(self._lease_due, list(self._leased), free_slots)
+        for entry_id, url, params, order_id, attempts in rows:
+            self._leased.add(entry_id)
+            await self._enqueue(entry_id, url, json.loads(params), order_id, attempts)
+
+    def _lease_due(self, leased: list, limit: int) -> list:
+        now = time.time()
+        lease_until = now + self.lease_seconds
+        with self._db_lock:
+            self._db.execute(
+                "UPDATE outbox SET locked_by = ?, locked_until = ? WHERE id IN ("
+                "SELECT id FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                "AND (locked_until IS NULL OR locked_until < ?) "
+                "AND id NOT IN (SELECT value FROM json_each(?)) "
+                "ORDER BY next_attempt_at LIMIT ?)",
+                (self._token, lease_until, now, now, json.dumps(leased), limit),
+            )
+            return self._db.execute(
+                "SELECT id, url, params, order_id, attempts FROM outbox "
+                "WHERE locked_by = ? AND locked_until = ?",
+                (self._token, lease_until),
+            ).fetchall()
+
+    # --- Outbox (SQLite) ---
+
+    def _without_secrets(self, params: dict) -> dict:
+        return {k: v for k, v in params.items() if k not in self.secret_params}
+
+    def _open_outbox(self) -> sqlite3.Connection:
+        db = sqlite3.connect(
+            self.outbox_path, isolation_level=None, check_same_thread=False
+        )
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "order_id TEXT NOT NULL, "
+            "url TEXT NOT NULL, "
+            "params TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "last_error TEXT, "
+            "locked_by TEXT, "
+            "locked_until REAL)"
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)"
+        )
+        for name in self.secret_params:
+            # Записи, сохранённые прежними версиями вместе с секретом.
+            path = "$." + json.dumps(name)
+            db.execute(
+                "UPDATE outbox SET params = json_remove(params, ?) "
+                "WHERE json_type(params, ?) IS NOT NULL",
+                (path, path),
+            )
+        return db
+
+    def _renew_lease(self, entry_id: int) -> bool:
+        """
+        Продлевает аренду записи перед отправкой. False - запись уже
+        арендована другим процессом или удалена (отправлять нельзя).
+        """
+        try:
+            with self._db_lock:
+                cursor = self._db.execute(
+                    "UPDATE outbox SET locked_until = ? "
+                    "WHERE id = ? AND locked_by = ? AND status = 'pending'",
+                    (time.time() + self.lease_seconds, entry_id, self._token),
+                )
+        except sqlite3.Error as e:
+            # Без продления аренды запрос не отправляется: запись останется
+            # в outbox и будет отправлена после истечения аренды.
+            log.error("Ошибка продления аренды постбэка: %s", e)
+            return False
+        return cursor.rowcount == 1
+
+    def _execute(self, sql: str, args: tuple):
+        with self._db_lock:
+            self._db.execute(sql, args)
@@ -0,0 +1,287 @@
+"""
+@file Admitad Visit Log
+@description Журнал визитов для /s/init-tracking: параметры перехода
+(admitad_uid, pid, utm_source, gclid, fbclid) и время визита, чтобы
+атрибуцию можно было проверить задним числом.
+Обработчик запроса только кладёт визит в кольцевой буфер в памяти;
+в SQLite визиты пишет отдельный поток пачками (одна транзакция на пачку).
+"""
+
+import atexit
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+log = logging.getLogger("admitad_tracker")
+
+VISIT_FIELDS = ("ts", "admitad_uid", "pid", "utm_source", "gclid", "fbclid", "source")
+
+# Визит в буфере: кортеж значений в порядке VISIT_FIELDS и последним -
+# visit_id, уникальный идентификатор визита (по нему visits_for убирает
+# визит, попавший и в память, и в базу).
+Visit = Tuple[Any, ...]
+_STORED_FIELDS = VISIT_FIELDS + ("visit_id",)
+
+# json_extract, а не оператор ->>: тот появился только в SQLite 3.38.
+_INSERT_BATCH = (
+    f"INSERT INTO visits ({', '.join(_STORED_FIELDS)}) SELECT "
+    + ", ".join(f"json_extract(value, '$[{i}]')" for i in range(len(_STORED_FIELDS)))
+    + " FROM json_each(?)"
+)
+
+
+class VisitLog:
+    """
+    Кольцевой буфер визитов с фоновой пакетной записью.
+
+    - Выборка: визиты без admitad_uid сохраняются с долей `sample_rate`;
+      визиты с admitad_uid сохраняются всегда - по ним проверяется атрибуция.
+    - Противодавление: буфер ограничен `buffer_size`. При заполнении
+      на `flush_batch_size` поток записи будится раньше срока, а если диск
+      не успевает и буфер полон, вытесняются самые старые визиты (счётчик
+      dropped). Обработчик запроса никогда не ждёт диска.
+    - Хранилище только дополняется; визиты старше `retention_seconds`
+      периодически удаляются.
+    """
+
+    # Как часто (в числе записанных пачек) удалять просроченные визиты.
+    PRUNE_EVERY = 100
+
+    def __init__(
+        self,
+        path: str,
+        buffer_size: int = 10_000,
+        flush_interval: float = 1.0,
+        flush_batch_size: int = 500,
+        sample_rate: float = 1.0,
+        retention_seconds: float = 90 * 86400,
+    ):
+        self.path = path
+        self.buffer_size = max(1, buffer_size)
+        self.flush_interval = flush_interval
+        self.flush_batch_size = max(1, flush_batch_size)
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.retention_seconds = retention_seconds
+        self._stats = {
+            "recorded": 0,
+            "sampled_out": 0,
+            "dropped": 0,
+            "flushed": 0,
+            "flush_errors": 0,
+            "last_flush_size": 0,
+            "last_flush_ms": 0.0,
+        }
+        self._init_state()
+        self._create_schema()
+        atexit.register(self.stop)
+        if hasattr(os, "register_at_fork"):
+            # Поток записи не переживает fork: воркер запускает свой,
+            # а визиты из буфера родителя остаются родителю.
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _init_state(self):
+        self._lock = threading.Lock()
+        self._buffer: "deque[Visit]" = deque(maxlen=self.buffer_size)
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        # Пачка, которую не удалось записать: повторяется перед следующей.
+        self._pending: List[Visit] = []
+        # Пачка, которая пишется сейчас: видна в visits_for до COMMIT.
+        self._flushing: List[Visit] = []
+        self._batches_since_prune = 0
+        # Соединения для чтения и для flush() вне потока записи - по одному на поток.
+        self._local = threading.local()
+
+    def _after_fork(self):
+        started = self._thread is not None
+        self._init_state()
+        for key in self._stats:
+            self._stats[key] = 0
+        if started:
+            self.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, isolation_level=None)
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        return db
+
+    def _conn(self) -> sqlite3.Connection:
+        """Соединение этого потока (создаётся при первом обращении)."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    def _create_schema(self):
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS visits ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "ts REAL NOT NULL, admitad_uid TEXT, pid TEXT, utm_source TEXT, "
+                "gclid TEXT, fbclid TEXT, source TEXT, visit_id TEXT)"
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(visits)")}
+            if "visit_id" not in columns:
+                # Журнал прежней версии: у старых визитов visit_id пустой.
+                db.execute("ALTER TABLE visits ADD COLUMN visit_id TEXT")
+            db.execute("CREATE INDEX IF NOT EXISTS visits_uid ON visits (admitad_uid, ts)")
+            db.execute("CREATE INDEX IF NOT EXISTS visits_ts ON visits (ts)")
+        finally:
+            db.close()
+
+    # --- Запись визита (в обработчике запроса) ---
+
+    def record(
+        self,
+        admitad_uid: Optional[str] = None,
+        pid: Optional[str] = None,
+        utm_source: Optional[str] = None,
+        gclid: Optional[str] = None,
+        fbclid: Optional[str] = None,
+        source: Optional[str] = None,
+    ) -> bool:
+        """Кладёт визит в буфер. Возвращает False, если визит не попал в выборку."""
+        if not admitad_uid and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            with self._lock:
+                self._stats["sampled_out"] += 1
+            return False
+        visit = (
+            time.time(), admitad_uid, pid, utm_source, gclid, fbclid, source, uuid.uuid4().hex
+        )
+        with self._lock:
+            if len(self._buffer) == self.buffer_size:
+                self._stats["dropped"] += 1
+            self._buffer.append(visit)
+            self._stats["recorded"] += 1
+            backlog = len(self._buffer)
+        if backlog >= self.flush_batch_size:
+            self._wakeup.set()
+        return True
+
+    # --- Фоновая запись ---
+
+    def start(self):
+        """Запускает поток записи (повторный вызов ничего не делает)."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="admitad-visit-log", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает поток записи и дописывает всё, что осталось в буфере."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        else:
+            self.flush()
+
+    def _run(self):
+        db = self._connect()
+        try:
+            while True:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                stopping = self._stopping
+                self.flush(db)
+                if stopping:
+                    return
+        finally:
+            db.close()
+
+    def flush(self, db: Optional[sqlite3.Connection] = None):
+        """Записывает буфер в SQLite одной транзакцией на пачку."""
+        with self._lock:
+            batch = self._pending + list(self._buffer)
+            self._buffer.clear()
+            self._pending = []
+            self._flushing = batch
+        if not batch:
+            return
+        if db is None:
+            db = self._conn()
+        started = time.perf_counter()
+        try:
+            # Вся пачка - один оператор над JSON-массивом: executemany
+            # отпускает и заново захватывает GIL на каждой строке и под
+            # нагрузкой ждёт потоки обработчиков запросов.
+            db.execute(_INSERT_BATCH, (json.dumps(batch),))
+            self._batches_since_prune += 1
+            if self._batches_since_prune >= self.PRUNE_EVERY:
+                self._prune(db)
+        except sqlite3.Error as e:
+            with self._lock:
+                self._stats["flush_errors"] += 1
+                # Повторим при следующей записи; сверх размера буфера - не держим.
+                self._pending = batch[-self.buffer_size:]
+                self._flushing = []
+            log.error("Ошибка записи журнала визитов (%d визитов): %s", len(batch), e)
+            return
+        with self._lock:
+            self._flushing = []
+            self._stats["flushed"] += len(batch)
+            self._stats["last_flush_size"] = len(batch)
+            self._stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    def _prune(self, db: sqlite3.Connection):
+        self._batches_since_prune = 0
+        db.execute("DELETE FROM visits WHERE ts < ?", (time.time() - self.retention_seconds,))
+
+    # --- Чтение ---
+
+    def visits_for(self, admitad_uid: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Визиты с этим admitad_uid от новых к старым, включая ещё
+        не записанные на диск визиты из буфера этого процесса.
+        """
+        # Сначала память, потом база: визит, записанный между этими
+        # чтениями, попадёт в оба списка - повтор убирается по visit_id
+        # (время визита не уникально).
+        with self._lock:
+            buffered = [
+                v
+                for visits in (self._buffer, self._flushing, self._pending)
+                for v in visits
+                if v[1] == admitad_uid
+            ]
+        buffered.sort(key=lambda v: v[0], reverse=True)
+        stored = self._conn().execute(
+            f"SELECT {', '.join(_STORED_FIELDS)} "
+            "FROM visits WHERE admitad_uid = ? ORDER BY ts DESC LIMIT ?",
+            (admitad_uid, limit),
+        ).fetchall()
+        visits = []
+        seen = set()
+        for visit in sorted(buffered[:limit] + stored, key=lambda v: v[0], reverse=True):
+            visit_id = visit[-1]
+            if visit_id is not None:
+                if visit_id in seen:
+                    continue
+                seen.add(visit_id)
+            visits.append(dict(zip(VISIT_FIELDS, visit)))
+            if len(visits) == limit:
+                break
+        return visits
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "buffered": len(self._buffer),
+                "flushing": len(self._flushing),
+                "pending_retry": len(self._pending),
+                "buffer_size": self.buffer_size,
+                "sample_rate": self.sample_rate,
+            }
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, HTTPException
+from backend.models import CartQuoteRequest
+from backend.services import pricing
+
+router = APIRouter()
+
+
+@router.post("/cart/quote", summary="Рассчитать корзину по ценам каталога")
+async def quote_cart(request: CartQuoteRequest):
+    """
+    Возвращает цены позиций и итог корзины, рассчитанные на сервере
+    одним запросом для всей корзины.
+    """
+    try:
+        quote = pricing.quote_cart((item.product_id, item.quantity) for item in request.items)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return pricing.quote_to_json(quote)
@@ -0,0 +1,176 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+from backend.services import compression
+
+# Тела больше этого размера сжимаются в пуле потоков, а не в цикле событий.
+_THREAD_THRESHOLD = 256 * 1024
+
+
+class CompressedBodyCache:
+    """
+    Небольшой LRU-кэш сжатых тел ответов с ETag.
+
+    Ключ - (кодировка, ETag, путь, query): одинаковый ETag у одного URL
+    означает одинаковое тело, поэтому, например, полный каталог
+    сжимается один раз на версию каталога, а не на каждый запрос.
+    """
+
+    def __init__(self, max_entries: int = 64, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._size = 0
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        with self._lock:
+            body = self._items.get(key)
+            if body is not None:
+                self._items.move_to_end(key)
+            return body
+
+    def put(self, key: Tuple, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = body
+            self._size += len(body)
+            while len(self._items) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+
+class CompressionMiddleware:
+    """
+    ASGI-middleware, сжимающее ответы gzip или brotli (по Accept-Encoding).
+
+    Сжимаются только ответы подходящего типа (JSON, текст, JS, CSS)
+    размером от `minimum_size` байт и без собственного Content-Encoding
+    (предварительно сжатая статика проходит как есть). Потоковые ответы
+    (NDJSON-выгрузка) сжимаются по частям. ETag сжатого ответа становится
+    слабым (W/"..."): тело другое, но версия ресурса та же, и условные
+    запросы по нему продолжают работать.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 5,
+        cache: Optional[CompressedBodyCache] = None,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {"gzip": gzip_level, "br": brotli_quality}
+        self.cache = cache if cache is not None else CompressedBodyCache()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = compression.choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        start = None
+        compressor: Optional[compression.StreamCompressor] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            if compressor is not None:
+                body = compressor.compress(message.get("body", b""))
+                more_body = message.get("more_body", False)
+                if not more_body:
+                    body += compressor.finish()
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            # Первый кусок тела: решаем, сжимать ли ответ.
+            headers = MutableHeaders(scope=start)
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if not self._should_compress(start["status"], headers):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            headers.add_vary_header("Accept-Encoding")
+            content_length = headers.get("content-length")
+            too_small = (
+                len(body) < self.minimum_size
+                if not more_body
+                else content_length is not None and int(content_length) < self.minimum_size
+            )
+            if encoding is None or too_small:
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            if more_body:
+                compressor = compression.StreamCompressor(encoding, self.levels[encoding])
+                self._mark_encoded(headers, encoding)
+                del headers["content-length"]
+                await send(start)
+                await send(
+                    {"type": "http.response.body", "body": compressor.compress(body), "more_body": True}
+                )
+                return
+
+            compressed = await self._compress_body(scope, headers, body, encoding)
+            passthrough = True
+            if len(compressed) >= len(body):
+                await send(start)
+                await send(message)
+                return
+            self._mark_encoded(headers, encoding)
+            headers["content-length"] = str(len(compressed))
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _should_compress(status: int, headers: MutableHeaders) -> bool:
+        return (
+            status not in (204, 304)
+            and "content-encoding" not in headers
+            and compression.is_compressible(headers.get("content-type"))
+        )
+
+    @staticmethod
+    def _mark_encoded(headers: MutableHeaders, encoding: str):
+        headers["content-encoding"] = encoding
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["etag"] = f"W/{etag}"
+
+    async def _compress_body(self, scope, headers: MutableHeaders, body: bytes, encoding: str) -> bytes:
+        etag = headers.get("etag")
+        key = None
+        if etag:
+            key = (encoding, etag, scope["path"], scope.get("query_string", b""))
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        level = self.levels[encoding]
+        if len(body) > _THREAD_THRESHOLD:
+            compressed = await anyio.to_thread.run_sync(compression.compress, body, encoding, level)
+        else:
+            compressed = compression.compress(body, encoding, level)
+        if key is not None:
+            self.cache.put(key, compressed)
+        return compressed
@@ -1,15 +1,44 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+
+from backend import db
 from backend.models import EventRegistration
 from backend.services import order_service
+from backend.storage.registration_store import RegistrationError
 
 router = APIRouter()
 
 
 # Исправляем URL на "/registrations"
 @router.post("/registrations", summary="Записать пользователя на мероприятие")
-def create_event_registration(registration: EventRegistration):
+async def create_event_registration(registration: EventRegistration):
     try:
-        result = order_service.process_event_registration(registration)
+        result = await order_service.process_event_registration(registration)
         return {"status": "success", **result}
+    except RegistrationError as e:
+        # Повторная запись или нет мест - конфликт с текущим состоянием
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/events/{event_name}/registrations", summary="Записи на мероприятие")
+def get_event_registrations(
+    event_name: str,
+    user_email: Optional[str] = None,
+    cursor: Optional[int] = Query(None, description="Курсор из next_cursor предыдущей страницы"),
+    limit: int = Query(50, ge=1, le=1000),
+):
+    """
+    Отдает число мест и записи на мероприятие от новых к старым постранично.
+    Для следующей страницы передайте `cursor` из поля `next_cursor`.
+    """
+    store = db.EVENT_REGISTRATIONS_DB
+    items, next_cursor = store.query(
+        event_name=event_name, user_email=user_email, cursor=cursor, limit=limit
+    )
+    return ORJSONResponse(
+        {**store.event_stats(event_name), "items": items, "next_cursor": next_cursor}
+    )
@@ -0,0 +1,118 @@
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from backend import db
+from backend.services import metrics
+from backend.admitad_postback_plugin import admitad_integration
+
+router = APIRouter()
+
+# Префикс пути -> имя роутера в метке метрики (первое совпадение).
+ROUTER_PREFIXES = (
+    ("/api/products", "products"),
+    ("/api/categories", "products"),
+    ("/api/orders", "orders"),
+    ("/api/cart", "cart"),
+    ("/api/registrations", "events"),
+    ("/api/events", "events"),
+    ("/api/transactions", "transactions"),
+    ("/api/stats", "stats"),
+    ("/s/", "admitad"),
+    ("/metrics", "metrics"),
+    ("/api/", "other"),
+)
+
+
+def router_for_path(path: str) -> str:
+    for prefix, name in ROUTER_PREFIXES:
+        if path.startswith(prefix):
+            return name
+    return "static"
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware, замеряющее длительность запросов по роутерам.
+    Написано на чистом ASGI (без BaseHTTPMiddleware), чтобы не добавлять
+    лишнюю задачу и копирование тела ответа на каждый запрос.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            name = router_for_path(scope["path"])
+            method = scope["method"]
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, name, method)
+            metrics.HTTP_REQUESTS_TOTAL.inc(name, method, str(status_code))
+
+
+# --- Gauge-метрики: считаются в момент опроса /metrics ---
+# В режиме SQLite это запросы к базе, поэтому /metrics - синхронный
+# эндпоинт (FastAPI выполняет его в пуле потоков, не в цикле событий),
+# а сами запросы читают счётчики, которые ведутся при записи: агрегаты
+# продаж, занятые места мероприятий, индекс outbox по статусу.
+
+
+def _dispatcher_backlog() -> dict:
+    stats = admitad_integration.dispatcher.stats()
+    return {
+        ("queue_depth",): stats["queue_depth"],
+        ("inflight_batches",): stats["inflight_batches"],
+        ("outbox_pending",): admitad_integration.dispatcher.pending_count(),
+    }
+
+
+metrics.Gauge(
+    "shop_transactions_stored",
+    "Количество транзакций в хранилище.",
+    lambda: len(db.TRANSACTIONS_DB),
+)
+metrics.Gauge(
+    "shop_catalog_products",
+    "Количество товаров в загруженном каталоге.",
+    lambda: len(db.CATALOG),
+)
+metrics.Gauge(
+    "shop_event_registrations_stored",
+    "Количество записей на мероприятия.",
+    lambda: len(db.EVENT_REGISTRATIONS_DB),
+)
+metrics.Gauge(
+    "shop_postback_backlog",
+    "Фоновая очередь постбэков Admitad.",
+    _dispatcher_backlog,
+    ("queue",),
+)
+
+
+def _observe_postback_attempt(outcome: str, duration: float):
+    metrics.STAGE_SECONDS.observe(duration, f"postback_{outcome}")
+    metrics.POSTBACK_ATTEMPTS_TOTAL.inc(outcome)
+
+
+admitad_integration.dispatcher.on_attempt = _observe_postback_attempt
+
+
+@router.get("/metrics", summary="Метрики в формате Prometheus", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(
+        metrics.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from backend import db
 from backend.models import Order
 from backend.services import order_service
 
@@ -6,10 +7,62 @@ router = APIRouter()
 
 
 @router.post("/orders", summary="Оформить новый заказ")
-def create_order(order: Order):
+async def create_order(order: Order):
     try:
-        result = order_service.process_new_order(order)
+        result = await order_service.process_new_order(order)
         return {"status": "success", **result}
     except ValueError as e:
         # Сервис может вернуть ошибку, которую мы превращаем в HTTP-ответ
         raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/orders/bulk", summary="Пакетная загрузка заказов (NDJSON)")
+async def create_orders_bulk(request: Request):
+    """
+    Принимает поток NDJSON: по одному объекту Order в строке.
+    Возвращает результат по каждой строке; ошибки в отдельных строках
+    не мешают принять остальные заказы пакета.
+    Размер тела, число строк и длина строки ограничены (413).
+    """
+    lines = []
+    tail = b""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > db.ORDERS_BULK_MAX_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Слишком большой пакет: максимум {db.ORDERS_BULK_MAX_BYTES} байт.",
+            )
+        parts = (tail + chunk).split(b"\n")
+        tail = parts.pop()
+        # Незавершённая строка не может расти бесконечно: иначе тело без
+        # переводов строк копировалось бы целиком на каждом куске.
+        _check_line_length(tail)
+        for line in parts:
+            _check_line_length(line)
+        lines.extend(parts)
+        _check_bulk_size(lines)
+    if tail:
+        lines.append(tail)
+        _check_bulk_size(lines)
+
+    results = await order_service.process_bulk_orders(lines)
+    accepted = sum(1 for r in results if r["status"] == "success")
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
+
+
+def _check_bulk_size(lines: list):
+    if len(lines) > db.ORDERS_BULK_MAX_LINES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Слишком много строк: максимум {db.ORDERS_BULK_MAX_LINES}.",
+        )
+
+
+def _check_line_length(line: bytes):
+    if len(line) > db.ORDERS_BULK_MAX_LINE_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Слишком длинная строка: максимум {db.ORDERS_BULK_MAX_LINE_BYTES} байт.",
+        )
@@ -1,44 +1,81 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Optional
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import Optional
 from backend import db
+from backend.api.http_cache import cached_response
+from backend.models import ProductSort
 
 router = APIRouter()
 
 
-def get_unique_categories() -> List[str]:
-    """Вспомогательная функция для получения уникальных категорий из "базы данных"."""
-    categories = set()
-    for product in db.PRODUCTS_DB:
-        categories.add(product["category"])
-    return sorted(list(categories))
+def _catalog_response(request: Request, catalog, body: bytes):
+    """Ответ каталога с ETag по версии каталога и настраиваемым Cache-Control."""
+    return cached_response(
+        request,
+        body,
+        etag=catalog.etag,
+        cache_control=db.CATALOG_CACHE_CONTROL,
+        last_modified=catalog.last_modified,
+    )
 
 
 @router.get("/categories", summary="Получить список всех категорий товаров")
-def get_categories():
+def get_categories(request: Request):
     """Отдает отсортированный список уникальных категорий."""
-    return get_unique_categories()
+    catalog = db.CATALOG
+    return _catalog_response(request, catalog, catalog.categories_json)
 
 
 @router.get("/products", summary="Получить список товаров (с фильтрацией по категории)")
-def get_products(category: Optional[str] = None):
+def get_products(request: Request, category: Optional[str] = None):
     """
     Отдает список всех товаров.
     Если указан GET-параметр `category`, фильтрует товары по этой категории.
     """
+    catalog = db.CATALOG
     if category:
-        # Возвращаем только товары из указанной категории
-        filtered_products = [
-            p for p in db.PRODUCTS_DB if p["category"].lower() == category.lower()
-        ]
-        return filtered_products
-    # Если категория не указана, возвращаем все товары
-    return db.PRODUCTS_DB
+        # Возвращаем только товары из указанной категории (через индекс)
+        return _catalog_response(
+            request, catalog, orjson.dumps(catalog.in_category(category))
+        )
+    # Если категория не указана, возвращаем все товары (заранее сериализованные)
+    return _catalog_response(request, catalog, catalog.products_json)
+
+
+@router.get("/products/search", summary="Поиск товаров по словам, категории и цене")
+def search_products(
+    request: Request,
+    q: str = Query("", max_length=200, description="Слова из названия или описания"),
+    category: Optional[str] = None,
+    price_min: Optional[float] = Query(None, ge=0),
+    price_max: Optional[float] = Query(None, ge=0),
+    sort: ProductSort = ProductSort.PRICE_ASC,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Находит товары, содержащие все слова запроса, по индексам каталога
+    (без перебора товаров). Результат отсортирован по цене и разбит на страницы.
+    """
+    catalog = db.CATALOG
+    total, items = catalog.search(
+        q,
+        category=category,
+        price_min=price_min,
+        price_max=price_max,
+        descending=sort is ProductSort.PRICE_DESC,
+        offset=offset,
+        limit=limit,
+    )
+    body = orjson.dumps({"total": total, "offset": offset, "limit": limit, "items": items})
+    return _catalog_response(request, catalog, body)
 
 
 @router.get("/products/{product_id}", summary="Получить один товар по ID")
-def get_product_by_id(product_id: int):
+def get_product_by_id(product_id: int, request: Request):
     """Находит и отдает один товар по его уникальному ID."""
-    product = next((p for p in db.PRODUCTS_DB if p["id"] == product_id), None)
+    catalog = db.CATALOG
+    product = catalog.get(product_id)
     if product:
-        return product
+        return _catalog_response(request, catalog, orjson.dumps(product))
     raise HTTPException(status_code=404, detail="Товар не найден")
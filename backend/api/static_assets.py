@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import stat
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+
+from backend.services import compression
+
+# Ссылки на локальные JS/CSS в HTML, к которым добавляется ?v=<хеш>.
+_ASSET_LINK_RE = re.compile(rb'\b(src|href)="([^"?#:]+\.(?:js|css))"')
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+class _Asset:
+    """Версия статического файла: хеш содержимого и пути к вариантам на диске."""
+
+    __slots__ = ("signature", "digest", "media_type", "files", "deps")
+
+    def __init__(self, signature, digest, media_type, files, deps):
+        self.signature: Tuple[int, int] = signature
+        self.digest: str = digest
+        self.media_type: Optional[str] = media_type
+        # кодировка (None - без сжатия) -> файл
+        self.files: Dict[Optional[str], Path] = files
+        # для HTML: файл, на который стоит ссылка -> хеш, подставленный в ссылку
+        self.deps: Dict[Path, str] = deps
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    Раздача статики с предварительно сжатыми файлами-спутниками.
+
+    Для каждого файла считается хеш содержимого, а сжатые варианты
+    (.gz и, если установлен brotli, .br) один раз записываются в `cache_dir`
+    под именами с этим хешем - сжатие не повторяется ни между запросами,
+    ни между воркерами и перезапусками. Версия пересобирается, если файл
+    изменился (по mtime и размеру). Проверка и пересборка идут в
+    lookup_path, который StaticFiles вызывает в пуле потоков; file_response
+    в цикле событий только берёт готовую версию из таблицы.
+
+    В HTML-страницах ссылки на локальные JS и CSS дополняются ?v=<хеш>.
+    Запрос с актуальным хешем отдаётся с Cache-Control immutable на год,
+    сами страницы - с no-cache и ETag (проверка занимает один 304).
+    """
+
+    def __init__(
+        self,
+        *,
+        directory: str,
+        cache_dir: Path,
+        html: bool = False,
+        minimum_size: int = 1024,
+    ):
+        super().__init__(directory=directory, html=html)
+        self.root = Path(directory).resolve()
+        self.cache_dir = Path(cache_dir)
+        self.minimum_size = minimum_size
+        self._assets: Dict[Path, _Asset] = {}
+        # Путь из lookup_path -> актуальная версия файла (для file_response).
+        self._current: Dict[str, _Asset] = {}
+        self._lock = threading.RLock()
+
+    def build_all(self):
+        """
+        Собирает версии и сжатые варианты всех файлов (вызывается при старте)
+        и удаляет из кэша файлы, которые больше не нужны.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        used = set()
+        for source in sorted(self.root.rglob("*")):
+            if source.is_file():
+                asset = self._asset(source)
+                used.update(path for path in asset.files.values() if path != source)
+        for cached in self.cache_dir.rglob("*"):
+            # .tmp может прямо сейчас дописывать другой воркер
+            if cached.is_file() and cached not in used and cached.suffix != ".tmp":
+                cached.unlink(missing_ok=True)
+        logging.info("Статика подготовлена: %d файлов в кэше %s.", len(used), self.cache_dir)
+
+    def lookup_path(self, path: str) -> Tuple[str, Optional[os.stat_result]]:
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            # Вызывается в пуле потоков: stat, чтение, хеш и сжатие изменённого
+            # файла не занимают цикл событий.
+            self._current[full_path] = self._asset(Path(full_path).resolve())
+        return full_path, stat_result
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        if status_code != 200:
+            return super().file_response(full_path, stat_result, scope, status_code)
+        asset = self._current.get(full_path)
+        if asset is None:
+            asset = self._asset(Path(full_path).resolve())
+        request_headers = Headers(scope=scope)
+        encoding = compression.choose_encoding(
+            request_headers.get("accept-encoding"),
+            [e for e in compression.SUPPORTED_ENCODINGS if e in asset.files],
+        )
+        etag = f'"{asset.digest}-{encoding}"' if encoding else f'"{asset.digest}"'
+        versioned = QueryParams(scope.get("query_string", b"")).get("v") == asset.digest
+        headers = {
+            "ETag": etag,
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if versioned else REVALIDATE_CACHE_CONTROL,
+        }
+        if len(asset.files) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and etag in {t.strip().removeprefix("W/") for t in if_none_match.split(",")}:
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return FileResponse(asset.files[encoding], media_type=asset.media_type, headers=headers)
+
+    # --- Сборка версий ---
+
+    def _asset(self, source: Path) -> _Asset:
+        """Текущая версия файла; пересобирается, если файл или его зависимости изменились."""
+        stat = source.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            asset = self._assets.get(source)
+            if (
+                asset is not None
+                and asset.signature == signature
+                and all(self._asset(dep).digest == digest for dep, digest in asset.deps.items())
+            ):
+                return asset
+            asset = self._build(source, signature)
+            self._assets[source] = asset
+            return asset
+
+    def _build(self, source: Path, signature: Tuple[int, int]) -> _Asset:
+        data = source.read_bytes()
+        media_type = mimetypes.guess_type(source.name)[0]
+        deps: Dict[Path, str] = {}
+        if source.suffix == ".html":
+            data = self._link_versions(source, data, deps)
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        relative = source.relative_to(self.root)
+        files: Dict[Optional[str], Path] = {None: source}
+        if deps:
+            # HTML со ссылками на версии отличается от исходного файла.
+            files[None] = self._write_cached(self._cache_path(relative, digest, ""), data)
+        if len(data) >= self.minimum_size and compression.is_compressible(media_type):
+            for encoding in compression.SUPPORTED_ENCODINGS:
+                path = self._cache_path(relative, digest, compression.FILE_SUFFIXES[encoding])
+                if not path.exists():
+                    compressed = compression.compress(data, encoding)
+                    if len(compressed) >= len(data):
+                        continue
+                    self._write_cached(path, compressed)
+                files[encoding] = path
+        return _Asset(signature, digest, media_type, files, deps)
+
+    def _link_versions(self, source: Path, data: bytes, deps: Dict[Path, str]) -> bytes:
+        def replace(match):
+            url = match.group(2).decode()
+            base = self.root if url.startswith("/") else source.parent
+            target = (base / url.lstrip("/")).resolve()
+            if not target.is_file() or self.root not in target.parents:
+                return match.group(0)
+            digest = self._asset(target).digest
+            deps[target] = digest
+            return match.group(1) + f'="{url}?v={digest}"'.encode()
+
+        return _ASSET_LINK_RE.sub(replace, data)
+
+    def _cache_path(self, relative: Path, digest: str, suffix: str) -> Path:
+        return self.cache_dir / relative.parent / f"{relative.name}.{digest}{suffix}"
+
+    @staticmethod
+    def _write_cached(path: Path, content: bytes) -> Path:
+        """Атомарно записывает файл кэша, если его ещё нет (имя содержит хеш)."""
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+            tmp_path.write_bytes(content)
+            os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,39 @@
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Query
+from fastapi.responses import ORJSONResponse
+
+from backend import db
+from backend.models import StatsDimension
+from backend.storage import rollups
+
+router = APIRouter()
+
+
+@router.get("/stats", summary="Итоги продаж за период")
+def get_stats_summary(
+    date_from: Optional[date] = Query(None, description="Первый день периода (включительно)"),
+    date_to: Optional[date] = Query(None, description="Последний день периода (не включительно)"),
+):
+    """
+    Выручка, число заказов, записей на мероприятия и конверсий Admitad.
+    Считается по заранее агрегированным данным, а не по истории транзакций.
+    """
+    cells = db.TRANSACTIONS_DB.rollup_cells()
+    return ORJSONResponse(rollups.summarize(cells, None, date_from, date_to)[0])
+
+
+@router.get("/stats/{dimension}", summary="Продажи в разрезе")
+def get_stats_by(
+    dimension: StatsDimension,
+    date_from: Optional[date] = Query(None, description="Первый день периода (включительно)"),
+    date_to: Optional[date] = Query(None, description="Последний день периода (не включительно)"),
+):
+    """
+    Те же показатели, что и /stats, по дням, способам оплаты, статусам
+    или по наличию admitad_uid (`admitad`: true/false).
+    """
+    cells = db.TRANSACTIONS_DB.rollup_cells()
+    items = rollups.summarize(cells, dimension.value, date_from, date_to)
+    return ORJSONResponse({"group_by": dimension.value, "items": items})
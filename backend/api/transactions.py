@@ -1,9 +1,90 @@
-from fastapi import APIRouter
+from datetime import datetime
+from typing import Optional
+
+import orjson
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
 from backend import db
+from backend.models import OrderStatus, PaymentMethod
 
 router = APIRouter()
 
+# Сколько строк NDJSON собирается в один кусок потокового ответа.
+EXPORT_CHUNK_SIZE = 500
+
+
+class TransactionFilters:
+    """Общие GET-параметры фильтрации транзакций."""
+
+    def __init__(
+        self,
+        status: Optional[OrderStatus] = None,
+        payment_method: Optional[PaymentMethod] = None,
+        user_email: Optional[str] = None,
+        admitad_uid: Optional[str] = None,
+        date_from: Optional[datetime] = Query(None, description="Начало периода (включительно)"),
+        date_to: Optional[datetime] = Query(None, description="Конец периода (не включительно)"),
+        order_id_from: Optional[int] = Query(None, description="Минимальный order_id (включительно)"),
+        order_id_to: Optional[int] = Query(None, description="Максимальный order_id (не включительно)"),
+    ):
+        self.fields = {
+            "status": status,
+            "payment_method": payment_method,
+            "user_email": user_email,
+            "admitad_uid": admitad_uid,
+        }
+        self.date_from = date_from
+        self.date_to = date_to
+        self.order_id_from = order_id_from
+        self.order_id_to = order_id_to
+
+
+@router.get("/transactions", summary="Получить страницу транзакций (с фильтрами)")
+def get_transactions(
+    filters: TransactionFilters = Depends(),
+    cursor: Optional[int] = Query(None, description="Курсор из next_cursor предыдущей страницы"),
+    limit: int = Query(50, ge=1, le=1000),
+):
+    """
+    Отдает транзакции от новых к старым постранично.
+    Для следующей страницы передайте `cursor` из поля `next_cursor`.
+    """
+    items, next_cursor = db.TRANSACTIONS_DB.query(
+        filters.fields,
+        time_from=filters.date_from,
+        time_to=filters.date_to,
+        cursor=cursor,
+        limit=limit,
+        id_from=filters.order_id_from,
+        id_to=filters.order_id_to,
+    )
+    # Ответ сразу кодируется orjson, минуя jsonable_encoder для каждой записи
+    return ORJSONResponse({"items": items, "next_cursor": next_cursor})
+
+
+@router.get("/transactions/export", summary="Выгрузить транзакции в формате NDJSON")
+def export_transactions(filters: TransactionFilters = Depends()):
+    """
+    Потоково отдает все подходящие транзакции (от старых к новым),
+    по одной JSON-записи на строку. Ответ формируется кусками и никогда
+    не собирается в памяти целиком.
+    """
+
+    def generate():
+        chunk = []
+        for record in db.TRANSACTIONS_DB.iter_matching(
+            filters.fields,
+            time_from=filters.date_from,
+            time_to=filters.date_to,
+            id_from=filters.order_id_from,
+            id_to=filters.order_id_to,
+        ):
+            chunk.append(orjson.dumps(record, default=str))
+            if len(chunk) >= EXPORT_CHUNK_SIZE:
+                yield b"\n".join(chunk) + b"\n"
+                chunk = []
+        if chunk:
+            yield b"\n".join(chunk) + b"\n"
 
-@router.get("/transactions", summary="Получить список всех транзакций")
-def get_transactions():
-    return db.TRANSACTIONS_DB
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
@@ -1,10 +1,19 @@
+import atexit
 import json
 import os
+import threading
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Sequence
 from dotenv import load_dotenv
 import logging
 
+from backend.storage.catalog import ProductCatalog
+from backend.storage.catalog_watcher import CatalogWatcher
+from backend.storage.journal import JsonlJournal
+from backend.storage.registration_store import EventRegistrationStore
+from backend.storage.sqlite_store import SqliteTransactionStore
+from backend.storage.transaction_store import TransactionStore
+
 # --- КОНФИГУРАЦИЯ И КОНСТАНТЫ ---
 
 load_dotenv()
@@ -17,60 +26,170 @@ TEST_CARD_DATA = {
     "owner_name": os.getenv("TEST_CARD_OWNER"),
 }
 
+# Папка с данными магазина: транзакции и записи на мероприятия
+# (по умолчанию - рядом с кодом). Бенчмарк направляет её во временную папку.
+DATA_DIR = Path(os.getenv("DATA_DIR", Path(__file__).parent))
+
+# Имитация задержки ответа банка (в секундах). 0 - без задержки.
+BANK_LATENCY_SECONDS = float(os.getenv("BANK_LATENCY_SECONDS", "1.0"))
+
+# Максимальное число строк (заказов) в одном запросе POST /api/orders/bulk.
+ORDERS_BULK_MAX_LINES = int(os.getenv("ORDERS_BULK_MAX_LINES", "10000"))
+# Максимальный размер тела POST /api/orders/bulk и одной его строки (в байтах).
+ORDERS_BULK_MAX_BYTES = int(os.getenv("ORDERS_BULK_MAX_BYTES", str(16 * 1024 * 1024)))
+ORDERS_BULK_MAX_LINE_BYTES = int(os.getenv("ORDERS_BULK_MAX_LINE_BYTES", str(64 * 1024)))
+
+# --- СЖАТИЕ ОТВЕТОВ И СТАТИКА ---
+
+# Ответы API меньше этого размера (в байтах) не сжимаются.
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Уровни сжатия ответов API на лету (статика сжимается заранее и максимально).
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+# Каталог для сжатых копий файлов фронтенда (.gz/.br) и HTML со ссылками на версии.
+STATIC_CACHE_DIR = Path(os.getenv("STATIC_CACHE_DIR", Path(__file__).parent / ".static_cache"))
+
 # --- ХРАНИЛИЩЕ ДАННЫХ: ТОВАРЫ ---
 
 PRODUCTS_FILE_PATH = Path(__file__).parent / "products.json"
+# Заголовок Cache-Control для ответов каталога (товары и категории).
+CATALOG_CACHE_CONTROL = os.getenv("CATALOG_CACHE_CONTROL", "public, max-age=60")
 
 
-def load_products() -> List[Dict[str, Any]]:
-    """Загружает каталог товаров из файла products.json."""
+# Интервал проверки products.json на изменения (в секундах). 0 - не следить.
+CATALOG_WATCH_INTERVAL = float(os.getenv("CATALOG_WATCH_INTERVAL", "2"))
+
+
+def _read_catalog() -> ProductCatalog:
+    """Читает products.json и строит снимок каталога. Ошибки пробрасываются."""
+    with open(PRODUCTS_FILE_PATH, "r", encoding="utf-8") as f:
+        mtime = os.fstat(f.fileno()).st_mtime
+        return ProductCatalog(json.load(f), last_modified=mtime)
+
+
+def load_products() -> ProductCatalog:
+    """Загружает каталог товаров из файла products.json и строит его индексы."""
     try:
-        with open(PRODUCTS_FILE_PATH, "r", encoding="utf-8") as f:
-            logging.info("Загрузка каталога товаров из products.json...")
-            return json.load(f)
+        logging.info("Загрузка каталога товаров из products.json...")
+        return _read_catalog()
     except (FileNotFoundError, json.JSONDecodeError) as e:
         logging.error(
-            f"Ошибка загрузки каталога товаров: {e}. Возвращается пустой список."
+            "Ошибка загрузки каталога товаров: %s. Возвращается пустой каталог.", e
         )
-        return []
+        return ProductCatalog([])
 
 
-PRODUCTS_DB = load_products()
+def swap_catalog(catalog: ProductCatalog):
+    """
+    Атомарно подменяет текущий снимок каталога.
+    Обработчики берут db.CATALOG один раз за запрос, поэтому всегда видят
+    либо старый, либо новый каталог целиком вместе с его индексами.
+    """
+    global CATALOG, PRODUCTS_DB
+    CATALOG = catalog
+    PRODUCTS_DB = catalog.products
+    logging.info(
+        "Каталог товаров перезагружен: %d товаров, версия %s.",
+        len(catalog),
+        catalog.version,
+    )
+
+
+CATALOG = load_products()
+PRODUCTS_DB = CATALOG.products
+CATALOG_WATCHER = CatalogWatcher(
+    PRODUCTS_FILE_PATH,
+    load=_read_catalog,
+    on_reload=swap_catalog,
+    interval=CATALOG_WATCH_INTERVAL,
+)
 
 
 # --- ХРАНИЛИЩЕ ДАННЫХ: ЗАПИСИ НА МЕРОПРИЯТИЯ ---
+# Записи хранятся в SQLite (режим WAL) независимо от TRANSACTIONS_BACKEND:
+# счётчики мест должны быть общими для всех воркеров. Записи из старых
+# event_registrations.json и event_registrations.jsonl переносятся
+# в базу автоматически при первом запуске.
 
-EVENT_REGISTRATIONS_FILE = Path(__file__).parent / "event_registrations.json"
+EVENT_REGISTRATIONS_FILE = DATA_DIR / "event_registrations.json"
+EVENT_REGISTRATIONS_JOURNAL_FILE = DATA_DIR / "event_registrations.jsonl"
+EVENT_REGISTRATIONS_SQLITE_FILE = DATA_DIR / "event_registrations.sqlite3"
+# Число мест на мероприятии по умолчанию (0 - без ограничения).
+EVENT_DEFAULT_CAPACITY = int(os.getenv("EVENT_DEFAULT_CAPACITY", "0"))
+# Число мест на отдельных мероприятиях, JSON: {"Марафон 5км": 500, ...}.
+EVENT_CAPACITIES = json.loads(os.getenv("EVENT_CAPACITIES", "{}"))
 
 
-def load_event_registrations() -> List[Dict[str, Any]]:
-    """Загружает записи на мероприятия из файла."""
-    if not EVENT_REGISTRATIONS_FILE.exists():
-        return []
-    try:
-        with open(EVENT_REGISTRATIONS_FILE, "r", encoding="utf-8") as f:
-            content = f.read()
-            return json.loads(content) if content else []
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+def _load_legacy_event_registrations() -> List[Dict[str, Any]]:
+    """Загружает записи на мероприятия из старых файлов (JSON и журнала)."""
+    records = JsonlJournal(EVENT_REGISTRATIONS_JOURNAL_FILE).recover()
+    if EVENT_REGISTRATIONS_FILE.exists():
+        try:
+            with open(EVENT_REGISTRATIONS_FILE, "r", encoding="utf-8") as f:
+                content = f.read()
+                records.extend(json.loads(content) if content else [])
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+    return records
+
+
+def load_event_registrations() -> EventRegistrationStore:
+    """Открывает хранилище записей на мероприятия (с переносом старых файлов)."""
+    store = EventRegistrationStore(
+        EVENT_REGISTRATIONS_SQLITE_FILE,
+        capacities=EVENT_CAPACITIES,
+        default_capacity=EVENT_DEFAULT_CAPACITY,
+    )
+    if EVENT_REGISTRATIONS_JOURNAL_FILE.exists() or EVENT_REGISTRATIONS_FILE.exists():
+        imported = store.import_if_empty(_load_legacy_event_registrations())
+        if imported:
+            logging.info("Перенесено %d записей на мероприятия в SQLite.", imported)
+    return store
 
 
-def save_event_registrations(registrations: List[Dict[str, Any]]):
-    """Сохраняет записи на мероприятия в файл."""
-    with open(EVENT_REGISTRATIONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(registrations, f, indent=4, ensure_ascii=False, default=str)
+def register_for_event(registration: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Сохраняет запись на мероприятие, атомарно занимая место.
+    Бросает DuplicateRegistrationError или EventFullError (подклассы ValueError).
+    """
+    return EVENT_REGISTRATIONS_DB.register(registration)
+
+
+def cancel_event_registration(registration: Dict[str, Any]) -> bool:
+    """Отменяет запись, сохранённую register_for_event, и освобождает место."""
+    return EVENT_REGISTRATIONS_DB.cancel(registration)
 
 
 EVENT_REGISTRATIONS_DB = load_event_registrations()
 
 
 # --- ХРАНИЛИЩЕ ДАННЫХ: ТРАНЗАКЦИИ ---
+# Транзакции хранятся в журнале JSON Lines: новая транзакция дописывается
+# одной строкой, а не переписывает весь файл. Старый transactions.json
+# переносится в журнал автоматически при первом запуске.
+#
+# Журнал рассчитан на один процесс. Для запуска с несколькими воркерами
+# укажите TRANSACTIONS_BACKEND=sqlite: транзакции будут храниться в SQLite
+# (режим WAL) с атомарными вставками и общим для всех воркеров чтением.
 
-TRANSACTIONS_FILE = Path(__file__).parent / "transactions.json"
+TRANSACTIONS_BACKEND = os.getenv("TRANSACTIONS_BACKEND", "journal").lower()
+TRANSACTIONS_FILE = DATA_DIR / "transactions.json"
+TRANSACTIONS_SQLITE_FILE = DATA_DIR / "transactions.sqlite3"
+TRANSACTIONS_JOURNAL_FILE = DATA_DIR / "transactions.jsonl"
+TRANSACTIONS_FSYNC_EVERY = int(os.getenv("TRANSACTIONS_FSYNC_EVERY", "32"))
+TRANSACTIONS_FSYNC_INTERVAL = float(os.getenv("TRANSACTIONS_FSYNC_INTERVAL", "1.0"))
+# Строить индексы в фоне сразу после старта (0 - только при первом запросе с фильтром).
+TRANSACTIONS_WARM_INDEXES = os.getenv("TRANSACTIONS_WARM_INDEXES", "1") == "1"
 
+TRANSACTIONS_JOURNAL = JsonlJournal(
+    TRANSACTIONS_JOURNAL_FILE,
+    fsync_every=TRANSACTIONS_FSYNC_EVERY,
+    fsync_interval=TRANSACTIONS_FSYNC_INTERVAL,
+)
 
-def load_transactions() -> List[Dict[str, Any]]:
-    """Загружает транзакции из файла."""
+
+def _load_legacy_transactions() -> List[Dict[str, Any]]:
+    """Загружает транзакции из старого файла transactions.json."""
     if not TRANSACTIONS_FILE.exists():
         return []
     try:
@@ -81,10 +200,71 @@ def load_transactions() -> List[Dict[str, Any]]:
         return []
 
 
+def _migrate_legacy_transactions():
+    """Переносит старый transactions.json в журнал (однократно)."""
+    if not TRANSACTIONS_JOURNAL_FILE.exists() and TRANSACTIONS_FILE.exists():
+        legacy = _load_legacy_transactions()
+        logging.info(
+            "Перенос %d транзакций из transactions.json в журнал...", len(legacy)
+        )
+        TRANSACTIONS_JOURNAL.compact(legacy)
+        TRANSACTIONS_FILE.rename(TRANSACTIONS_FILE.with_suffix(".json.bak"))
+
+
+def load_transactions() -> List[Dict[str, Any]]:
+    """Восстанавливает транзакции из журнала (с переносом старого transactions.json)."""
+    _migrate_legacy_transactions()
+    return TRANSACTIONS_JOURNAL.recover()
+
+
+def open_transactions() -> Sequence:
+    """
+    Открывает журнал транзакций для ленивого чтения: файл отображается
+    в память, смещения записей берутся из сохранённого индекса.
+    """
+    _migrate_legacy_transactions()
+    return TRANSACTIONS_JOURNAL.open_records()
+
+
+def init_transactions_store():
+    """Создаёт хранилище транзакций выбранного типа (journal или sqlite)."""
+    if TRANSACTIONS_BACKEND == "sqlite":
+        store = SqliteTransactionStore(TRANSACTIONS_SQLITE_FILE)
+        if TRANSACTIONS_JOURNAL_FILE.exists() or TRANSACTIONS_FILE.exists():
+            imported = store.import_if_empty(load_transactions())
+            if imported:
+                logging.info("Перенесено %d транзакций в SQLite.", imported)
+        return store
+    return TransactionStore(open_transactions(), journal=TRANSACTIONS_JOURNAL, lazy=True)
+
+
+def warm_transaction_indexes():
+    """
+    Строит индексы и агрегаты транзакций в фоновом потоке после старта,
+    чтобы первый запрос с фильтром или к /api/stats не ждал их построения.
+    """
+    ensure_indexes = getattr(TRANSACTIONS_DB, "ensure_indexes", None)
+    if TRANSACTIONS_WARM_INDEXES and ensure_indexes is not None:
+        threading.Thread(
+            target=ensure_indexes, name="transactions-indexer", daemon=True
+        ).start()
+
+
+def append_transaction(transaction: Dict[str, Any]):
+    """Добавляет одну транзакцию в хранилище (и в его индексы)."""
+    TRANSACTIONS_DB.append(transaction)
+
+
+def append_transactions(transactions: List[Dict[str, Any]]):
+    """Добавляет группу транзакций одной групповой записью."""
+    if transactions:
+        TRANSACTIONS_DB.append_many(transactions)
+
+
 def save_transactions(transactions: List[Dict[str, Any]]):
-    """Сохраняет транзакции в файл."""
-    with open(TRANSACTIONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(transactions, f, indent=4, ensure_ascii=False, default=str)
+    """Полностью переписывает (компактирует) журнал транзакций."""
+    TRANSACTIONS_JOURNAL.compact(transactions)
 
 
-TRANSACTIONS_DB = load_transactions()
+TRANSACTIONS_DB = init_transactions_store()
+atexit.register(TRANSACTIONS_JOURNAL.close)
@@ -1,14 +1,22 @@
 import logging
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from backend import db
-from backend.api import products, transactions, orders, events
+from backend.api import products, transactions, orders, events, cart, stats, metrics
+from backend.api.compression import CompressionMiddleware
+from backend.api.static_assets import PrecompressedStaticFiles
+from backend.api.http_cache import cached_response
 from backend.admitad_postback_plugin import admitad_integration
+from backend.services.logging_setup import setup_logging
+
+# --- Логирование через очередь: вывод логов не блокирует обработку запросов ---
+setup_logging()
 
 # --- Настройка приложения и CORS ---
-app = FastAPI(title="Sport Shop Test API")
+# ORJSONResponse по умолчанию: ответы API кодируются через orjson
+app = FastAPI(title="Sport Shop Test API", default_response_class=ORJSONResponse)
 origins = [
     "http://localhost:5500",
     "http://127.0.0.1:5500",
@@ -22,33 +30,63 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Сжатие ответов API (gzip/brotli) от COMPRESSION_MIN_SIZE байт
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=db.COMPRESSION_MIN_SIZE,
+    gzip_level=db.COMPRESSION_GZIP_LEVEL,
+    brotli_quality=db.COMPRESSION_BROTLI_QUALITY,
+)
+# Замер длительности запросов по роутерам для /metrics
+app.add_middleware(metrics.MetricsMiddleware)
 
 # --- Подключаем все наши API-роутеры ---
 app.include_router(products.router, prefix="/api")
 app.include_router(transactions.router, prefix="/api")
+app.include_router(stats.router, prefix="/api")
 app.include_router(orders.router, prefix="/api")
+app.include_router(cart.router, prefix="/api")
 app.include_router(events.router, prefix="/api")
 app.include_router(admitad_integration.router, prefix="/s")
+app.include_router(metrics.router)
+
+# --- Горячая перезагрузка каталога при изменении products.json ---
+app.add_event_handler("startup", db.CATALOG_WATCHER.start)
+app.add_event_handler("shutdown", db.CATALOG_WATCHER.stop)
+
+# --- Фоновое построение индексов и агрегатов транзакций (старт не ждёт чтения истории) ---
+app.add_event_handler("startup", db.warm_transaction_indexes)
 
 
 @app.get("/api/categories")
-def get_categories():
-    logging.info("Получение категорий")
+def get_categories(request: Request):
     """
     Возвращает список всех уникальных категорий товаров.
     """
     # Убедитесь, что db импортирован: from backend import db
-    all_products = db.PRODUCTS_DB
-    logging.info(f"Всего продуктов: {len(all_products)}")
-    if not all_products:
+    catalog = db.CATALOG
+    logging.debug("Получение категорий, всего продуктов: %d", len(catalog))
+    if not catalog:
         logging.warning("База данных продуктов пуста")
         return []
-    # Используем множество (set) для автоматического получения уникальных значений
-    unique_categories = sorted(list({p["category"] for p in all_products}))
-    logging.info(f"Найденные категории: {unique_categories}")
-    return unique_categories
+    # Список категорий уже посчитан и сериализован при загрузке каталога
+    return cached_response(
+        request,
+        catalog.categories_json,
+        etag=catalog.etag,
+        cache_control=db.CATALOG_CACHE_CONTROL,
+        last_modified=catalog.last_modified,
+    )
 
 
 # --- ЯВНАЯ ОТДАЧА СТАТИЧЕСКИХ ФАЙЛОВ ---
 # 1. Подключаем папку frontend как статику по пути /
-app.mount("/", StaticFiles(directory="frontend", html=True), name="static")
+#    (сжатые копии файлов готовятся при старте, JS/CSS кэшируются по хешу содержимого)
+static_files = PrecompressedStaticFiles(
+    directory="frontend",
+    html=True,
+    cache_dir=db.STATIC_CACHE_DIR,
+    minimum_size=db.COMPRESSION_MIN_SIZE,
+)
+app.add_event_handler("startup", static_files.build_all)
+app.mount("/", static_files, name="static")
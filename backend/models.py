@@ -18,14 +18,35 @@ class PaymentMethod(str, Enum):
     EVENT_REGISTRATION = "event_registration"
 
 
+class ProductSort(str, Enum):
+    PRICE_ASC = "price_asc"
+    PRICE_DESC = "price_desc"
+
+
+class StatsDimension(str, Enum):
+    DAY = "day"
+    PAYMENT_METHOD = "payment_method"
+    STATUS = "status"
+    ADMITAD = "admitad"
+
+
 class ProductInOrder(BaseModel):
     product_id: int  # Явное название поля
     sku: Optional[str] = None  # Артикул, очень распространённое поле
     name: str
-    price: float
+    price: Optional[float] = None  # Цена от клиента не используется: её берёт сервер из каталога
     quantity: int = Field(gt=0)
 
 
+class CartItem(BaseModel):
+    product_id: int
+    quantity: int = Field(gt=0)
+
+
+class CartQuoteRequest(BaseModel):
+    items: List[CartItem]
+
+
 class CardDetails(BaseModel):
     card_number: str
     expiry_date: str
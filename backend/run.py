@@ -1,11 +1,195 @@
+"""
+Запуск сервера.
+
+    python -m backend.run                 # разработка: один процесс, автоперезагрузка
+    python -m backend.run --workers 4     # продакшен: несколько воркеров
+
+В продакшен-режиме (--workers или WEB_CONCURRENCY) приложение вместе
+с каталогом товаров загружается один раз в главном процессе, после чего
+воркеры создаются через fork и разделяют эти данные copy-on-write.
+Все воркеры принимают соединения на одном сокете; используются цикл
+событий uvloop и HTTP-парсер httptools.
+
+При SIGTERM/SIGINT главный процесс передаёт SIGTERM воркерам: каждый
+перестаёт принимать соединения, дожидается текущих запросов (оформление
+заказа, ответ банка) и при остановке досылает постбэки Admitad.
+Воркеры, не успевшие за GRACEFUL_TIMEOUT (+ запас), завершаются принудительно.
+Упавший воркер перезапускается.
+
+С несколькими воркерами транзакции должны храниться в SQLite
+(TRANSACTIONS_BACKEND=sqlite): журнал рассчитан на один процесс.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
 import uvicorn
 
-if __name__ == "__main__":
+# Корень репозитория - чтобы `backend` импортировался и при запуске
+# как `python backend/run.py`.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+PORT = int(os.getenv("SERVER_PORT", "8000"))
+# Число воркеров в продакшен-режиме (0 - режим разработки).
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "0"))
+# Сколько секунд воркер ждёт завершения текущих запросов при остановке.
+GRACEFUL_TIMEOUT = float(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+# Запас сверх GRACEFUL_TIMEOUT на остановку приложения (досылку постбэков).
+SHUTDOWN_MARGIN = 15.0
+# Пауза перед перезапуском упавшего воркера (защита от частых падений).
+RESPAWN_DELAY = 1.0
+
+log = logging.getLogger("backend.run")
+
+
+def serve_dev(host: str, port: int):
     uvicorn.run(
         "backend.main:app",  # <-- Указываем полный путь к объекту app
-        host="127.0.0.1",
-        port=8000,
+        host=host,
+        port=port,
         reload=True,
         # Указываем, где искать файлы для перезагрузки
         reload_dirs=["backend"],
     )
+
+
+def serve_production(host: str, port: int, workers: int) -> int:
+    """
+    Загружает приложение, открывает сокет и запускает `workers` воркеров.
+    Возвращает код выхода (в воркере - после его остановки).
+    """
+    from backend import db
+    from backend.main import app
+    from backend.services.id_generator import MAX_WORKER_ID
+
+    if workers > MAX_WORKER_ID + 1:
+        log.error(
+            "Воркеров (%d) больше, чем ID воркеров в генераторе order_id (%d).",
+            workers,
+            MAX_WORKER_ID + 1,
+        )
+        return 2
+    if workers > 1 and db.TRANSACTIONS_BACKEND != "sqlite":
+        log.error(
+            "Для %d воркеров нужен TRANSACTIONS_BACKEND=sqlite: "
+            "журнал транзакций рассчитан на один процесс.",
+            workers,
+        )
+        return 2
+
+    config = uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        lifespan="on",
+        access_log=False,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+    )
+    sock = config.bind_socket()
+    # Всё, что загружено до fork (каталог и его индексы, модули), переводится
+    # в постоянное поколение сборщика мусора: он не будет обходить эти объекты
+    # в воркерах и лишний раз копировать их страницы памяти.
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            _signal(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for number in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            return _run_worker(config, sock)
+        children[pid] = number
+    log.info("Сервер запущен на %s:%d, воркеров: %d.", host, port, workers)
+
+    deadline = None
+    while children:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + GRACEFUL_TIMEOUT + SHUTDOWN_MARGIN
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if deadline is not None and time.monotonic() > deadline:
+                for child in children:
+                    _signal(child, signal.SIGKILL)
+            time.sleep(0.2)
+            continue
+        number = children.pop(pid)
+        if stopping:
+            continue
+        log.error(
+            "Воркер %d (pid %d) завершился с кодом %d, перезапуск.",
+            number,
+            pid,
+            os.waitstatus_to_exitcode(status),
+        )
+        time.sleep(RESPAWN_DELAY)
+        if stopping:
+            continue
+        pid = os.fork()
+        if pid == 0:
+            return _run_worker(config, sock)
+        children[pid] = number
+    sock.close()
+    return 0
+
+
+def _run_worker(config: uvicorn.Config, sock) -> int:
+    """
+    Тело воркера после fork. Сигналы остановки до запуска сервера
+    игнорируются; uvicorn ставит свои обработчики и после остановки
+    восстанавливает эти, поэтому воркер выходит обычным путём (с atexit:
+    сброс журналов и очередей логов).
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return 0 if server.started else 1
+
+
+def _signal(pid: int, signum: int):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Запуск сервера Sport Shop")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="Число воркеров (продакшен-режим). 0 - режим разработки с автоперезагрузкой.",
+    )
+    args = parser.parse_args()
+    if args.workers <= 0:
+        serve_dev(args.host, args.port)
+        return 0
+    return serve_production(args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
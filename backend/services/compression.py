@@ -0,0 +1,97 @@
+"""
+Сжатие ответов: выбор кодировки по Accept-Encoding, gzip и brotli.
+
+brotli - необязательная зависимость: если пакет не установлен,
+ответы сжимаются только gzip.
+"""
+
+import gzip
+import zlib
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli не установлен - только gzip
+    brotli = None
+
+# Поддерживаемые кодировки в порядке предпочтения (при равном q).
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+# Расширения файлов-спутников для предварительно сжатой статики.
+FILE_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Типы содержимого, которые имеет смысл сжимать (картинки и архивы уже сжаты).
+_COMPRESSIBLE_PREFIXES = ("text/", "application/json", "application/x-ndjson")
+_COMPRESSIBLE_TYPES = frozenset(
+    (
+        "application/javascript",
+        "application/xml",
+        "application/manifest+json",
+        "image/svg+xml",
+    )
+)
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    """Стоит ли сжимать содержимое с этим Content-Type."""
+    if not content_type:
+        return False
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return media_type.startswith(_COMPRESSIBLE_PREFIXES) or media_type in _COMPRESSIBLE_TYPES
+
+
+def choose_encoding(accept_encoding: Optional[str], available=SUPPORTED_ENCODINGS) -> Optional[str]:
+    """
+    Выбирает кодировку из `available` по заголовку Accept-Encoding
+    (с учётом q-значений и "*"). None - отдавать без сжатия.
+    """
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Сжимает данные целиком. `level` - уровень gzip (1-9) или качество brotli (0-11)."""
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if level is None else level)
+    return gzip.compress(data, compresslevel=9 if level is None else level, mtime=0)
+
+
+class StreamCompressor:
+    """Потоковое сжатие для ответов, которые отдаются по частям."""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=level)
+        else:
+            # wbits=31: zlib-поток с заголовком и контрольной суммой gzip
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(chunk) + self._brotli.flush()
+        return self._zlib.compress(chunk) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush()
@@ -0,0 +1,150 @@
+"""
+Генератор уникальных, упорядоченных по времени ID (в стиле snowflake).
+
+Структура ID (53 бита, чтобы значение точно передавалось в JavaScript
+как Number без потери точности):
+
+    | 41 бит: миллисекунды от EPOCH | 5 бит: ID воркера | 7 бит: счётчик |
+
+Каждый процесс получает собственный ID воркера, поэтому ID, выданные
+разными воркерами, не пересекаются без общей блокировки. Так как старшие
+биты - это время, диапазон ID соответствует диапазону времени.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+EPOCH_MS = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+WORKER_BITS = 5
+SEQUENCE_BITS = 7
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = WORKER_BITS + SEQUENCE_BITS
+
+WORKER_LOCK_DIR = os.getenv(
+    "ID_WORKER_LOCK_DIR", os.path.join(tempfile.gettempdir(), "sport-shop-id-workers")
+)
+
+
+def _claim_worker_id() -> int:
+    """
+    Выбирает ID воркера для текущего процесса.
+
+    Приоритет у переменной окружения WORKER_ID (нужна при запуске на
+    нескольких серверах). Иначе процесс захватывает первый свободный
+    lock-файл в WORKER_LOCK_DIR и держит его до завершения, так что два
+    живых процесса на одной машине не получат одинаковый ID.
+
+    Если свободного ID нет или lock-файлы недоступны, бросает RuntimeError:
+    выдавать ID с чужим номером воркера нельзя - это дубли order_id.
+    """
+    env_worker = os.getenv("WORKER_ID")
+    if env_worker is not None:
+        try:
+            worker_id = int(env_worker)
+        except ValueError:
+            worker_id = -1
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise RuntimeError(
+                f"WORKER_ID={env_worker!r}: ожидается целое число от 0 до {MAX_WORKER_ID}."
+            )
+        return worker_id
+    if fcntl is None:
+        logging.warning(
+            "Нет fcntl: ID воркера берётся из PID и может совпасть у разных процессов. "
+            "Задайте WORKER_ID для каждого процесса."
+        )
+        return os.getpid() & MAX_WORKER_ID
+    try:
+        os.makedirs(WORKER_LOCK_DIR, exist_ok=True)
+        for worker_id in range(MAX_WORKER_ID + 1):
+            fd = os.open(
+                os.path.join(WORKER_LOCK_DIR, f"{worker_id}.lock"),
+                os.O_RDWR | os.O_CREAT,
+                0o644,
+            )
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            # Дескриптор намеренно не закрывается: блокировка живёт
+            # вместе с процессом и снимается ОС при его завершении.
+            return worker_id
+    except OSError as e:
+        logging.error("Не удалось захватить ID воркера через lock-файл: %s", e)
+        raise RuntimeError(
+            f"Не удалось захватить ID воркера в {WORKER_LOCK_DIR}: {e}. Задайте WORKER_ID."
+        ) from e
+    logging.error("Все %d ID воркеров заняты (%s).", MAX_WORKER_ID + 1, WORKER_LOCK_DIR)
+    raise RuntimeError(
+        f"Все {MAX_WORKER_ID + 1} ID воркеров заняты живыми процессами: "
+        f"уменьшите число воркеров или задайте WORKER_ID."
+    )
+
+
+class IdGenerator:
+    """Потокобезопасный генератор ID для одного процесса."""
+
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"ID воркера должен быть в диапазоне 0..{MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self) -> int:
+        with self._lock:
+            now_ms = _now_ms()
+            if now_ms < self._last_ms:
+                # Часы ушли назад: продолжаем от последнего выданного времени.
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # Счётчик в этой миллисекунде исчерпан - ждём следующую.
+                    while now_ms <= self._last_ms:
+                        time.sleep(0.0001)
+                        now_ms = _now_ms()
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (
+                ((now_ms - EPOCH_MS) << TIMESTAMP_SHIFT)
+                | (self.worker_id << SEQUENCE_BITS)
+                | self._sequence
+            )
+
+
+def _now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+_generator: Optional[IdGenerator] = None
+_generator_pid: Optional[int] = None
+_generator_lock = threading.Lock()
+
+
+def generate_id() -> int:
+    """
+    Выдаёт следующий ID. Генератор создаётся при первом вызове в процессе
+    (и заново после fork, чтобы воркеры не унаследовали ID родителя).
+    """
+    global _generator, _generator_pid
+    if _generator is None or _generator_pid != os.getpid():
+        with _generator_lock:
+            if _generator is None or _generator_pid != os.getpid():
+                _generator = IdGenerator(_claim_worker_id())
+                _generator_pid = os.getpid()
+    return _generator.next_id()
@@ -0,0 +1,60 @@
+"""
+Неблокирующее логирование приложения.
+
+Корневой логгер пишет не напрямую в обработчики (консоль, файл), а в очередь
+в памяти; вывод выполняет фоновый поток QueueListener. Поэтому медленный
+stderr или диск не задерживают обработку запросов.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Фильтр общий с плагином Admitad: приложение и так импортирует плагин,
+# а плагин кода приложения не импортирует.
+from backend.admitad_postback_plugin.log_queue import DebugSampler
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+# Доля DEBUG-записей, попадающих в лог (1.0 - все, 0.01 - каждая сотая).
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+_listener = None
+
+
+def setup_logging():
+    """
+    Переводит корневой логгер на очередь. Уже настроенные обработчики
+    (если есть) переносятся за QueueListener, иначе используется вывод в stderr.
+    Повторный вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    if not handlers:
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers = [console]
+    for handler in handlers:
+        root.removeHandler(handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE_RATE))
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(_listener.stop)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_listener.start)
+    return _listener
@@ -1,42 +1,44 @@
+import asyncio
 import logging
 import random
-import math
-import time
 from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Tuple
+
+import orjson
+from pydantic import TypeAdapter, ValidationError
+from starlette.concurrency import run_in_threadpool
 
 from backend import db
 from backend.models import Order, EventRegistration, Transaction, CardDetails
+from backend.services import pricing
+from backend.services.id_generator import generate_id
+from backend.services.metrics import STAGE_SECONDS
+
+_ORDERS_ADAPTER = TypeAdapter(List[Order])
 
 
-def process_new_order(order: Order) -> dict:
+async def process_new_order(order: Order) -> dict:
     """
     Полный цикл обработки нового заказа: проверка, симуляция оплаты,
     сохранение транзакции и вызов трекинга.
     """
-    logging.info(f"СЕРВИС: Начало обработки заказа для {order.user_email}...")
-    time.sleep(1)
+    logging.info("СЕРВИС: Начало обработки заказа для %s...", order.user_email)
+    await _simulate_bank_latency()
     try:
-        # 1. Серверная валидация суммы
-        server_total = sum(item.price * item.quantity for item in order.items)
-        if not math.isclose(server_total, order.total_amount):
-            raise ValueError("Сумма заказа не совпадает.")
-
-        # 2. Симуляция банковской операции
-        payment_result = {"status": "success"}
-        if order.payment_method == "card":
-            if not order.card_details:
-                raise ValueError("Данные карты обязательны при онлайн-оплате.")
-            payment_result = _simulate_bank_processing(order.card_details)
-            if payment_result["status"] == "failed":
-                raise ValueError(payment_result["reason"])
-
-        # 3. Создание и сохранение транзакции
-        order_id = random.randint(1000, 9999)
-        transaction = _create_and_save_transaction(
+        # 1-2. Расчёт корзины по ценам каталога и симуляция банковской операции
+        server_total, payment_result = _price_and_pay(order)
+
+        # 3. Создание и сохранение транзакции (запись на диск - в пуле потоков,
+        # чтобы fsync журнала или ожидание блокировки SQLite не останавливали
+        # цикл событий)
+        order_id = generate_id()
+        transaction = await run_in_threadpool(
+            _create_and_save_transaction,
             order_id=order_id,
             transaction_id=payment_result.get("transaction_id"),
             user_email=order.user_email,
-            amount=server_total,
+            amount=float(server_total),
             payment_method=order.payment_method,
             admitad_uid=order.admitad_uid,
         )
@@ -44,45 +46,136 @@ def process_new_order(order: Order) -> dict:
         # 4. Вызов сервиса трекинга
         # tracking_service.send_postback_to_admitad(transaction)
 
-        logging.info(f"СЕРВИС: Новый заказ #{order_id} успешно обработан.")
-        return {"order_id": order_id, "total_amount": server_total}
+        logging.info("СЕРВИС: Новый заказ #%s успешно обработан.", order_id)
+        return {"order_id": order_id, "total_amount": float(server_total)}
     except ValueError as e:
         # 4. Добавляем логирование ошибок
-        logging.error(f"Ошибка валидации при обработке заказа: {e}")
+        logging.error("Ошибка валидации при обработке заказа: %s", e)
         # Передаём ошибку дальше, чтобы FastAPI вернул корректный ответ
         raise e
 
 
-def process_event_registration(registration: EventRegistration) -> dict:
+async def process_bulk_orders(lines: List[bytes]) -> List[dict]:
+    """
+    Пакетная обработка заказов из NDJSON (по одному заказу в строке).
+
+    Все строки разбираются и валидируются одним вызовом TypeAdapter,
+    задержка банка имитируется один раз на пакет, а все транзакции
+    сохраняются одной групповой записью. Разбор, валидация, расчёт цен
+    и запись выполняются в пуле потоков: на тысячах строк это секунды
+    работы процессора, которые иначе остановили бы цикл событий.
+    Возвращает результат по каждой непустой строке (номер строки
+    начинается с 1).
+    """
+    results: Dict[int, dict] = {}
+    orders = await run_in_threadpool(_parse_bulk_orders, lines, results)
+    if orders:
+        await _simulate_bank_latency()
+    transactions = await run_in_threadpool(_price_bulk_orders, orders, results)
+
+    with STAGE_SECONDS.time("save_transaction_batch"):
+        await run_in_threadpool(db.append_transactions, transactions)
+    logging.info(
+        "СЕРВИС: Пакет заказов обработан: принято %d из %d.", len(transactions), len(results)
+    )
+    return [results[number] for number in sorted(results)]
+
+
+def _parse_bulk_orders(lines: List[bytes], results: Dict[int, dict]) -> List[Tuple[int, Order]]:
+    """Разбирает строки NDJSON и валидирует заказы; ошибки пишутся в `results`."""
+    line_numbers: List[int] = []
+    payloads: List[Any] = []
+    for number, raw in enumerate(lines, start=1):
+        if not raw.strip():
+            continue
+        try:
+            payloads.append(orjson.loads(raw))
+            line_numbers.append(number)
+        except orjson.JSONDecodeError as e:
+            results[number] = {
+                "line": number,
+                "status": "error",
+                "detail": f"Некорректный JSON: {e}",
+            }
+    return _validate_orders(payloads, line_numbers, results)
+
+
+def _price_bulk_orders(orders: List[Tuple[int, Order]], results: Dict[int, dict]) -> List[dict]:
+    """Рассчитывает и оплачивает заказы пакета; возвращает транзакции для записи."""
+    transactions = []
+    for number, order in orders:
+        try:
+            server_total, payment_result = _price_and_pay(order)
+        except ValueError as e:
+            results[number] = {"line": number, "status": "error", "detail": str(e)}
+            continue
+        order_id = generate_id()
+        transactions.append(
+            _build_transaction(
+                validated=True,
+                order_id=order_id,
+                transaction_id=payment_result.get("transaction_id"),
+                user_email=order.user_email,
+                amount=float(server_total),
+                payment_method=order.payment_method,
+                admitad_uid=order.admitad_uid,
+            )
+        )
+        results[number] = {
+            "line": number,
+            "status": "success",
+            "order_id": order_id,
+            "total_amount": float(server_total),
+        }
+    return transactions
+
+
+async def process_event_registration(registration: EventRegistration) -> dict:
     """
     Полный цикл обработки записи на мероприятие.
+    Повторная запись и запись на мероприятие без свободных мест отклоняются
+    (DuplicateRegistrationError / EventFullError).
     """
-    logging.info(f"СЕРВИС: Начало обработки записи для {registration.user_email}...")
-    time.sleep(1)
+    logging.info("СЕРВИС: Начало обработки записи для %s...", registration.user_email)
+    await _simulate_bank_latency()
     try:
-        registration_id = random.randint(10000, 99999)
-
-        # Запись на мероприятие тоже является транзакцией (с нулевой суммой)
-        transaction = _create_and_save_transaction(
-            order_id=registration_id,
-            user_email=registration.user_email,
-            amount=0.0,
-            payment_method="event_registration",
-            admitad_uid=registration.admitad_uid,
-        )
+        registration_id = generate_id()
+        record = {"registration_id": registration_id, **registration.model_dump(mode="json")}
+
+        # Место занимается атомарно вместе с сохранением записи
+        # (BEGIN IMMEDIATE может ждать блокировку - в пуле потоков)
+        with STAGE_SECONDS.time("save_registration"):
+            event = await run_in_threadpool(db.register_for_event, record)
+
+        # Запись на мероприятие тоже является транзакцией (с нулевой суммой).
+        # Если транзакцию сохранить не удалось, место освобождается: иначе
+        # повторная попытка получила бы отказ "уже записаны".
+        try:
+            transaction = await run_in_threadpool(
+                _create_and_save_transaction,
+                order_id=registration_id,
+                user_email=registration.user_email,
+                amount=0.0,
+                payment_method="event_registration",
+                admitad_uid=registration.admitad_uid,
+            )
+        except Exception:
+            await run_in_threadpool(db.cancel_event_registration, record)
+            raise
 
         # Вызов сервиса трекинга
         # tracking_service.send_postback_to_admitad(transaction)
 
-        logging.info(f"СЕРВИС: Новая запись #{registration_id} успешно обработана.")
+        logging.info("СЕРВИС: Новая запись #%s успешно обработана.", registration_id)
         return {
             "registration_id": registration_id,
             "user_name": registration.user_name,
             "event_name": registration.event_name,
+            "seats_remaining": event["remaining"],
         }
     except ValueError as e:
         # Добавляем логирование ошибок
-        logging.error(f"Ошибка валидации при обработке регистрации: {e}")
+        logging.error("Ошибка валидации при обработке регистрации: %s", e)
         # Передаём ошибку дальше, чтобы FastAPI вернул корректный ответ
         raise e
 
@@ -90,6 +183,65 @@ def process_event_registration(registration: EventRegistration) -> dict:
 # --- Приватные вспомогательные функции, используемые только внутри этого сервиса ---
 
 
+async def _simulate_bank_latency():
+    """Неблокирующая имитация задержки ответа банка (не занимает поток)."""
+    if db.BANK_LATENCY_SECONDS > 0:
+        with STAGE_SECONDS.time("bank_latency"):
+            await asyncio.sleep(db.BANK_LATENCY_SECONDS)
+
+
+def _price_and_pay(order: Order) -> Tuple[Decimal, dict]:
+    """
+    Рассчитывает заказ по ценам каталога (цены от клиента не используются)
+    и проводит оплату картой. При ошибке выбрасывает ValueError.
+    """
+    with STAGE_SECONDS.time("validation"):
+        quote = pricing.quote_cart((item.product_id, item.quantity) for item in order.items)
+        server_total = quote["total_amount"]
+        if pricing.to_money(order.total_amount) != server_total:
+            raise ValueError("Сумма заказа не совпадает с ценами каталога.")
+
+    payment_result = {"status": "success"}
+    if order.payment_method == "card":
+        if not order.card_details:
+            raise ValueError("Данные карты обязательны при онлайн-оплате.")
+        payment_result = _simulate_bank_processing(order.card_details)
+        if payment_result["status"] == "failed":
+            raise ValueError(payment_result["reason"])
+    return server_total, payment_result
+
+
+def _validate_orders(
+    payloads: List[Any], line_numbers: List[int], results: Dict[int, dict]
+) -> List[Tuple[int, Order]]:
+    """
+    Валидирует все заказы пакета одним вызовом TypeAdapter. Если часть строк
+    невалидна, ошибки записываются в `results`, а остальные строки
+    валидируются повторно (тоже одним вызовом).
+    """
+    if not payloads:
+        return []
+    try:
+        with STAGE_SECONDS.time("validation_batch"):
+            orders = _ORDERS_ADAPTER.validate_python(payloads)
+        return list(zip(line_numbers, orders))
+    except ValidationError as e:
+        errors: Dict[int, List[str]] = {}
+        for error in e.errors(include_url=False):
+            index, *loc = error["loc"]
+            field = ".".join(map(str, loc))
+            message = f"{field}: {error['msg']}" if field else error["msg"]
+            errors.setdefault(index, []).append(message)
+    for index, messages in errors.items():
+        number = line_numbers[index]
+        results[number] = {"line": number, "status": "error", "detail": "; ".join(messages)}
+    valid = [i for i in range(len(payloads)) if i not in errors]
+    return _validate_orders(
+        [payloads[i] for i in valid], [line_numbers[i] for i in valid], results
+    )
+
+
+@STAGE_SECONDS.time("bank_processing")
 def _simulate_bank_processing(card: CardDetails) -> dict:
     is_valid = all(
         getattr(card, key) == value for key, value in db.TEST_CARD_DATA.items()
@@ -102,14 +254,25 @@ def _simulate_bank_processing(card: CardDetails) -> dict:
     return {"status": "failed", "reason": "Неверные данные карты."}
 
 
+@STAGE_SECONDS.time("save_transaction")
 def _create_and_save_transaction(**kwargs) -> dict:
     """Создает, сохраняет транзакцию и возвращает ее в виде словаря."""
+    transaction_dict = _build_transaction(**kwargs)
+    db.append_transaction(transaction_dict)
+    return transaction_dict
+
+
+def _build_transaction(validated: bool = False, **kwargs) -> dict:
+    """
+    Создает транзакцию и возвращает ее в виде словаря (без сохранения).
+    validated=True - поля уже проверены вместе с заказом, повторная
+    валидация (в т.ч. дорогая проверка email) пропускается.
+    """
     if "timestamp" not in kwargs:
         kwargs["timestamp"] = datetime.now()
 
-    new_transaction = Transaction(**kwargs)
-    transaction_dict = new_transaction.dict(exclude_none=True)
-
-    db.TRANSACTIONS_DB.append(transaction_dict)
-    db.save_transactions(db.TRANSACTIONS_DB)
-    return transaction_dict
+    if validated:
+        new_transaction = Transaction.model_construct(**kwargs)
+    else:
+        new_transaction = Transaction(**kwargs)
+    return new_transaction.dict(exclude_none=True)
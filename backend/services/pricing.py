@@ -0,0 +1,76 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, Optional, Tuple
+
+from backend import db
+from backend.storage.catalog import ProductCatalog
+
+# Денежные суммы округляются до копеек.
+MONEY_QUANT = Decimal("0.01")
+
+
+def to_money(value) -> Decimal:
+    """Приводит сумму к Decimal с точностью до копеек."""
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+
+
+def quote_cart(
+    items: Iterable[Tuple[int, int]], catalog: Optional[ProductCatalog] = None
+) -> dict:
+    """
+    Рассчитывает корзину по ценам каталога.
+
+    `items` - пары (product_id, quantity). Повторяющиеся товары
+    объединяются, все товары ищутся в каталоге одним пакетным запросом,
+    суммы считаются в Decimal. Цены от клиента не используются.
+    Если каких-то товаров нет в каталоге, выбрасывается ValueError.
+    """
+    catalog = catalog or db.CATALOG
+    quantities: Dict[int, int] = {}
+    for product_id, quantity in items:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+    products = catalog.get_many(quantities)
+    missing = [product_id for product_id in quantities if product_id not in products]
+    if missing:
+        raise ValueError(f"Товары не найдены в каталоге: {', '.join(map(str, missing))}.")
+
+    lines = []
+    total = Decimal(0)
+    for product_id, quantity in quantities.items():
+        product = products[product_id]
+        unit_price = catalog.price(product_id)
+        line_total = to_money(unit_price * quantity)
+        total += line_total
+        lines.append(
+            {
+                "product_id": product_id,
+                "sku": product.get("sku"),
+                "name": product.get("name"),
+                "unit_price": to_money(unit_price),
+                "quantity": quantity,
+                "line_total": line_total,
+            }
+        )
+    return {
+        "items": lines,
+        "total_amount": to_money(total),
+        "catalog_version": catalog.version,
+    }
+
+
+def quote_to_json(quote: dict) -> dict:
+    """Переводит Decimal-суммы расчёта в числа для JSON-ответа."""
+    return {
+        **quote,
+        "items": [
+            {
+                **line,
+                "unit_price": float(line["unit_price"]),
+                "line_total": float(line["line_total"]),
+            }
+            for line in quote["items"]
+        ],
+        "total_amount": float(quote["total_amount"]),
+    }
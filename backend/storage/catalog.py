@@ -0,0 +1,229 @@
+import hashlib
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from typing import Iterable, List, Dict, Any, Optional, Tuple
+
+import orjson
+
+# Слово для полнотекстового поиска - последовательность букв и цифр.
+_TOKEN_RE = re.compile(r"\w+")
+# Списки длиннее 1/_DENSE_RATIO каталога дополняются битовой картой.
+_DENSE_RATIO = 64
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на слова для поиска (без учёта регистра, ё = е)."""
+    return _TOKEN_RE.findall(text.casefold().replace("ё", "е"))
+
+
+class ProductCatalog:
+    """
+    Неизменяемый снимок каталога товаров с индексами.
+
+    Все индексы строятся один раз при создании объекта, поэтому поиск
+    товара по ID и выборка по категории не зависят от размера каталога.
+    Полный список товаров и список категорий сразу сериализуются в JSON:
+    эти байты отдаются без повторного кодирования на каждый запрос и
+    заменяются вместе со снимком каталога при его перезагрузке.
+
+    `version` - хеш содержимого каталога, используется как ETag,
+    `last_modified` - время изменения файла каталога (для Last-Modified).
+    Цены товаров заранее переведены в Decimal для расчёта корзины.
+
+    Для поиска товары упорядочены по цене: позиция товара в этом порядке
+    (ранг) хранится в обратном индексе слов названия и описания и в индексе
+    категорий. Диапазон цен - это диапазон рангов (бинарный поиск по
+    отсортированному массиву цен), а списки рангов уже отсортированы по
+    цене, поэтому поиск не перебирает каталог и не сортирует результат.
+    """
+
+    def __init__(
+        self, products: List[Dict[str, Any]], last_modified: Optional[float] = None
+    ):
+        self.products = products
+        self.last_modified = last_modified
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        self._by_category: Dict[str, List[Dict[str, Any]]] = {}
+        self._prices: Dict[int, Decimal] = {}
+        category_names = set()
+        for product in products:
+            self._by_id[product["id"]] = product
+            # str() убирает двоичный хвост float: 0.1 -> Decimal("0.1")
+            self._prices[product["id"]] = Decimal(str(product["price"]))
+            category = product["category"]
+            category_names.add(category)
+            self._by_category.setdefault(category.casefold(), []).append(product)
+        self.categories: List[str] = sorted(category_names)
+        self._build_search_index(products)
+        self.products_json: bytes = orjson.dumps(products)
+        self.categories_json: bytes = orjson.dumps(self.categories)
+        self.version: str = hashlib.sha256(self.products_json).hexdigest()[:16]
+        self.etag: str = f'"{self.version}"'
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def get(self, product_id: int) -> Optional[Dict[str, Any]]:
+        """Возвращает товар по ID или None."""
+        return self._by_id.get(product_id)
+
+    def get_many(self, product_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """Возвращает найденные товары по списку ID одним проходом."""
+        by_id = self._by_id
+        return {pid: by_id[pid] for pid in product_ids if pid in by_id}
+
+    def price(self, product_id: int) -> Decimal:
+        """Цена товара в Decimal (KeyError, если товара нет)."""
+        return self._prices[product_id]
+
+    def in_category(self, category: str) -> List[Dict[str, Any]]:
+        """Возвращает товары категории (без учёта регистра)."""
+        return self._by_category.get(category.casefold(), [])
+
+    # --- Поиск ---
+
+    def _build_search_index(self, products: List[Dict[str, Any]]):
+        ranked = sorted(products, key=lambda p: (float(p["price"]), p["id"]))
+        self._ranked: List[Dict[str, Any]] = ranked
+        self._sorted_prices = array("d", (float(p["price"]) for p in ranked))
+        # слово / категория -> ранги товаров по возрастанию
+        postings: Dict[str, array] = {}
+        categories: Dict[str, array] = {}
+        for rank, product in enumerate(ranked):
+            text = f"{product.get('name') or ''} {product.get('description') or ''}"
+            for token in set(tokenize(text)):
+                ranks = postings.get(token)
+                if ranks is None:
+                    ranks = postings[token] = array("I")
+                ranks.append(rank)
+            ranks = categories.get(product["category"].casefold())
+            if ranks is None:
+                ranks = categories[product["category"].casefold()] = array("I")
+            ranks.append(rank)
+        size = len(ranked)
+        dense = max(size // _DENSE_RATIO, 1)
+        self._postings = {k: _Term(v, dense, size) for k, v in postings.items()}
+        self._category_terms = {k: _Term(v, dense, size) for k, v in categories.items()}
+
+    def search(
+        self,
+        query: str = "",
+        category: Optional[str] = None,
+        price_min: Optional[float] = None,
+        price_max: Optional[float] = None,
+        descending: bool = False,
+        offset: int = 0,
+        limit: int = 20,
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Ищет товары, в названии или описании которых есть все слова `query`,
+        с фильтром по категории и цене (границы включительно). Результат
+        отсортирован по цене. Возвращает (всего найдено, страница товаров).
+        """
+        low = 0 if price_min is None else bisect_left(self._sorted_prices, price_min)
+        high = (
+            len(self._ranked)
+            if price_max is None
+            else bisect_right(self._sorted_prices, price_max)
+        )
+        terms = [self._postings.get(token) for token in set(tokenize(query))]
+        if category:
+            terms.append(self._category_terms.get(category.casefold()))
+        if None in terms or low >= high:
+            return 0, []
+
+        sparse = sorted((t.ranks for t in terms if t.bitmap is None), key=len)
+        dense = [t.bitmap for t in terms if t.bitmap is not None]
+        if not terms:
+            matched = range(low, high)
+        elif sparse:
+            # Идём по самому короткому списку (только в пределах диапазона
+            # цен), остальные списки проверяем бинарным поиском,
+            # битовые карты - чтением одного байта.
+            shortest, others = sparse[0], sparse[1:]
+            start, stop = bisect_left(shortest, low), bisect_left(shortest, high)
+            if not others and not dense:
+                matched = shortest[start:stop]
+            else:
+                matched = [
+                    rank
+                    for rank in shortest[start:stop]
+                    if all(_contains(ranks, rank) for ranks in others)
+                    and all(bitmap[rank >> 3] >> (rank & 7) & 1 for bitmap in dense)
+                ]
+        else:
+            # Только частые слова: пересечение - побитовое И длинных чисел.
+            bits = (1 << high) - (1 << low)
+            for bitmap in dense:
+                bits &= int.from_bytes(bitmap, "little")
+            total = bits.bit_count()
+            page = _bit_page(bits, total, offset, limit, descending)
+            return total, [self._ranked[rank] for rank in page]
+
+        total = len(matched)
+        if descending:
+            page = matched[max(total - offset - limit, 0) : max(total - offset, 0)][::-1]
+        else:
+            page = matched[offset : offset + limit]
+        return total, [self._ranked[rank] for rank in page]
+
+
+class _Term:
+    """
+    Список рангов товаров для слова или категории. Для частых слов
+    (больше 1/_DENSE_RATIO каталога) дополнительно хранится битовая карта:
+    проверка ранга - чтение байта, пересечение - побитовое И.
+    """
+
+    __slots__ = ("ranks", "bitmap")
+
+    def __init__(self, ranks: array, dense_from: int, size: int):
+        self.ranks = ranks
+        self.bitmap: Optional[bytes] = None
+        if len(ranks) >= dense_from:
+            bitmap = bytearray((size + 7) >> 3)
+            for rank in ranks:
+                bitmap[rank >> 3] |= 1 << (rank & 7)
+            self.bitmap = bytes(bitmap)
+
+
+def _contains(ranks: array, rank: int) -> bool:
+    index = bisect_left(ranks, rank)
+    return index < len(ranks) and ranks[index] == rank
+
+
+def _bit_page(bits: int, total: int, offset: int, limit: int, descending: bool) -> List[int]:
+    """Номера установленных битов `bits` для страницы (offset, limit)."""
+    if offset >= total:
+        return []
+    page = []
+    if descending:
+        # Первый бит страницы - (total - 1 - offset)-й по возрастанию.
+        top = _select(bits, total - 1 - offset)
+        bits &= (1 << (top + 1)) - 1
+        while bits and len(page) < limit:
+            rank = bits.bit_length() - 1
+            page.append(rank)
+            bits ^= 1 << rank
+    else:
+        base = _select(bits, offset) if offset else 0
+        bits >>= base
+        while bits and len(page) < limit:
+            lowest = bits & -bits
+            page.append(base + lowest.bit_length() - 1)
+            bits ^= lowest
+    return page
+
+
+def _select(bits: int, k: int) -> int:
+    """Позиция k-го (с нуля) установленного бита - бинарным поиском по bit_count."""
+    lo, hi = 0, bits.bit_length() - 1
+    while lo < hi:
+        middle = (lo + hi) // 2
+        if (bits & ((1 << (middle + 1)) - 1)).bit_count() > k:
+            hi = middle
+        else:
+            lo = middle + 1
+    return lo
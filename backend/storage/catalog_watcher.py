@@ -0,0 +1,74 @@
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+
+class CatalogWatcher:
+    """
+    Следит за файлом каталога и перезагружает его без перезапуска сервера.
+
+    Фоновый поток раз в `interval` секунд сравнивает mtime и размер файла.
+    Новый каталог разбирается и индексируется в этом же потоке, вне
+    обработки запросов, и только готовый снимок передаётся в `on_reload`.
+    Если файл не разбирается (например, записан не до конца), остаётся
+    старый каталог, а попытка повторится после следующего изменения файла.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        load: Callable[[], object],
+        on_reload: Callable[[object], None],
+        interval: float = 2.0,
+    ):
+        self.path = Path(path)
+        self.load = load
+        self.on_reload = on_reload
+        self.interval = interval
+        self._seen = self._signature()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Запускает фоновый поток наблюдения (если интервал больше нуля)."""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="catalog-watcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self) -> bool:
+        """Перезагружает каталог, если файл изменился. Возвращает True при замене."""
+        signature = self._signature()
+        if signature is None or signature == self._seen:
+            return False
+        self._seen = signature
+        try:
+            catalog = self.load()
+        except Exception as e:
+            logging.error(
+                "Каталог %s изменён, но не загружен: %s. Используется предыдущая версия.",
+                self.path.name,
+                e,
+            )
+            return False
+        self.on_reload(catalog)
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def _signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
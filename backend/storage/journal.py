@@ -0,0 +1,396 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections.abc import Sequence
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+import orjson
+
+# Заголовок файла индекса смещений: сигнатура, inode журнала,
+# размер проиндексированной части журнала и число записей.
+_INDEX_MAGIC = b"JIDX0001"
+_INDEX_HEADER = struct.Struct("<8sQQQ")
+
+
+def _dump_line(record: Dict[str, Any]) -> bytes:
+    """Сериализует одну запись журнала в строку JSON Lines."""
+    line = json.dumps(record, ensure_ascii=False, default=str, separators=(",", ":"))
+    return (line + "\n").encode("utf-8")
+
+
+class JsonlJournal:
+    """
+    Журнал в формате JSON Lines, в который записи только дописываются.
+
+    Каждая запись - одна строка, поэтому стоимость записи не зависит от
+    размера истории. fsync выполняется пачками: после `fsync_every` записей
+    или если с прошлого fsync прошло больше `fsync_interval` секунд. Если
+    новых записей нет, хвост сбрасывает на диск таймер через `fsync_interval`.
+
+    Рядом с журналом хранится индекс смещений строк (`<журнал>.idx`).
+    С ним `open_records` не читает историю при старте: журнал отображается
+    в память (mmap), а запись разбирается только при обращении к ней.
+    При старте дочитывается лишь хвост журнала, дописанный после
+    последнего сохранения индекса.
+    """
+
+    def __init__(self, path: Path, fsync_every: int = 32, fsync_interval: float = 1.0):
+        self.path = Path(path)
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._sync_timer: Optional[threading.Timer] = None
+        if hasattr(os, "register_at_fork"):
+            # Таймер и блокировка родителя в дочернем процессе недействительны.
+            os.register_at_fork(after_in_child=self._after_fork)
+        self.index_path = self.path.with_suffix(self.path.suffix + ".idx")
+        # Индекс смещений ведётся только после open_records().
+        self._indexed = False
+        self._index_base: Sequence = ()
+        self._index_extra = array("Q")
+        self._size = 0
+
+    # --- Восстановление после сбоя ---
+
+    def recover(self) -> List[Dict[str, Any]]:
+        """
+        Читает журнал и возвращает все корректные записи.
+
+        Оборванная последняя строка (запись, прерванная падением процесса)
+        отрезается. Повреждённые строки в середине пропускаются, после чего
+        журнал компактируется, чтобы не разбирать их при каждом старте.
+        """
+        if not self.path.exists():
+            return []
+
+        records: List[Dict[str, Any]] = []
+        damaged = 0
+        good_size = 0
+        with open(self.path, "rb") as f:
+            for raw in f:
+                complete = raw.endswith(b"\n")
+                try:
+                    record = json.loads(raw) if raw.strip() else None
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    record = None
+                    if complete:
+                        damaged += 1
+                if record is not None:
+                    records.append(record)
+                if complete:
+                    good_size += len(raw)
+                elif record is not None:
+                    # Запись целая, не хватает только перевода строки.
+                    good_size += len(raw)
+                    with open(self.path, "r+b") as fix:
+                        fix.truncate(good_size)
+                        fix.seek(good_size)
+                        fix.write(b"\n")
+                    good_size += 1
+                    break
+                else:
+                    logging.warning(
+                        "Журнал %s: отрезана оборванная запись (%d байт) после сбоя.",
+                        self.path.name,
+                        len(raw),
+                    )
+                    with open(self.path, "r+b") as fix:
+                        fix.truncate(good_size)
+                    break
+
+        if damaged:
+            logging.error(
+                "Журнал %s: пропущено повреждённых записей: %d. Выполняется компакция.",
+                self.path.name,
+                damaged,
+            )
+            self.compact(records)
+        return records
+
+    # --- Запись ---
+
+    def append(self, record: Dict[str, Any]):
+        """Дописывает одну запись в конец журнала."""
+        self.append_many([record])
+
+    def append_many(self, records: Iterable[Dict[str, Any]]):
+        """Дописывает группу записей одним вызовом write."""
+        lines = [_dump_line(r) for r in records]
+        if not lines:
+            return
+        data = b"".join(lines)
+        with self._lock:
+            f = self._ensure_open()
+            f.write(data)
+            if self._indexed:
+                for line in lines:
+                    self._index_extra.append(self._size)
+                    self._size += len(line)
+            f.flush()
+            self._pending += len(lines)
+            now = time.monotonic()
+            if (
+                self._pending >= self.fsync_every
+                or now - self._last_sync >= self.fsync_interval
+            ):
+                self._fsync(f, now)
+            elif self._sync_timer is None:
+                self._schedule_sync(now)
+
+    def sync(self):
+        """Принудительно сбрасывает накопленные записи на диск."""
+        with self._lock:
+            if self._file is not None and self._pending:
+                self._fsync(self._file, time.monotonic())
+
+    def _schedule_sync(self, now: float):
+        """Запускает таймер fsync хвоста (вызывается под self._lock)."""
+        delay = max(self.fsync_interval - (now - self._last_sync), 0.0)
+        self._sync_timer = threading.Timer(delay, self._timed_sync)
+        self._sync_timer.daemon = True
+        self._sync_timer.start()
+
+    def _timed_sync(self):
+        with self._lock:
+            self._sync_timer = None
+            if self._file is not None and self._pending:
+                self._fsync(self._file, time.monotonic())
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._sync_timer = None
+
+    def compact(self, records: Iterable[Dict[str, Any]]):
+        """
+        Атомарно переписывает журнал заданным набором записей.
+        Новый файл пишется рядом и подменяет старый через os.replace,
+        поэтому при сбое на диске остаётся либо старая, либо новая версия.
+        """
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        offsets = array("Q")
+        size = 0
+        with self._lock:
+            with open(tmp_path, "wb") as tmp:
+                for record in records:
+                    line = _dump_line(record)
+                    offsets.append(size)
+                    size += len(line)
+                    tmp.write(line)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            self._close_file()
+            os.replace(tmp_path, self.path)
+            _fsync_dir(self.path.parent)
+            self._pending = 0
+            self._last_sync = time.monotonic()
+            if self._indexed:
+                self._index_base, self._index_extra, self._size = (), offsets, size
+                self._save_index()
+
+    def close(self):
+        """Сбрасывает данные на диск, сохраняет индекс и закрывает файл журнала."""
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            if self._file is not None and self._pending:
+                self._fsync(self._file, time.monotonic())
+            self._close_file()
+            if self._indexed and self._index_extra:
+                self._save_index()
+
+    # --- Ленивое чтение через индекс смещений ---
+
+    def open_records(self) -> "JournalRecords":
+        """
+        Возвращает записи журнала в виде ленивой последовательности.
+
+        Смещения строк берутся из сохранённого индекса (тоже через mmap,
+        без копирования), поэтому время старта почти не зависит от размера
+        истории. Строки, дописанные после сохранения индекса, проверяются
+        и добавляются в индекс; оборванная последняя строка отрезается,
+        повреждённые строки пропускаются.
+        """
+        with self._lock:
+            self._close_file()
+            if not self.path.exists():
+                self.path.touch()
+            stat = os.stat(self.path)
+            base, covered = self._load_index(stat)
+            extra, size, damaged = self._scan(covered)
+            if damaged:
+                logging.error(
+                    "Журнал %s: пропущено повреждённых записей: %d.",
+                    self.path.name,
+                    damaged,
+                )
+            self._indexed = True
+            self._index_base, self._index_extra, self._size = base, extra, size
+            if extra or not self.index_path.exists():
+                self._save_index()
+                saved, saved_size = self._load_index(os.stat(self.path))
+                if saved_size != size:
+                    # Индекс не сохранился - держим смещения в памяти.
+                    saved = array("Q", base)
+                    saved.extend(extra)
+                self._index_base, self._index_extra = saved, array("Q")
+            return JournalRecords(self._map(size), self._index_base)
+
+    def _load_index(self, stat: os.stat_result) -> Tuple[Sequence, int]:
+        """Отображает файл индекса в память. При несовпадении - пустой индекс."""
+        try:
+            with open(self.index_path, "rb") as f:
+                index_size = os.fstat(f.fileno()).st_size
+                if index_size < _INDEX_HEADER.size:
+                    return (), 0
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return (), 0
+        magic, inode, covered, count = _INDEX_HEADER.unpack_from(index)
+        valid = (
+            magic == _INDEX_MAGIC
+            and inode == stat.st_ino
+            and covered <= stat.st_size
+            and index_size == _INDEX_HEADER.size + count * 8
+            and (covered == 0 or self._byte_at(covered - 1) == b"\n")
+        )
+        if not valid:
+            index.close()
+            return (), 0
+        return memoryview(index)[_INDEX_HEADER.size:].cast("Q"), covered
+
+    def _byte_at(self, position: int) -> bytes:
+        with open(self.path, "rb") as f:
+            f.seek(position)
+            return f.read(1)
+
+    def _scan(self, start: int) -> Tuple[array, int, int]:
+        """
+        Проверяет строки журнала начиная с `start`. Возвращает смещения
+        корректных строк, размер журнала после исправлений и число
+        повреждённых строк.
+        """
+        offsets = array("Q")
+        damaged = 0
+        position = start
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            for raw in f:
+                complete = raw.endswith(b"\n")
+                valid = False
+                if raw.strip():
+                    try:
+                        orjson.loads(raw)
+                        valid = True
+                    except orjson.JSONDecodeError:
+                        damaged += complete
+                if complete:
+                    if valid:
+                        offsets.append(position)
+                    position += len(raw)
+                    continue
+                with open(self.path, "r+b") as fix:
+                    fix.truncate(position)
+                    if valid:
+                        # Запись целая, не хватает только перевода строки.
+                        fix.seek(position)
+                        fix.write(raw + b"\n")
+                        offsets.append(position)
+                        position += len(raw) + 1
+                    else:
+                        logging.warning(
+                            "Журнал %s: отрезана оборванная запись (%d байт) после сбоя.",
+                            self.path.name,
+                            len(raw),
+                        )
+                break
+        return offsets, position, damaged
+
+    def _save_index(self):
+        """Атомарно записывает индекс смещений (вызывается под self._lock)."""
+        count = len(self._index_base) + len(self._index_extra)
+        header = _INDEX_HEADER.pack(
+            _INDEX_MAGIC, os.stat(self.path).st_ino, self._size, count
+        )
+        tmp_path = self.index_path.with_suffix(self.index_path.suffix + ".tmp")
+        try:
+            with open(tmp_path, "wb") as tmp:
+                tmp.write(header)
+                tmp.write(bytes(self._index_base))
+                tmp.write(self._index_extra.tobytes())
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            # Индекс - только ускоритель старта: без него журнал будет перечитан.
+            logging.error("Не удалось сохранить индекс журнала %s: %s", self.path.name, e)
+
+    def _map(self, size: int) -> Optional[mmap.mmap]:
+        if size == 0:
+            return None
+        with open(self.path, "rb") as f:
+            return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+    # --- Внутренние методы ---
+
+    def _ensure_open(self):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        return self._file
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _fsync(self, f, now: float):
+        os.fsync(f.fileno())
+        self._pending = 0
+        self._last_sync = now
+
+
+def _fsync_dir(directory: Path):
+    """fsync каталога, чтобы переименование файла пережило сбой питания."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class JournalRecords(Sequence):
+    """
+    Записи журнала, отображённого в память. Запись разбирается из JSON
+    только при обращении к ней; страницы файла общие для всех процессов
+    через кэш ОС.
+    """
+
+    def __init__(self, data: Optional[mmap.mmap], offsets: Sequence):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(len(self))[position]]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("journal record index out of range")
+        start = self._offsets[position]
+        end = self._data.find(b"\n", start)
+        return orjson.loads(self._data[start:end])
@@ -0,0 +1,269 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS registrations ("
+    "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "event_key TEXT NOT NULL, "
+    "email_key TEXT NOT NULL, "
+    "data TEXT NOT NULL, "
+    "UNIQUE (event_key, email_key))",
+    "CREATE INDEX IF NOT EXISTS reg_event ON registrations (event_key, seq)",
+    "CREATE INDEX IF NOT EXISTS reg_user_email ON registrations (email_key, seq)",
+    # Счётчик занятых мест по мероприятию: меняется в той же транзакции
+    # SQLite, что и вставка записи.
+    "CREATE TABLE IF NOT EXISTS events ("
+    "event_key TEXT PRIMARY KEY, "
+    "event_name TEXT NOT NULL, "
+    "registered INTEGER NOT NULL)",
+)
+
+
+class RegistrationError(ValueError):
+    """Запись на мероприятие отклонена."""
+
+
+class DuplicateRegistrationError(RegistrationError):
+    """Пользователь уже записан на это мероприятие."""
+
+
+class EventFullError(RegistrationError):
+    """На мероприятии не осталось мест."""
+
+
+def event_key(name: str) -> str:
+    """Ключ мероприятия: без учёта регистра и лишних пробелов."""
+    return " ".join(str(name).split()).casefold()
+
+
+def email_key(email: str) -> str:
+    return str(email).strip().lower()
+
+
+class EventRegistrationStore:
+    """
+    Записи на мероприятия в SQLite (режим WAL), общие для всех воркеров.
+
+    Уникальный индекс (мероприятие, email) не даёт записаться дважды,
+    а счётчик мест в таблице events увеличивается только если место
+    есть - проверка, занятие места и вставка записи идут в одной
+    транзакции BEGIN IMMEDIATE, поэтому мест не продаётся больше,
+    чем задано, даже при одновременных запросах в разные воркеры.
+
+    Ёмкость мероприятий берётся из настроек (`capacities`, иначе
+    `default_capacity`; 0 - без ограничения) и не хранится в базе,
+    поэтому её можно менять без правки данных.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        capacities: Optional[Mapping[str, int]] = None,
+        default_capacity: int = 0,
+    ):
+        self.path = Path(path)
+        self.capacities = {event_key(name): int(value) for name, value in (capacities or {}).items()}
+        self.default_capacity = default_capacity
+        self._local = threading.local()
+        if hasattr(os, "register_at_fork"):
+            # Воркер после fork не должен пользоваться соединением родителя.
+            os.register_at_fork(after_in_child=self._after_fork)
+        db = self._conn()
+        for statement in _SCHEMA:
+            db.execute(statement)
+
+    # --- Соединения ---
+
+    def _after_fork(self):
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Отдельное соединение на поток: sqlite3 не любит общих соединений."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # --- Запись ---
+
+    def capacity(self, event_name: str) -> int:
+        """Число мест на мероприятии (0 - без ограничения)."""
+        return self.capacities.get(event_key(event_name), self.default_capacity)
+
+    def register(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Атомарно занимает место и сохраняет запись. Возвращает состояние
+        мероприятия после записи (см. `event_stats`).
+        Бросает DuplicateRegistrationError или EventFullError.
+        """
+        key = (event_key(record["event_name"]), email_key(record["user_email"]))
+        # Повторная запись отклоняется чтением, без блокировки записи;
+        # внутри транзакции проверка повторяется.
+        if self._exists(key):
+            raise DuplicateRegistrationError("Вы уже записаны на это мероприятие.")
+        capacity = self.capacity(record["event_name"])
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if self._exists(key):
+                db.execute("ROLLBACK")
+                raise DuplicateRegistrationError("Вы уже записаны на это мероприятие.")
+            db.execute(
+                "INSERT INTO events (event_key, event_name, registered) VALUES (?, ?, 0) "
+                "ON CONFLICT (event_key) DO NOTHING",
+                (key[0], record["event_name"]),
+            )
+            updated = db.execute(
+                "UPDATE events SET registered = registered + 1 "
+                "WHERE event_key = ? AND (? <= 0 OR registered < ?) RETURNING registered",
+                (key[0], capacity, capacity),
+            ).fetchall()
+            if not updated:
+                db.execute("ROLLBACK")
+                raise EventFullError("На это мероприятие не осталось мест.")
+            db.execute(
+                "INSERT INTO registrations (event_key, email_key, data) VALUES (?, ?, ?)",
+                (*key, json.dumps(record, ensure_ascii=False, default=str)),
+            )
+            db.execute("COMMIT")
+        except RegistrationError:
+            raise
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        return self._stats(record["event_name"], updated[0][0], capacity)
+
+    def cancel(self, record: Dict[str, Any]) -> bool:
+        """
+        Отменяет запись, сделанную `register(record)`, и освобождает место
+        (в одной транзакции). Удаляется только запись с тем же
+        registration_id. Возвращает False, если такой записи нет.
+        """
+        key = (event_key(record["event_name"]), email_key(record["user_email"]))
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = db.execute(
+                "DELETE FROM registrations WHERE event_key = ? AND email_key = ? "
+                "AND json_extract(data, '$.registration_id') IS ?",
+                (*key, record.get("registration_id")),
+            ).rowcount
+            if deleted:
+                db.execute(
+                    "UPDATE events SET registered = registered - 1 WHERE event_key = ?",
+                    (key[0],),
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return bool(deleted)
+
+    def import_if_empty(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Однократно переносит записи из старого хранилища в пустую базу
+        (повторные записи пропускаются) и пересчитывает счётчики мест.
+        """
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if db.execute("SELECT 1 FROM registrations LIMIT 1").fetchone():
+                db.execute("COMMIT")
+                return 0
+            names: Dict[str, str] = {}
+            rows = []
+            for record in records:
+                if not record.get("event_name") or not record.get("user_email"):
+                    continue
+                key = event_key(record["event_name"])
+                names.setdefault(key, record["event_name"])
+                rows.append(
+                    (
+                        key,
+                        email_key(record["user_email"]),
+                        json.dumps(record, ensure_ascii=False, default=str),
+                    )
+                )
+            cursor = db.executemany(
+                "INSERT OR IGNORE INTO registrations (event_key, email_key, data) VALUES (?, ?, ?)",
+                rows,
+            )
+            db.executemany(
+                "INSERT INTO events (event_key, event_name, registered) "
+                "SELECT ?, ?, COUNT(*) FROM registrations WHERE event_key = ? "
+                "ON CONFLICT (event_key) DO UPDATE SET registered = excluded.registered",
+                ((key, name, key) for key, name in names.items()),
+            )
+            db.execute("COMMIT")
+            return cursor.rowcount
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    # --- Чтение ---
+
+    def __len__(self) -> int:
+        return self._conn().execute(
+            "SELECT coalesce(SUM(registered), 0) FROM events"
+        ).fetchone()[0]
+
+    def _exists(self, key: Tuple[str, str]) -> bool:
+        return (
+            self._conn().execute(
+                "SELECT 1 FROM registrations WHERE event_key = ? AND email_key = ?", key
+            ).fetchone()
+            is not None
+        )
+
+    def event_stats(self, event_name: str) -> Dict[str, Any]:
+        """Ёмкость, число занятых и свободных мест (None - без ограничения)."""
+        row = self._conn().execute(
+            "SELECT event_name, registered FROM events WHERE event_key = ?",
+            (event_key(event_name),),
+        ).fetchone()
+        name, registered = row if row else (event_name, 0)
+        return self._stats(name, registered, self.capacity(event_name))
+
+    def query(
+        self,
+        event_name: Optional[str] = None,
+        user_email: Optional[str] = None,
+        cursor: Optional[int] = None,
+        limit: int = 50,
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Страница записей от новых к старым и курсор следующей страницы."""
+        where: List[str] = []
+        args: List[Any] = []
+        if event_name is not None:
+            where.append("event_key = ?")
+            args.append(event_key(event_name))
+        if user_email is not None:
+            where.append("email_key = ?")
+            args.append(email_key(user_email))
+        if cursor is not None:
+            where.append("seq < ?")
+            args.append(cursor)
+        where_sql = "WHERE " + " AND ".join(where) if where else ""
+        rows = self._conn().execute(
+            f"SELECT seq, data FROM registrations {where_sql} ORDER BY seq DESC LIMIT ?",
+            (*args, limit + 1),
+        ).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [json.loads(data) for _, data in rows[:limit]], next_cursor
+
+    @staticmethod
+    def _stats(event_name: str, registered: int, capacity: int) -> Dict[str, Any]:
+        return {
+            "event_name": event_name,
+            "capacity": capacity or None,
+            "registered": registered,
+            "remaining": max(capacity - registered, 0) if capacity > 0 else None,
+        }
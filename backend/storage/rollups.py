@@ -0,0 +1,150 @@
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Разрезы агрегатов. Ячейка агрегата - уникальное сочетание всех разрезов.
+DIMENSIONS = ("day", "payment_method", "status", "admitad")
+
+# Записи на мероприятия хранятся как транзакции, но заказами не считаются.
+EVENT_PAYMENT_METHOD = "event_registration"
+# Статусы, суммы которых не входят в выручку.
+NON_REVENUE_STATUSES = frozenset(("canceled", "failed"))
+# День транзакций без времени (или с неразбираемым временем). В отчёты
+# за период не попадает, в итоги за всё время - попадает.
+UNKNOWN_DAY = "unknown"
+
+# (день "YYYY-MM-DD" или UNKNOWN_DAY, способ оплаты, статус, есть ли admitad_uid)
+CellKey = Tuple[str, Optional[str], Optional[str], bool]
+
+
+class SalesRollup:
+    """
+    Агрегаты продаж, которые обновляются при каждой записи транзакции.
+
+    Хранится не история, а счётчики по ячейкам (день по локальному времени
+    сервера, способ оплаты, статус, есть ли admitad_uid): количество
+    транзакций и сумма в копейках.
+    Число ячеек зависит от числа дней, а не от числа транзакций, поэтому
+    отчёты считаются за время, не зависящее от объёма истории.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cells: Dict[CellKey, List[int]] = {}
+        # Границы последнего вычисленного дня: (начало, конец, "YYYY-MM-DD").
+        # Транзакции идут почти по порядку времени, поэтому день почти
+        # всегда берётся отсюда без обращения к datetime.
+        self._last_day: Tuple[float, float, str] = (0.0, 0.0, "")
+
+    def add_transaction(
+        self,
+        epoch_seconds: Optional[float],
+        payment_method: Optional[str],
+        status: Optional[str],
+        attributed: bool,
+        cents: int,
+    ):
+        """
+        Учитывает одну транзакцию (время - в секундах эпохи, сумма - в копейках).
+        Транзакция без времени (None или 0) учитывается в дне UNKNOWN_DAY.
+        """
+        if not epoch_seconds:
+            self.add((UNKNOWN_DAY, payment_method, status, attributed), cents)
+            return
+        start, end, day = self._last_day
+        if not start <= epoch_seconds < end:
+            moment = datetime.fromtimestamp(epoch_seconds)
+            midnight = datetime.combine(moment.date(), time.min)
+            day = moment.date().isoformat()
+            self._last_day = (
+                midnight.timestamp(),
+                (midnight + timedelta(days=1)).timestamp(),
+                day,
+            )
+        self.add((day, payment_method, status, attributed), cents)
+
+    def add(self, key: CellKey, cents: int, count: int = 1):
+        with self._lock:
+            cell = self._cells.get(key)
+            if cell is None:
+                self._cells[key] = [count, cents]
+            else:
+                cell[0] += count
+                cell[1] += cents
+
+    def cells(self) -> List[Tuple[CellKey, int, int]]:
+        """Снимок ячеек: [(ключ, количество, сумма в копейках), ...]."""
+        with self._lock:
+            return [(key, cell[0], cell[1]) for key, cell in self._cells.items()]
+
+
+def _empty_totals() -> Dict[str, int]:
+    return {
+        "transactions": 0,
+        "orders": 0,
+        "registrations": 0,
+        "revenue_cents": 0,
+        "conversions": 0,
+        "conversion_revenue_cents": 0,
+    }
+
+
+def summarize(
+    cells: Iterable[Tuple[CellKey, int, int]],
+    group_by: Optional[str] = None,
+    day_from: Optional[date] = None,
+    day_to: Optional[date] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Сворачивает ячейки агрегата в отчёт. Без `group_by` - одна строка
+    с итогами, иначе по строке на значение разреза (по возрастанию ключа).
+    Период задаётся днями: `day_from` включительно, `day_to` не включительно;
+    ячейки дня UNKNOWN_DAY учитываются только без периода.
+    """
+    if group_by is not None and group_by not in DIMENSIONS:
+        raise ValueError(f"Неизвестный разрез: {group_by}.")
+    low = day_from.isoformat() if day_from else None
+    high = day_to.isoformat() if day_to else None
+    groups: Dict[Any, Dict[str, int]] = {}
+    for key, count, cents in cells:
+        day, payment_method, status, attributed = key
+        if (low or high) and day == UNKNOWN_DAY:
+            continue
+        if (low and day < low) or (high and day >= high):
+            continue
+        group = None
+        if group_by is not None:
+            group = dict(zip(DIMENSIONS, key))[group_by]
+        totals = groups.get(group)
+        if totals is None:
+            totals = groups[group] = _empty_totals()
+        totals["transactions"] += count
+        revenue = 0
+        if payment_method == EVENT_PAYMENT_METHOD:
+            totals["registrations"] += count
+        else:
+            totals["orders"] += count
+            if status not in NON_REVENUE_STATUSES:
+                revenue = cents
+            totals["revenue_cents"] += revenue
+        # Конверсия - любая транзакция с admitad_uid (заказ или запись).
+        if attributed:
+            totals["conversions"] += count
+            totals["conversion_revenue_cents"] += revenue
+
+    if group_by is None and not groups:
+        groups[None] = _empty_totals()
+    rows = []
+    for group in sorted(groups, key=lambda g: (g is None, str(g))):
+        totals = groups[group]
+        row = {} if group_by is None else {group_by: group}
+        row.update(
+            transactions=totals["transactions"],
+            orders=totals["orders"],
+            registrations=totals["registrations"],
+            revenue=totals["revenue_cents"] / 100,
+            conversions=totals["conversions"],
+            conversion_revenue=totals["conversion_revenue_cents"] / 100,
+        )
+        rows.append(row)
+    return rows
@@ -0,0 +1,301 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Iterable
+
+from backend.storage.rollups import UNKNOWN_DAY, CellKey
+from backend.storage.transaction_store import INDEXED_FIELDS, index_key, shape_record, to_epoch
+
+# Сколько строк читается из базы за один запрос при потоковой выгрузке.
+_ITER_BATCH_SIZE = 1000
+
+# Ячейка агрегата и сумма в копейках для строки transactions.
+# ts = 0 - время транзакции отсутствует или не разбирается (см. to_epoch).
+_ROLLUP_CELL = (
+    f"CASE WHEN {{row}}.ts != 0 THEN date({{row}}.ts, 'unixepoch', 'localtime') "
+    f"ELSE '{UNKNOWN_DAY}' END, "
+    "coalesce({row}.payment_method, ''), "
+    "coalesce({row}.status, ''), "
+    "coalesce({row}.admitad_uid, '') != ''"
+)
+_ROLLUP_CENTS = "coalesce(round(json_extract({row}.data, '$.amount') * 100), 0)"
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS transactions ("
+    "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "order_id INTEGER NOT NULL, "
+    "status TEXT, "
+    "payment_method TEXT, "
+    "user_email TEXT, "
+    "admitad_uid TEXT, "
+    "ts REAL NOT NULL, "
+    "data TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS tx_status ON transactions (status, seq)",
+    "CREATE INDEX IF NOT EXISTS tx_payment_method ON transactions (payment_method, seq)",
+    "CREATE INDEX IF NOT EXISTS tx_user_email ON transactions (user_email, seq)",
+    "CREATE INDEX IF NOT EXISTS tx_admitad_uid ON transactions (admitad_uid, seq)",
+    "CREATE INDEX IF NOT EXISTS tx_ts ON transactions (ts)",
+    "CREATE INDEX IF NOT EXISTS tx_order_id ON transactions (order_id)",
+    # Агрегаты продаж (см. SalesRollup). Пустая строка вместо NULL - чтобы
+    # ON CONFLICT находил ячейку по первичному ключу.
+    "CREATE TABLE IF NOT EXISTS sales_rollup ("
+    "day TEXT NOT NULL, "
+    "payment_method TEXT NOT NULL, "
+    "status TEXT NOT NULL, "
+    "attributed INTEGER NOT NULL, "
+    "transactions INTEGER NOT NULL, "
+    "cents INTEGER NOT NULL, "
+    "PRIMARY KEY (day, payment_method, status, attributed))",
+)
+
+# Агрегаты обновляются триггером в той же транзакции SQLite, что и вставка,
+# поэтому всегда согласованы с таблицей transactions во всех воркерах.
+# Создаётся в _backfill_rollup вместе с заменой прежнего триггера
+# tx_sales_rollup, который относил транзакции без времени к 1970-01-01.
+_ROLLUP_TRIGGER = (
+    f"CREATE TRIGGER IF NOT EXISTS tx_sales_rollup_day AFTER INSERT ON transactions BEGIN "
+    f"INSERT INTO sales_rollup SELECT {_ROLLUP_CELL.format(row='NEW')}, 1, "
+    f"{_ROLLUP_CENTS.format(row='NEW')} WHERE 1 "
+    f"ON CONFLICT (day, payment_method, status, attributed) DO UPDATE SET "
+    f"transactions = transactions + 1, cents = cents + excluded.cents; "
+    f"END"
+)
+
+
+def _row_values(record: Dict[str, Any]) -> tuple:
+    return (
+        record.get("order_id"),
+        *(index_key(field, record.get(field)) for field in INDEXED_FIELDS),
+        to_epoch(record.get("timestamp")),
+        json.dumps(record, ensure_ascii=False, default=str),
+    )
+
+
+class SqliteTransactionStore:
+    """
+    Хранилище транзакций в SQLite (режим WAL) с тем же интерфейсом,
+    что и TransactionStore.
+
+    Каждая вставка - атомарная транзакция SQLite, поэтому несколько
+    воркеров uvicorn могут писать в один файл одновременно, а чтение
+    в любом воркере видит все подтверждённые записи остальных.
+    Курсор пагинации - значение seq последней отданной записи.
+    Записи отдаются в том же виде, что и из TransactionStore (shape_record).
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+        if hasattr(os, "register_at_fork"):
+            # Воркер после fork не должен пользоваться соединением родителя.
+            os.register_at_fork(after_in_child=self._after_fork)
+        db = self._conn()
+        for statement in _SCHEMA:
+            db.execute(statement)
+        self._backfill_rollup()
+
+    # --- Соединения ---
+
+    def _after_fork(self):
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Отдельное соединение на поток: sqlite3 не любит общих соединений."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # --- Запись ---
+
+    def append(self, record: Dict[str, Any]):
+        """Атомарно добавляет одну транзакцию."""
+        self._conn().execute(
+            "INSERT INTO transactions (order_id, status, payment_method, user_email, "
+            "admitad_uid, ts, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            _row_values(record),
+        )
+
+    def append_many(self, records: List[Dict[str, Any]]):
+        """Добавляет группу транзакций одной транзакцией SQLite (всё или ничего)."""
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT INTO transactions (order_id, status, payment_method, user_email, "
+                "admitad_uid, ts, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (_row_values(r) for r in records),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def import_if_empty(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Однократно переносит существующую историю в пустую базу.
+        Проверка и вставка идут в одной транзакции, поэтому при старте
+        нескольких воркеров перенос выполнит только один из них.
+        """
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if db.execute("SELECT 1 FROM transactions LIMIT 1").fetchone():
+                db.execute("COMMIT")
+                return 0
+            cursor = db.executemany(
+                "INSERT INTO transactions (order_id, status, payment_method, user_email, "
+                "admitad_uid, ts, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (_row_values(r) for r in records),
+            )
+            db.execute("COMMIT")
+            return cursor.rowcount
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _backfill_rollup(self):
+        """
+        Строит агрегаты по уже сохранённым транзакциям, если база создана
+        до появления таблицы sales_rollup (однократно, под BEGIN IMMEDIATE).
+        В базе с прежним триггером ячейки 1970-01-01 (транзакции без
+        времени) переносятся в день UNKNOWN_DAY.
+        """
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'tx_sales_rollup'"
+            ).fetchone():
+                db.execute("DROP TRIGGER tx_sales_rollup")
+                db.execute(
+                    "INSERT INTO sales_rollup SELECT ?, payment_method, status, attributed, "
+                    "transactions, cents FROM sales_rollup "
+                    "WHERE day = date(0, 'unixepoch', 'localtime') "
+                    "ON CONFLICT (day, payment_method, status, attributed) DO UPDATE SET "
+                    "transactions = transactions + excluded.transactions, "
+                    "cents = cents + excluded.cents",
+                    (UNKNOWN_DAY,),
+                )
+                db.execute("DELETE FROM sales_rollup WHERE day = date(0, 'unixepoch', 'localtime')")
+            db.execute(_ROLLUP_TRIGGER)
+            if not db.execute("SELECT 1 FROM sales_rollup LIMIT 1").fetchone():
+                db.execute(
+                    f"INSERT INTO sales_rollup SELECT {_ROLLUP_CELL.format(row='t')}, "
+                    f"COUNT(*), SUM({_ROLLUP_CENTS.format(row='t')}) "
+                    f"FROM transactions AS t GROUP BY 1, 2, 3, 4"
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    # --- Чтение ---
+
+    def rollup_cells(self) -> List[Tuple[CellKey, int, int]]:
+        """Ячейки агрегатов продаж из таблицы sales_rollup (общей для всех воркеров)."""
+        rows = self._conn().execute(
+            "SELECT day, payment_method, status, attributed, transactions, cents "
+            "FROM sales_rollup"
+        ).fetchall()
+        return [
+            ((day, payment_method or None, status or None, bool(attributed)), count, int(cents))
+            for day, payment_method, status, attributed, count, cents in rows
+        ]
+
+    def __len__(self) -> int:
+        # Счётчик из агрегатов продаж (их ведёт триггер при каждой вставке)
+        # вместо COUNT(*) - полного прохода по таблице на каждый опрос /metrics.
+        return self._conn().execute(
+            "SELECT coalesce(SUM(transactions), 0) FROM sales_rollup"
+        ).fetchone()[0]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self.iter_matching()
+
+    def query(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        time_from: Optional[datetime] = None,
+        time_to: Optional[datetime] = None,
+        cursor: Optional[int] = None,
+        limit: int = 50,
+        id_from: Optional[int] = None,
+        id_to: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Страница транзакций от новых к старым и курсор следующей страницы."""
+        where, args = self._where(filters, time_from, time_to, id_from, id_to)
+        if cursor is not None:
+            where.append("seq < ?")
+            args.append(cursor)
+        rows = self._conn().execute(
+            f"SELECT seq, data FROM transactions {_where_sql(where)} "
+            f"ORDER BY seq DESC LIMIT ?",
+            (*args, limit + 1),
+        ).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [shape_record(json.loads(data)) for _, data in rows[:limit]], next_cursor
+
+    def iter_matching(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        time_from: Optional[datetime] = None,
+        time_to: Optional[datetime] = None,
+        id_from: Optional[int] = None,
+        id_to: Optional[int] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Перебирает подходящие транзакции от старых к новым пачками."""
+        where, args = self._where(filters, time_from, time_to, id_from, id_to)
+        last_seq = 0
+        while True:
+            rows = self._conn().execute(
+                f"SELECT seq, data FROM transactions {_where_sql(where + ['seq > ?'])} "
+                f"ORDER BY seq LIMIT ?",
+                (*args, last_seq, _ITER_BATCH_SIZE),
+            ).fetchall()
+            for seq, data in rows:
+                yield shape_record(json.loads(data))
+            if len(rows) < _ITER_BATCH_SIZE:
+                return
+            last_seq = rows[-1][0]
+
+    @staticmethod
+    def _where(
+        filters: Optional[Dict[str, Any]],
+        time_from: Optional[datetime],
+        time_to: Optional[datetime],
+        id_from: Optional[int] = None,
+        id_to: Optional[int] = None,
+    ) -> Tuple[List[str], List[Any]]:
+        where: List[str] = []
+        args: List[Any] = []
+        for field, value in (filters or {}).items():
+            if value is not None and field in INDEXED_FIELDS:
+                where.append(f"{field} = ?")
+                args.append(index_key(field, value))
+        if time_from is not None or time_to is not None:
+            # Записи без времени (ts = 0) не попадают ни в один период.
+            where.append("ts != 0")
+        if time_from is not None:
+            where.append("ts >= ?")
+            args.append(time_from.timestamp())
+        if time_to is not None:
+            where.append("ts < ?")
+            args.append(time_to.timestamp())
+        if id_from is not None:
+            where.append("order_id >= ?")
+            args.append(id_from)
+        if id_to is not None:
+            where.append("order_id < ?")
+            args.append(id_to)
+        return where, args
+
+
+def _where_sql(where: List[str]) -> str:
+    return "WHERE " + " AND ".join(where) if where else ""
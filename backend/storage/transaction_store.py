@@ -0,0 +1,482 @@
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from datetime import datetime
+from enum import Enum
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+
+from backend.storage.journal import JsonlJournal
+from backend.storage.rollups import CellKey, SalesRollup
+
+# Поля, по которым строятся индексы точного совпадения.
+INDEXED_FIELDS = ("status", "payment_method", "user_email", "admitad_uid")
+
+# Поля модели Transaction, которые хранятся в колонках. Остальные поля
+# (если встречаются в старых записях) хранятся как есть в _extras.
+_COLUMN_FIELDS = frozenset(
+    ("order_id", "transaction_id", "amount", "timestamp", *INDEXED_FIELDS)
+)
+
+# Значение "поле отсутствует" в целочисленных колонках.
+_MISSING = -(2**63)
+
+
+def index_key(field: str, value: Any) -> Any:
+    """Нормализует значение поля для ключа индекса."""
+    if isinstance(value, Enum):
+        value = value.value
+    if field == "user_email" and isinstance(value, str):
+        value = value.lower()
+    return value
+
+
+def to_epoch(value: Any) -> float:
+    """Переводит timestamp транзакции (datetime или строку) в секунды."""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return 0.0
+    return 0.0
+
+
+def _to_micros(value: Any) -> int:
+    """timestamp транзакции -> целые микросекунды эпохи (или _MISSING)."""
+    if value is None:
+        return _MISSING
+    seconds = to_epoch(value)
+    return round(seconds * 1_000_000) if seconds else _MISSING
+
+
+def _from_micros(micros: int) -> datetime:
+    seconds, micro = divmod(micros, 1_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=micro)
+
+
+def _to_order_id(value: Any) -> int:
+    """
+    order_id -> значение колонки (или _MISSING). В старых записях order_id
+    встречается строкой или float - такие значения приводятся к int;
+    не приводимые к int64 бросают ValueError.
+    """
+    if value is None:
+        return _MISSING
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not _MISSING < value < 2**63:
+        raise ValueError(f"некорректный order_id: {value!r}")
+    return value
+
+
+def _to_cents(value: Any) -> int:
+    """Сумма -> целое число копеек (фиксированная точка, 2 знака)."""
+    return _MISSING if value is None else round(float(value) * 100)
+
+
+def shape_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Приводит исходную запись к тому же виду, что и запись из колонок:
+    строки вместо Enum, order_id - int, сумма с точностью до копеек,
+    timestamp - datetime.
+    """
+    row = {}
+    for field, value in record.items():
+        if value is None:
+            continue
+        if isinstance(value, Enum):
+            value = value.value
+        elif field == "order_id":
+            try:
+                value = _to_order_id(value)
+            except ValueError:
+                pass
+        elif field == "amount":
+            value = _to_cents(value) / 100
+        elif field == "timestamp":
+            micros = _to_micros(value)
+            if micros == _MISSING:
+                continue
+            value = _from_micros(micros)
+        row[field] = value
+    return row
+
+
+class _Interner:
+    """
+    Словарь повторяющихся строк: каждая строка хранится один раз,
+    а в колонке - только её целочисленный код. Код 0 означает None.
+    """
+
+    __slots__ = ("codes", "values")
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.values: List[Optional[str]] = [None]
+
+    def code(self, value: Any) -> int:
+        if value is None:
+            return 0
+        if isinstance(value, Enum):
+            value = value.value
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class TransactionStore:
+    """
+    Хранилище транзакций в памяти с индексами для фильтрации.
+
+    Транзакции хранятся не словарями, а по колонкам в компактных массивах
+    (array): order_id, время в целых микросекундах эпохи, сумма в копейках,
+    а статус, способ оплаты, email, admitad_uid и transaction_id - кодами
+    из общих словарей строк. Это на порядок меньше памяти на запись, чем dict с повторяющимися
+    строками. Наружу (API, экспорт) запись отдаётся в виде словаря в форме
+    модели Transaction и собирается только в момент выдачи.
+
+    Записи только добавляются, поэтому позиция записи в хранилище
+    неизменна и используется как курсор пагинации. Для каждого
+    индексируемого поля хранится массив позиций (по возрастанию),
+    а для времени и order_id - колонки значений, по которым
+    диапазон ищется бинарным поиском, пока значения идут по возрастанию.
+    Там же обновляются агрегаты продаж по дням (SalesRollup).
+
+    С lazy=True `records` - ленивая последовательность (например,
+    JournalRecords), и колонки с индексами строятся не при создании, а при
+    первом запросе с фильтром или по вызову ensure_indexes(). До этого
+    страницы без фильтров читаются прямо из последовательности, а новые
+    записи копятся в небольшом хвосте.
+    """
+
+    def __init__(
+        self,
+        records: Optional[Sequence] = None,
+        journal: Optional[JsonlJournal] = None,
+        lazy: bool = False,
+    ):
+        self.journal = journal
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._source: Optional[Sequence] = None
+        self._tail: List[Dict[str, Any]] = []
+        self._built = True
+        self._order_ids = _RangeColumn()
+        self._timestamps = _RangeColumn()
+        self._amounts = array("q")
+        self._strings = {field: _Interner() for field in INDEXED_FIELDS}
+        self._codes = {field: array("I") for field in INDEXED_FIELDS}
+        # transaction_id есть у каждой оплаты картой: колонка кодов, как у
+        # индексируемых строк (индекса по нему нет).
+        self._transaction_ids = _Interner()
+        self._transaction_id_codes = array("I")
+        # Редкие поля старых записей: позиция -> {поле: значение}.
+        self._extras: Dict[int, Dict[str, Any]] = {}
+        self._indexes: Dict[str, Dict[Any, array]] = {f: {} for f in INDEXED_FIELDS}
+        self._rollup = SalesRollup()
+        if lazy:
+            self._source, self._built = records if records is not None else [], False
+        else:
+            for record in records or []:
+                self._add(record)
+
+    # --- Интерфейс списка (для совместимости со старым кодом) ---
+
+    def __len__(self) -> int:
+        source, tail = self._source, self._tail
+        if not self._built and source is not None:
+            return len(source) + len(tail)
+        return len(self._amounts)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return (self._row(position) for position in range(len(self)))
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self._row(p) for p in range(len(self))[position]]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("transaction index out of range")
+        return self._row(position)
+
+    def append(self, record: Dict[str, Any]):
+        """
+        Добавляет транзакцию, обновляет индексы и дописывает её в журнал.
+        Журнал пишется под той же блокировкой: при записи из нескольких
+        потоков порядок строк журнала совпадает с порядком в памяти.
+        """
+        with self._lock:
+            self._add_or_defer(record)
+            if self.journal is not None:
+                self.journal.append(record)
+
+    def append_many(self, records: List[Dict[str, Any]]):
+        """
+        Добавляет группу транзакций: в журнал она пишется одним вызовом
+        write и сразу сбрасывается на диск одним fsync.
+        """
+        with self._lock:
+            for record in records:
+                self._add_or_defer(record)
+            if self.journal is not None:
+                self.journal.append_many(records)
+                self.journal.sync()
+
+    def ensure_indexes(self):
+        """
+        Строит колонки и индексы по ленивой последовательности (один раз).
+        Основная часть строится без блокировки записи: блокировка берётся
+        только чтобы добавить накопленный хвост и переключить режим.
+        """
+        if self._built:
+            return
+        with self._build_lock:
+            if self._built:
+                return
+            for record in self._source:
+                self._add(record)
+            with self._lock:
+                for record in self._tail:
+                    self._add(record)
+                self._built = True
+                self._source, self._tail = None, []
+
+    def _add_or_defer(self, record: Dict[str, Any]):
+        if self._built:
+            self._add(record)
+        else:
+            self._tail.append(record)
+
+    def _add(self, record: Dict[str, Any]):
+        position = len(self._amounts)
+        extras = {k: v for k, v in record.items() if k not in _COLUMN_FIELDS}
+        try:
+            order_id = _to_order_id(record.get("order_id"))
+        except ValueError as e:
+            # Запись не теряется: исходное значение отдаётся как есть,
+            # но в фильтр по диапазону order_id она не попадает.
+            logging.warning("Транзакция на позиции %d: %s.", position, e)
+            order_id = _MISSING
+            extras["order_id"] = record["order_id"]
+        micros = _to_micros(record.get("timestamp"))
+        cents = _to_cents(record.get("amount"))
+        self._order_ids.append(order_id)
+        self._timestamps.append(micros)
+        self._amounts.append(cents)
+        self._rollup.add_transaction(
+            None if micros == _MISSING else micros / 1_000_000,
+            index_key("payment_method", record.get("payment_method")),
+            index_key("status", record.get("status")),
+            bool(record.get("admitad_uid")),
+            0 if cents == _MISSING else cents,
+        )
+        for field in INDEXED_FIELDS:
+            value = record.get(field)
+            self._codes[field].append(self._strings[field].code(value))
+            if value is not None:
+                key = index_key(field, value)
+                postings = self._indexes[field].get(key)
+                if postings is None:
+                    postings = self._indexes[field][key] = array("I")
+                postings.append(position)
+        self._transaction_id_codes.append(self._transaction_ids.code(record.get("transaction_id")))
+        if extras:
+            self._extras[position] = extras
+
+    def _value(self, field: str, position: int) -> Optional[str]:
+        return self._strings[field].values[self._codes[field][position]]
+
+    def _row(self, position: int) -> Dict[str, Any]:
+        """Собирает запись в форме модели Transaction (без полей со значением None)."""
+        source, tail = self._source, self._tail
+        if not self._built and source is not None:
+            if position < len(source):
+                return shape_record(source[position])
+            return shape_record(tail[position - len(source)])
+        row: Dict[str, Any] = {}
+        order_id = self._order_ids.values[position]
+        if order_id != _MISSING:
+            row["order_id"] = order_id
+        transaction_id = self._transaction_ids.values[self._transaction_id_codes[position]]
+        if transaction_id is not None:
+            row["transaction_id"] = transaction_id
+        for field in ("status", "user_email"):
+            value = self._value(field, position)
+            if value is not None:
+                row[field] = value
+        cents = self._amounts[position]
+        if cents != _MISSING:
+            row["amount"] = cents / 100
+        value = self._value("payment_method", position)
+        if value is not None:
+            row["payment_method"] = value
+        micros = self._timestamps.values[position]
+        if micros != _MISSING:
+            row["timestamp"] = _from_micros(micros)
+        value = self._value("admitad_uid", position)
+        if value is not None:
+            row["admitad_uid"] = value
+        extras = self._extras.get(position)
+        if extras:
+            row.update(extras)
+        return row
+
+    # --- Выборки ---
+
+    def query(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        time_from: Optional[datetime] = None,
+        time_to: Optional[datetime] = None,
+        cursor: Optional[int] = None,
+        limit: int = 50,
+        id_from: Optional[int] = None,
+        id_to: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Возвращает страницу транзакций от новых к старым и курсор следующей
+        страницы (позицию последней отданной записи) или None.
+        """
+        page: List[Dict[str, Any]] = []
+        last_position = None
+        self._ensure_indexes_for(filters, time_from, time_to, id_from, id_to)
+        bounds = self._bounds(time_from, time_to, id_from, id_to)
+        for position in self._iter_positions(filters, bounds, cursor, True):
+            if len(page) == limit:
+                return page, last_position
+            page.append(self._row(position))
+            last_position = position
+        return page, None
+
+    def iter_matching(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        time_from: Optional[datetime] = None,
+        time_to: Optional[datetime] = None,
+        id_from: Optional[int] = None,
+        id_to: Optional[int] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Перебирает все подходящие транзакции от старых к новым."""
+        self._ensure_indexes_for(filters, time_from, time_to, id_from, id_to)
+        bounds = self._bounds(time_from, time_to, id_from, id_to)
+        for position in self._iter_positions(filters, bounds, None, False):
+            yield self._row(position)
+
+    def rollup_cells(self) -> List[Tuple[CellKey, int, int]]:
+        """
+        Ячейки агрегатов продаж (см. SalesRollup). Агрегаты обновляются
+        вместе с колонками при каждом добавлении транзакции.
+        """
+        self.ensure_indexes()
+        return self._rollup.cells()
+
+    def _ensure_indexes_for(self, filters, *bounds):
+        """Индексы нужны только запросам с фильтрами или диапазонами."""
+        if any(v is not None for v in (filters or {}).values()) or any(
+            b is not None for b in bounds
+        ):
+            self.ensure_indexes()
+
+    def _bounds(
+        self,
+        time_from: Optional[datetime],
+        time_to: Optional[datetime],
+        id_from: Optional[int],
+        id_to: Optional[int],
+    ) -> List[Tuple["_RangeColumn", Optional[float], Optional[float]]]:
+        """
+        Диапазоны [от, до) по колонкам времени и order_id. Записи без
+        значения (_MISSING) не попадают ни в один диапазон, поэтому нижняя
+        граница не бывает меньше _MISSING + 1.
+        """
+        bounds = []
+        if time_from is not None or time_to is not None:
+            bounds.append((
+                self._timestamps,
+                _to_micros(time_from) if time_from else _MISSING + 1,
+                _to_micros(time_to) if time_to else None,
+            ))
+        if id_from is not None or id_to is not None:
+            bounds.append((self._order_ids, _MISSING + 1 if id_from is None else id_from, id_to))
+        return bounds
+
+    def _iter_positions(
+        self,
+        filters: Optional[Dict[str, Any]],
+        bounds: List[Tuple["_RangeColumn", Optional[float], Optional[float]]],
+        cursor: Optional[int],
+        descending: bool,
+    ) -> Iterator[int]:
+        filters = {
+            field: index_key(field, value)
+            for field, value in (filters or {}).items()
+            if value is not None
+        }
+
+        # Границы диапазона позиций [lo, hi): по курсору и бинарным поиском
+        # по упорядоченным колонкам. Неупорядоченные колонки (например,
+        # старые случайные order_id) проверяются по каждой записи.
+        lo, hi = 0, len(self)
+        if cursor is not None:
+            hi = min(hi, max(cursor, 0))
+        checked_bounds = []
+        for column, low, high in bounds:
+            if column.is_sorted:
+                if low is not None:
+                    lo = max(lo, bisect_left(column.values, low))
+                if high is not None:
+                    hi = min(hi, bisect_left(column.values, high))
+            else:
+                checked_bounds.append((column.values, low, high))
+        if lo >= hi:
+            return
+
+        # Кандидаты берутся из самого короткого списка позиций.
+        if filters:
+            postings = [self._indexes[f].get(v, []) for f, v in filters.items()]
+            candidates = min(postings, key=len)
+            start, stop = bisect_left(candidates, lo), bisect_left(candidates, hi)
+            positions = (candidates[i] for i in _range(start, stop, descending))
+        else:
+            positions = _range(lo, hi, descending)
+
+        for position in positions:
+            if any(
+                index_key(field, self._value(field, position)) != value
+                for field, value in filters.items()
+            ):
+                continue
+            if any(
+                (low is not None and values[position] < low)
+                or (high is not None and values[position] >= high)
+                for values, low, high in checked_bounds
+            ):
+                continue
+            yield position
+
+
+class _RangeColumn:
+    """Целочисленная колонка с признаком упорядоченности по возрастанию."""
+
+    __slots__ = ("values", "is_sorted")
+
+    def __init__(self):
+        self.values = array("q")
+        self.is_sorted = True
+
+    def append(self, value: int):
+        if self.values and value < self.values[-1]:
+            self.is_sorted = False
+        self.values.append(value)
+
+
+def _range(start: int, stop: int, descending: bool) -> range:
+    return range(stop - 1, start - 1, -1) if descending else range(start, stop)
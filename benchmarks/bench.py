@@ -0,0 +1,388 @@
+"""
+Нагрузочный бенчмарк API магазина.
+
+Прогоняет основные эндпоинты (каталог, заказы, записи на мероприятия,
+транзакции, трекинг конверсий) с заданным параллелизмом на синтетических
+каталогах и историях транзакций растущего размера и сохраняет
+p50/p95/p99 и пропускную способность в JSON.
+
+По умолчанию приложение запускается в этом же процессе через
+httpx.ASGITransport: данные подменяются синтетическими, банк и Admitad
+не вызываются. С флагом --url нагрузка идёт на уже запущенный сервер
+(например, uvicorn), и тогда используются его собственные данные.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench
+    python -m benchmarks.bench --catalog-sizes 100,100000 --tx-sizes 1000,1000000
+    python -m benchmarks.bench --url http://127.0.0.1:8000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+CATEGORIES = ["Shoes", "Clothes", "Gadgets", "Accessories", "Balls", "Bikes"]
+STATUSES = ["pending", "paid", "shipped", "canceled", "failed"]
+PAYMENT_METHODS = ["cash", "card", "event_registration"]
+EVENTS = ["Марафон", "Полумарафон", "Велозаезд", "Заплыв", "Триатлон"]
+
+SCENARIOS = (
+    "products_list",
+    "products_by_category",
+    "products_search",
+    "product_by_id",
+    "orders",
+    "cart_quote",
+    "registrations",
+    "transactions_page",
+    "transactions_filtered",
+    "track_conversion",
+)
+
+# Счётчик для уникальных order_id в track-conversion (иначе сработает дедупликация).
+_conversion_ids = itertools.count()
+# Счётчик для уникальных email в записях на мероприятия (иначе повторная запись - 409).
+_registration_ids = itertools.count()
+
+
+# --- Синтетические данные ---
+
+
+def make_catalog(size: int, rng: random.Random) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": i,
+            "sku": f"SKU-{i:07d}",
+            "name": f"Товар {i}",
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "description": f"Описание синтетического товара номер {i}.",
+            "price": round(rng.uniform(100, 50000), 2),
+        }
+        for i in range(1, size + 1)
+    ]
+
+
+def make_transactions(size: int, rng: random.Random) -> List[Dict[str, Any]]:
+    start = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / max(size, 1)
+    return [
+        {
+            "order_id": 1_000_000 + i,
+            "status": rng.choice(STATUSES),
+            "user_email": f"user{rng.randrange(5000)}@example.com",
+            "amount": round(rng.uniform(0, 50000), 2),
+            "payment_method": rng.choice(PAYMENT_METHODS),
+            "timestamp": str(start + step * i),
+            **({"admitad_uid": f"uid{rng.randrange(1000)}"} if i % 5 == 0 else {}),
+        }
+        for i in range(size)
+    ]
+
+
+# --- Запросы сценариев ---
+
+
+def _cart_items(rng: random.Random, product_ids: List[int], size: int) -> List[dict]:
+    picked = {rng.choice(product_ids) for _ in range(size)}
+    return [{"product_id": pid, "quantity": rng.randint(1, 3)} for pid in picked]
+
+
+def _order_payload(rng: random.Random, prices: Dict[int, float], product_ids: List[int]) -> dict:
+    items = [
+        {**item, "name": "Товар"}
+        for item in _cart_items(rng, product_ids, rng.randint(1, 5))
+    ]
+    # Сумма должна совпасть с расчётом сервера по ценам каталога.
+    total = sum(
+        Decimal(str(prices[i["product_id"]])) * i["quantity"] for i in items
+    ).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    return {
+        "user_name": "Bench User",
+        "user_email": "bench@example.com",
+        "payment_method": "cash",
+        "items": items,
+        "total_amount": float(total),
+    }
+
+
+def build_request(name: str, rng: random.Random, prices: Dict[int, float]) -> Callable:
+    """Возвращает корутину-фабрику одного запроса сценария."""
+    product_ids = list(prices)
+
+    def make(client: httpx.AsyncClient):
+        if name == "products_list":
+            return client.get("/api/products")
+        if name == "products_by_category":
+            return client.get("/api/products", params={"category": rng.choice(CATEGORIES)})
+        if name == "products_search":
+            low = round(rng.uniform(100, 40000), 2)
+            return client.get(
+                "/api/products/search",
+                params={
+                    "q": rng.choice(["товар", "синтетического товара", "описание номер"]),
+                    "category": rng.choice(CATEGORIES),
+                    "price_min": low,
+                    "price_max": low + 5000,
+                    "sort": rng.choice(["price_asc", "price_desc"]),
+                    "offset": rng.choice([0, 20, 100]),
+                },
+            )
+        if name == "product_by_id":
+            return client.get(f"/api/products/{rng.choice(product_ids)}")
+        if name == "orders":
+            return client.post("/api/orders", json=_order_payload(rng, prices, product_ids))
+        if name == "cart_quote":
+            return client.post(
+                "/api/cart/quote", json={"items": _cart_items(rng, product_ids, 20)}
+            )
+        if name == "registrations":
+            return client.post(
+                "/api/registrations",
+                json={
+                    "user_name": "Bench User",
+                    "user_email": f"bench-{os.getpid()}-{next(_registration_ids)}@example.com",
+                    "event_name": rng.choice(EVENTS),
+                },
+            )
+        if name == "transactions_page":
+            return client.get("/api/transactions", params={"limit": 50})
+        if name == "transactions_filtered":
+            return client.get(
+                "/api/transactions",
+                params={"limit": 50, "status": rng.choice(STATUSES)},
+            )
+        if name == "track_conversion":
+            return client.post(
+                "/s/track-conversion",
+                json={
+                    "orderId": f"bench-{os.getpid()}-{next(_conversion_ids)}",
+                    "orderAmount": 1000,
+                    "paymentType": "sale",
+                },
+                cookies={"_adm_aid": "bench-uid", "_last_source": "admitad"},
+            )
+        raise ValueError(f"Неизвестный сценарий: {name}")
+
+    return make
+
+
+# --- Измерение ---
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Перцентиль методом ближайшего ранга."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    name: str,
+    requests_total: int,
+    concurrency: int,
+    prices: Dict[int, float],
+    seed: int,
+) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    make_request = build_request(name, rng, prices)
+    latencies: List[float] = []
+    errors = 0
+    remaining = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while next(remaining) < requests_total:
+            started = time.perf_counter()
+            try:
+                response = await make_request(client)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+    }
+
+
+# --- Подготовка приложения в процессе ---
+
+
+def prepare_inprocess_app(workdir: str, bank_latency: float):
+    """
+    Импортирует приложение так, чтобы бенчмарк не трогал рабочие данные:
+    журнал транзакций, записи на мероприятия, outbox, индекс дедупликации,
+    журнал визитов и лог Admitad - во временной папке, постбэки уходят
+    в заглушку, задержка банка настраивается.
+    """
+    os.environ["DATA_DIR"] = workdir
+    os.environ["BANK_LATENCY_SECONDS"] = str(bank_latency)
+    os.environ["CATALOG_WATCH_INTERVAL"] = "0"
+    os.environ["ADMITAD_OUTBOX_FILE"] = os.path.join(workdir, "outbox.sqlite3")
+    os.environ["ADMITAD_DEDUP_FILE"] = os.path.join(workdir, "dedup.sqlite3")
+    os.environ["ADMITAD_VISIT_LOG_FILE"] = os.path.join(workdir, "visits.sqlite3")
+    os.environ["ADMITAD_LOG_FILE"] = os.path.join(workdir, "admitad_tracker.log")
+
+    from backend import db
+    from backend.main import app
+    from backend.admitad_postback_plugin import admitad_integration
+
+    admitad_integration.dispatcher._transport = httpx.MockTransport(
+        lambda request: httpx.Response(200)
+    )
+    return app, db
+
+
+def load_synthetic_data(db, workdir: str, backend: str, catalog, transactions, label: str):
+    """
+    Подменяет каталог и хранилище транзакций синтетическими данными,
+    а записи на мероприятия - пустым хранилищем во временной папке.
+    """
+    from backend.storage.catalog import ProductCatalog
+    from backend.storage.journal import JsonlJournal
+    from backend.storage.registration_store import EventRegistrationStore
+    from backend.storage.sqlite_store import SqliteTransactionStore
+    from backend.storage.transaction_store import TransactionStore
+
+    db.swap_catalog(ProductCatalog(catalog))
+    if backend == "sqlite":
+        store = SqliteTransactionStore(os.path.join(workdir, f"tx-{label}.sqlite3"))
+        store.import_if_empty(transactions)
+    else:
+        journal = JsonlJournal(os.path.join(workdir, f"tx-{label}.jsonl"))
+        journal.compact(transactions)
+        store = TransactionStore(transactions, journal=journal)
+    db.TRANSACTIONS_DB = store
+    db.EVENT_REGISTRATIONS_DB = EventRegistrationStore(
+        Path(workdir) / f"registrations-{label}.sqlite3"
+    )
+
+
+async def main_async(args) -> Dict[str, Any]:
+    scenarios = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    results: List[Dict[str, Any]] = []
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+            response = await client.get("/api/products")
+            response.raise_for_status()
+            prices = {p["id"]: p["price"] for p in response.json()}
+            for name in scenarios:
+                result = await run_scenario(
+                    client, name, args.requests, args.concurrency, prices, args.seed
+                )
+                results.append({"catalog_size": None, "transactions_size": None, **result})
+                _print_result(results[-1])
+        mode = "live"
+    else:
+        workdir = tempfile.mkdtemp(prefix="shop-bench-")
+        app, db = prepare_inprocess_app(workdir, args.bank_latency)
+        rng = random.Random(args.seed)
+        catalog_sizes = [int(s) for s in args.catalog_sizes.split(",")]
+        tx_sizes = [int(s) for s in args.tx_sizes.split(",")]
+        for catalog_size, tx_size in itertools.product(catalog_sizes, tx_sizes):
+            catalog = make_catalog(catalog_size, rng)
+            prices = {p["id"]: p["price"] for p in catalog}
+            load_synthetic_data(
+                db,
+                workdir,
+                args.backend,
+                catalog,
+                make_transactions(tx_size, rng),
+                f"{catalog_size}-{tx_size}",
+            )
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for name in scenarios:
+                    result = await run_scenario(
+                        client, name, args.requests, args.concurrency, prices, args.seed
+                    )
+                    results.append(
+                        {"catalog_size": catalog_size, "transactions_size": tx_size, **result}
+                    )
+                    _print_result(results[-1])
+        from backend.admitad_postback_plugin import admitad_integration
+
+        await admitad_integration.dispatcher.stop()
+        mode = "in-process"
+
+    return {
+        "mode": mode,
+        "backend": None if args.url else args.backend,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+
+
+def _print_result(result: Dict[str, Any]):
+    latency = result["latency_ms"]
+    print(
+        f"{result['scenario']:<22} catalog={result['catalog_size']!s:<8} "
+        f"tx={result['transactions_size']!s:<9} rps={result['throughput_rps']:<10} "
+        f"p50={latency['p50']:<8} p95={latency['p95']:<8} p99={latency['p99']:<8} "
+        f"errors={result['errors']}",
+        flush=True,
+    )
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Бенчмарк API Sport Shop")
+    parser.add_argument("--url", help="Адрес запущенного сервера (иначе - в процессе)")
+    parser.add_argument("--scenarios", help=f"Через запятую, из: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=2000, help="Запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--catalog-sizes", default="100,10000,100000")
+    parser.add_argument("--tx-sizes", default="1000,100000")
+    parser.add_argument("--backend", choices=["journal", "sqlite"], default="journal")
+    parser.add_argument("--bank-latency", type=float, default=0.0,
+                        help="Имитация задержки банка в секундах (в процессе)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_results.json")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    report = asyncio.run(main_async(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -77,7 +77,8 @@ document.addEventListener('DOMContentLoaded', () => {
         displayConfirmationDetails();
     } else if (path === 'event-confirmation.html') {
         displayEventConfirmation();
-    } else if (path === 'transactions.html') {
+    } else if (path === 'transactions.html' || path === 'admin.html') {
+        loadStats();
         loadTransactions();
     }
 
@@ -216,37 +217,69 @@ async function loadCategories() {
     }
 }
 
+const PRODUCTS_PAGE_SIZE = 24;
+
+// Поиск, фильтр по цене, сортировка и постраничная выдача выполняются
+// на сервере (/api/products/search), браузер получает только страницу товаров.
 async function loadProductsByCategory() {
     const container = document.getElementById('products-list-container');
     const title = document.getElementById('category-title');
+    const form = document.getElementById('product-search-form');
+    const moreButton = document.getElementById('products-more');
     if (!container || !title) return;
 
     const params = new URLSearchParams(window.location.search);
     const category = params.get('category');
-    if (!category) {
+    if (!category && !params.get('q')) {
         title.textContent = 'Категория не выбрана';
         container.innerHTML = '';
         return;
     }
 
-    title.textContent = `Товары в категории: ${category}`;
-    try {
-        const response = await fetch(`${API_URL}/products?category=${encodeURIComponent(category)}`);
-        if (!response.ok) throw new Error('Network response was not ok');
-        const products = await response.json();
+    title.textContent = category ? `Товары в категории: ${category}` : 'Результаты поиска';
+    let offset = 0;
 
-        container.innerHTML = '';
-        if (products.length === 0) {
-            container.innerHTML = '<p>В этой категории пока нет товаров.</p>';
-            return;
+    function searchParams() {
+        const query = new URLSearchParams({ limit: PRODUCTS_PAGE_SIZE, offset });
+        if (category) query.set('category', category);
+        const fields = form ? new FormData(form) : params;
+        ['q', 'price_min', 'price_max', 'sort'].forEach(name => {
+            const value = fields.get(name);
+            if (value) query.set(name, value);
+        });
+        return query;
+    }
+
+    async function loadPage() {
+        try {
+            const response = await fetch(`${API_URL}/products/search?${searchParams()}`);
+            if (!response.ok) throw new Error('Network response was not ok');
+            const page = await response.json();
+
+            if (offset === 0) container.innerHTML = '';
+            if (page.total === 0) {
+                container.innerHTML = '<p>Товары не найдены.</p>';
+            }
+            page.items.forEach(product => {
+                container.appendChild(createProductCard(product));
+            });
+            offset += page.items.length;
+            if (moreButton) moreButton.style.display = offset < page.total ? '' : 'none';
+        } catch (error) {
+            container.innerHTML = `<p class="error-message">Не удалось загрузить товары.</p>`;
         }
+    }
 
-        products.forEach(product => {
-            container.appendChild(createProductCard(product));
+    if (form) {
+        if (params.get('q')) form.elements.q.value = params.get('q');
+        form.addEventListener('submit', event => {
+            event.preventDefault();
+            offset = 0;
+            loadPage();
         });
-    } catch (error) {
-        container.innerHTML = `<p class="error-message">Не удалось загрузить товары.</p>`;
     }
+    if (moreButton) moreButton.addEventListener('click', loadPage);
+    await loadPage();
 }
 
 async function loadProductDetails() {
@@ -318,21 +351,69 @@ function createProductCard(product) {
     return cardLink;
 }
 
+// Итоги и разбивка по дням считаются на сервере по готовым агрегатам
+// (/api/stats), а не по всем транзакциям в браузере.
+async function loadStats() {
+    const container = document.getElementById('stats-container');
+    if (!container) return;
+    try {
+        const [summaryResponse, byDayResponse] = await Promise.all([
+            fetch(`${API_URL}/stats`),
+            fetch(`${API_URL}/stats/day`),
+        ]);
+        if (!summaryResponse.ok || !byDayResponse.ok) throw new Error('Network response was not ok');
+        const summary = await summaryResponse.json();
+        const byDay = await byDayResponse.json();
+        const rows = byDay.items.slice().reverse().map(day =>
+            `<tr><td>${day.day}</td><td>${day.orders}</td><td>${day.revenue.toFixed(2)}</td><td>${day.registrations}</td><td>${day.conversions}</td></tr>`
+        ).join('');
+        container.innerHTML = `
+            <p>Заказов: <strong>${summary.orders}</strong>, выручка: <strong>${summary.revenue.toFixed(2)} руб.</strong>,
+            записей на мероприятия: <strong>${summary.registrations}</strong>, конверсий Admitad: <strong>${summary.conversions}</strong></p>
+            <table class="transactions-table">
+                <thead><tr><th>День</th><th>Заказы</th><th>Выручка</th><th>Записи</th><th>Конверсии</th></tr></thead>
+                <tbody>${rows}</tbody>
+            </table>
+        `;
+    } catch (error) { container.innerHTML = `<p class="error-message">Не удалось загрузить статистику.</p>`; }
+}
+
+const TRANSACTIONS_PAGE_SIZE = 50;
+
 async function loadTransactions() {
     const container = document.getElementById('transactions-container');
     if (!container) return;
-    try {
-        const response = await fetch(`${API_URL}/transactions`);
-        if (!response.ok) throw new Error('Network response was not ok');
-        const transactions = await response.json();
-        const tableBody = container.querySelector('tbody');
-        if (!tableBody) return;
-        tableBody.innerHTML = '';
-        transactions.reverse().forEach(tx => {
-            const row = tableBody.insertRow();
-            row.innerHTML = `<td>${new Date(tx.timestamp).toLocaleString()}</td><td>${tx.order_id}</td><td>${tx.amount.toFixed(2)}</td><td>${tx.payment_method}</td><td>${tx.user_email}</td><td>${tx.admitad_uid || 'N/A'}</td>`;
-        });
-    } catch (error) { container.innerHTML = `<p class="error-message">Не удалось загрузить транзакции.</p>`; }
+    container.innerHTML = `
+        <table class="transactions-table">
+            <thead><tr><th>Дата</th><th>Заказ</th><th>Сумма</th><th>Оплата</th><th>Email</th><th>Admitad UID</th></tr></thead>
+            <tbody></tbody>
+        </table>
+        <button class="button" id="transactions-more" style="display: none;">Показать ещё</button>
+    `;
+    const tableBody = container.querySelector('tbody');
+    const moreButton = document.getElementById('transactions-more');
+    let cursor = null;
+
+    // Сервер отдаёт транзакции страницами (от новых к старым),
+    // следующая страница запрашивается по курсору next_cursor.
+    async function loadPage() {
+        try {
+            const params = new URLSearchParams({ limit: TRANSACTIONS_PAGE_SIZE });
+            if (cursor !== null) params.set('cursor', cursor);
+            const response = await fetch(`${API_URL}/transactions?${params}`);
+            if (!response.ok) throw new Error('Network response was not ok');
+            const page = await response.json();
+            page.items.forEach(tx => {
+                const row = tableBody.insertRow();
+                row.innerHTML = `<td>${new Date(tx.timestamp).toLocaleString()}</td><td>${tx.order_id}</td><td>${tx.amount.toFixed(2)}</td><td>${tx.payment_method}</td><td>${tx.user_email}</td><td>${tx.admitad_uid || 'N/A'}</td>`;
+            });
+            cursor = page.next_cursor;
+            moreButton.style.display = cursor === null ? 'none' : '';
+        } catch (error) { container.innerHTML = `<p class="error-message">Не удалось загрузить транзакции.</p>`; }
+    }
+
+    moreButton.addEventListener('click', loadPage);
+    await loadPage();
 }
 
 // ====================================================================
@@ -392,6 +473,7 @@ function displayCheckoutPage() {
                 submitBtn.disabled = false;
                 submitBtn.textContent = 'Оформить заказ';
             }
+            refreshCheckoutQuote(cart);
         }
     }
 
@@ -415,6 +497,46 @@ function displayCheckoutPage() {
 }
 
 
+/**
+ * Пересчитывает корзину на сервере одним запросом и показывает актуальные
+ * цены каталога. Цены в корзине обновляются, чтобы сумма заказа совпала
+ * с расчётом сервера.
+ */
+async function refreshCheckoutQuote(cart) {
+    const itemsSummaryContainer = document.getElementById('cart-items-summary');
+    const totalAmountEl = document.getElementById('summary-total-amount');
+    try {
+        const response = await fetch(`${API_URL}/cart/quote`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                items: cart.map(item => ({ product_id: item.id, quantity: item.quantity }))
+            })
+        });
+        if (!response.ok) throw new Error(`Ошибка сервера: ${response.status}`);
+        const quote = await response.json();
+        const prices = new Map(quote.items.map(line => [line.product_id, line.unit_price]));
+        cart.forEach(item => {
+            if (prices.has(item.id)) item.price = prices.get(item.id);
+        });
+        saveCart(cart);
+
+        if (itemsSummaryContainer) {
+            itemsSummaryContainer.innerHTML = '';
+            quote.items.forEach(line => {
+                const itemEl = document.createElement('div');
+                itemEl.className = 'summary-item';
+                itemEl.innerHTML = `<span>${line.name} (x${line.quantity})</span><span>${line.line_total.toFixed(2)} руб.</span>`;
+                itemsSummaryContainer.appendChild(itemEl);
+            });
+        }
+        if (totalAmountEl) totalAmountEl.textContent = quote.total_amount.toFixed(2);
+    } catch (error) {
+        console.error("Не удалось пересчитать корзину на сервере:", error);
+    }
+}
+
+
 // ====================================================================
 // --- ОБРАБОТЧИКИ ФОРМ ---
 // ====================================================================
@@ -0,0 +1,22 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# Корень репозитория - чтобы `backend` импортировался при любом способе запуска pytest.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Тесты, импортирующие backend.db и приложение, не трогают рабочие данные:
+# журнал транзакций, записи на мероприятия, outbox, индекс дедупликации,
+# журнал визитов и лог Admitad - во временной папке (как в бенчмарке).
+_WORKDIR = tempfile.mkdtemp(prefix="sport-shop-tests-")
+atexit.register(shutil.rmtree, _WORKDIR, ignore_errors=True)
+os.environ["DATA_DIR"] = _WORKDIR
+os.environ["BANK_LATENCY_SECONDS"] = "0"
+os.environ["CATALOG_WATCH_INTERVAL"] = "0"
+os.environ["ADMITAD_OUTBOX_FILE"] = os.path.join(_WORKDIR, "outbox.sqlite3")
+os.environ["ADMITAD_DEDUP_FILE"] = os.path.join(_WORKDIR, "dedup.sqlite3")
+os.environ["ADMITAD_VISIT_LOG_FILE"] = os.path.join(_WORKDIR, "visits.sqlite3")
+os.environ["ADMITAD_LOG_FILE"] = os.path.join(_WORKDIR, "admitad_tracker.log")
@@ -0,0 +1,100 @@
+"""
+ProductCatalog.search против перебора всего каталога: одинаковые total
+и страницы по возрастанию и убыванию цены, при смещении в конце выдачи
+и за ней, для частых слов (битовые карты) и редких (списки рангов).
+"""
+
+import itertools
+import random
+
+from backend.storage.catalog import ProductCatalog, tokenize
+
+CATEGORIES = ("Бег", "Плавание", "Теннис")
+RARE_WORDS = [f"rare{i}" for i in range(8)]
+
+
+def make_catalog(size=2000, seed=7):
+    rng = random.Random(seed)
+    products = []
+    for product_id in range(1, size + 1):
+        words = [f"item{product_id}"]
+        if rng.random() < 0.5:
+            words.append("common")
+        if rng.random() < 0.3:
+            words.append("half")
+        words.extend(word for word in RARE_WORDS if rng.random() < 0.006)
+        products.append(
+            {
+                "id": product_id,
+                "name": " ".join(words[: len(words) // 2 + 1]),
+                "description": " ".join(words[len(words) // 2 + 1 :]),
+                "category": rng.choice(CATEGORIES),
+                # Мало разных цен: много равных, порядок между ними - по id.
+                "price": rng.randrange(100, 160) * 10.0,
+            }
+        )
+    return ProductCatalog(products)
+
+
+def product_tokens(catalog):
+    return {p["id"]: set(tokenize(f"{p['name']} {p['description']}")) for p in catalog.products}
+
+
+def brute_force(catalog, words, query="", category=None, price_min=None, price_max=None,
+                descending=False, offset=0, limit=20):
+    tokens = set(tokenize(query))
+    found = [
+        p
+        for p in catalog.products
+        if tokens <= words[p["id"]]
+        and (not category or p["category"].casefold() == category.casefold())
+        and (price_min is None or p["price"] >= price_min)
+        and (price_max is None or p["price"] <= price_max)
+    ]
+    found.sort(key=lambda p: (p["price"], p["id"]), reverse=descending)
+    return len(found), found[offset : offset + limit]
+
+
+def check(catalog, words, **filters):
+    total, _ = brute_force(catalog, words, **filters)
+    for descending, offset, limit in itertools.product(
+        (False, True),
+        sorted({0, 1, 7, max(total - 3, 0), max(total - 1, 0), total, total + 5}),
+        (1, 20),
+    ):
+        args = dict(filters, descending=descending, offset=offset, limit=limit)
+        expected_total, expected = brute_force(catalog, words, **args)
+        got_total, got = catalog.search(**args)
+        assert got_total == expected_total, args
+        assert [p["id"] for p in got] == [p["id"] for p in expected], args
+
+
+def test_catalog_has_dense_and_sparse_terms():
+    catalog = make_catalog()
+    assert catalog._postings["common"].bitmap is not None
+    assert catalog._postings["half"].bitmap is not None
+    assert all(catalog._postings[word].bitmap is None for word in RARE_WORDS)
+    assert all(term.bitmap is not None for term in catalog._category_terms.values())
+
+
+def test_search_matches_brute_force():
+    catalog = make_catalog()
+    words = product_tokens(catalog)
+    queries = ["", "common", "common half", "rare3", "rare3 common", "rare1 rare2 half",
+               "RARE5", "нет-такого"]
+    categories = [None, "бег", "Теннис"]
+    prices = [(None, None), (1200.0, None), (None, 1200.0), (1150.0, 1350.0), (1590.0, 1590.0),
+              (1700.0, 1800.0)]
+    for query, category, (price_min, price_max) in itertools.product(queries, categories, prices):
+        check(
+            catalog, words,
+            query=query, category=category, price_min=price_min, price_max=price_max,
+        )
+
+
+def test_search_in_small_and_empty_catalog():
+    for size in (0, 1, 5):
+        catalog = make_catalog(size=size)
+        words = product_tokens(catalog)
+        for query in ("", "common", "rare0"):
+            check(catalog, words, query=query)
@@ -0,0 +1,121 @@
+"""
+ConversionDedupIndex: занятие и освобождение ключей, общий индекс для
+нескольких воркеров, срок жизни ключей (TTL) и очистка индекса.
+"""
+
+import types
+
+import pytest
+
+from backend.admitad_postback_plugin import dedup_index as dedup_module
+from backend.admitad_postback_plugin.dedup_index import ConversionDedupIndex
+
+TTL = 100.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое время индекса."""
+    clock = types.SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(dedup_module, "time", types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def make_index(tmp_path, **kwargs):
+    kwargs.setdefault("ttl_seconds", TTL)
+    return ConversionDedupIndex(str(tmp_path / "dedup.sqlite3"), **kwargs)
+
+
+def stored_keys(index):
+    return {key for (key,) in index._db.execute("SELECT key FROM seen_keys")}
+
+
+def test_claim_rejects_repeats(tmp_path, clock):
+    index = make_index(tmp_path)
+    assert index.claim("order:1") is True
+    assert index.claim("order:1") is False
+    assert index.claim("order:2") is True
+
+
+def test_claim_with_several_keys_is_all_or_nothing(tmp_path, clock):
+    index = make_index(tmp_path)
+    assert index.claim("order:1", "idem:a") is True
+    # Тот же Idempotency-Key с другим заказом - дубликат, order:2 не занимается.
+    assert index.claim("order:2", "idem:a") is False
+    assert stored_keys(index) == {"order:1", "idem:a"}
+    assert index.claim("order:2") is True
+
+
+def test_index_is_shared_between_workers(tmp_path, clock):
+    first, second = make_index(tmp_path), make_index(tmp_path)
+    assert first.claim("order:1") is True
+    # У второго воркера ключа нет в локальном кэше - решает SQLite.
+    assert second.claim("order:1") is False
+    assert second.claim("order:2") is True
+    assert first.claim("order:2") is False
+
+
+def test_release_allows_retry(tmp_path, clock):
+    first, second = make_index(tmp_path), make_index(tmp_path)
+    assert first.claim("order:1", "idem:a") is True
+    assert second.claim("order:1") is False
+    first.release("order:1", "idem:a")
+    assert stored_keys(first) == set()
+    assert first.claim("order:1", "idem:a") is True
+    first.release("order:1", "idem:a")
+    assert second.claim("order:1") is True
+
+
+def test_keys_expire_after_ttl(tmp_path, clock):
+    index, other = make_index(tmp_path), make_index(tmp_path)
+    assert index.claim("order:1") is True
+    clock.now += TTL - 1
+    assert index.claim("order:1") is False
+    assert other.claim("order:1") is False
+    clock.now += 2
+    # Срок истёк и в локальном кэше, и в SQLite.
+    assert index.claim("order:1") is True
+    assert other.claim("order:1") is False
+
+
+def test_repeats_do_not_extend_ttl(tmp_path, clock):
+    first, second = make_index(tmp_path), make_index(tmp_path)
+    assert first.claim("order:1") is True
+    for _ in range(3):
+        clock.now += TTL / 4
+        assert second.claim("order:1") is False
+    clock.now += TTL / 4 + 1
+    assert second.claim("order:1") is True
+
+
+def test_eviction_removes_expired_and_extra_keys(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(ConversionDedupIndex, "EVICT_EVERY", 5)
+    index = make_index(tmp_path, max_entries=3)
+    for i in range(4):
+        assert index.claim(f"old:{i}") is True
+    clock.now += TTL + 1
+    for i in range(1):
+        assert index.claim(f"new:{i}") is True
+    # Пятое занятие запускает очистку: просроченные удалены.
+    assert stored_keys(index) == {"new:0"}
+    for i in range(1, 6):
+        clock.now += 1
+        assert index.claim(f"new:{i}") is True
+    # Десятое занятие: остаются только max_entries самых новых.
+    assert stored_keys(index) == {"new:3", "new:4", "new:5"}
+
+
+def test_local_cache_is_bounded(tmp_path, clock):
+    index = make_index(tmp_path, local_cache_size=2)
+    for i in range(5):
+        index.claim(f"order:{i}")
+    assert list(index._local) == ["order:3", "order:4"]
+    # Вытесненный из кэша ключ по-прежнему занят в SQLite.
+    assert index.claim("order:0") is False
+
+
+def test_storage_error_lets_conversion_through(tmp_path, clock):
+    index = make_index(tmp_path)
+    index._db.close()
+    assert index.claim("order:1") is True
+    index.release("order:1")
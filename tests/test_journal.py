@@ -0,0 +1,267 @@
+"""
+JsonlJournal: восстановление после оборванной записи, пакетный fsync
+и таймер, компакция, индекс смещений (.idx) и ленивые JournalRecords.
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from backend.storage import journal as journal_module
+from backend.storage.journal import JsonlJournal
+
+
+def records(count, start=0):
+    return [
+        {"order_id": i, "status": "paid", "amount": i * 1.5} for i in range(start, start + count)
+    ]
+
+
+def write_lines(path, items, tail=b""):
+    with open(path, "wb") as f:
+        for item in items:
+            f.write(json.dumps(item).encode() + b"\n")
+        f.write(tail)
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    """Считает вызовы os.fsync."""
+    calls = []
+    real = os.fsync
+
+    def counting(fd):
+        calls.append(fd)
+        real(fd)
+
+    monkeypatch.setattr(journal_module.os, "fsync", counting)
+    return calls
+
+
+def scan_starts(monkeypatch):
+    """Запоминает, с какого смещения open_records дочитывал журнал."""
+    starts = []
+    real = JsonlJournal._scan
+
+    def spy(self, start):
+        starts.append(start)
+        return real(self, start)
+
+    monkeypatch.setattr(JsonlJournal, "_scan", spy)
+    return starts
+
+
+# --- Восстановление после сбоя ---
+
+
+def test_recover_cuts_torn_last_line(tmp_path):
+    path = tmp_path / "tx.jsonl"
+    write_lines(path, records(3), tail=b'{"order_id": 3, "sta')
+    assert JsonlJournal(path).recover() == records(3)
+    assert path.read_bytes().endswith(b"\n")
+    # Дописанное после восстановления читается вместе со старым.
+    journal = JsonlJournal(path)
+    journal.append(records(1, start=3)[0])
+    journal.close()
+    assert JsonlJournal(path).recover() == records(4)
+
+
+def test_recover_keeps_complete_record_without_newline(tmp_path):
+    path = tmp_path / "tx.jsonl"
+    write_lines(path, records(2), tail=json.dumps(records(1, start=2)[0]).encode())
+    assert JsonlJournal(path).recover() == records(3)
+    assert path.read_bytes().count(b"\n") == 3
+
+
+def test_recover_skips_damaged_lines_and_compacts(tmp_path):
+    path = tmp_path / "tx.jsonl"
+    good = records(4)
+    with open(path, "wb") as f:
+        for i, item in enumerate(good):
+            f.write(json.dumps(item).encode() + b"\n")
+            if i == 1:
+                f.write(b"{not json}\n")
+    assert JsonlJournal(path).recover() == good
+    assert b"not json" not in path.read_bytes()
+
+
+def test_open_records_cuts_torn_last_line(tmp_path):
+    path = tmp_path / "tx.jsonl"
+    write_lines(path, records(3), tail=b'{"order_id": 3')
+    journal = JsonlJournal(path)
+    assert list(journal.open_records()) == records(3)
+    journal.close()
+    assert list(JsonlJournal(path).open_records()) == records(3)
+
+
+# --- Пакетный fsync ---
+
+
+def test_fsync_is_batched(tmp_path, fsyncs):
+    journal = JsonlJournal(tmp_path / "tx.jsonl", fsync_every=3, fsync_interval=60)
+    journal.append_many(records(2))
+    assert fsyncs == []
+    journal.append(records(1, start=2)[0])
+    assert len(fsyncs) == 1
+    journal.append(records(1, start=3)[0])
+    journal.sync()
+    assert len(fsyncs) == 2
+    journal.close()
+
+
+def test_timer_syncs_idle_tail(tmp_path, fsyncs):
+    journal = JsonlJournal(tmp_path / "tx.jsonl", fsync_every=100, fsync_interval=0.05)
+    journal.append(records(1)[0])
+    assert fsyncs == []
+    deadline = time.monotonic() + 2
+    while not fsyncs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(fsyncs) == 1
+    with journal._lock:
+        assert journal._pending == 0
+    journal.close()
+    assert len(fsyncs) == 1
+
+
+def test_close_cancels_timer_and_syncs(tmp_path, fsyncs):
+    journal = JsonlJournal(tmp_path / "tx.jsonl", fsync_every=100, fsync_interval=60)
+    journal.append(records(1)[0])
+    assert journal._sync_timer is not None
+    journal.close()
+    assert journal._sync_timer is None
+    assert len(fsyncs) == 1
+
+
+# --- Компакция ---
+
+
+def test_compact_replaces_content(tmp_path):
+    path = tmp_path / "tx.jsonl"
+    journal = JsonlJournal(path)
+    journal.append_many(records(5))
+    journal.compact(records(2, start=10))
+    journal.append(records(1, start=12)[0])
+    journal.close()
+    assert JsonlJournal(path).recover() == records(3, start=10)
+    assert not path.with_suffix(".jsonl.tmp").exists()
+
+
+def test_compact_of_indexed_journal_rewrites_index(tmp_path, monkeypatch):
+    path = tmp_path / "tx.jsonl"
+    journal = JsonlJournal(path)
+    journal.append_many(records(5))
+    journal.open_records()
+    journal.compact(records(3, start=20))
+    journal.close()
+    starts = scan_starts(monkeypatch)
+    assert list(JsonlJournal(path).open_records()) == records(3, start=20)
+    # Индекс после компакции покрывает весь новый файл.
+    assert starts == [path.stat().st_size]
+
+
+# --- Индекс смещений ---
+
+
+def test_index_is_reused_without_rescanning(tmp_path, monkeypatch):
+    path = tmp_path / "tx.jsonl"
+    write_lines(path, records(50))
+    JsonlJournal(path).open_records()
+    assert path.with_suffix(".jsonl.idx").exists()
+    starts = scan_starts(monkeypatch)
+    assert list(JsonlJournal(path).open_records()) == records(50)
+    assert starts == [path.stat().st_size]
+
+
+def test_stale_index_after_append_reads_only_the_tail(tmp_path, monkeypatch):
+    path = tmp_path / "tx.jsonl"
+    write_lines(path, records(10))
+    JsonlJournal(path).open_records()
+    covered = path.stat().st_size
+    # Дописывает процесс, который не вёл индекс (например, старая версия).
+    writer = JsonlJournal(path)
+    writer.append_many(records(5, start=10))
+    writer.close()
+    starts = scan_starts(monkeypatch)
+    assert list(JsonlJournal(path).open_records()) == records(15)
+    assert starts == [covered]
+    starts.clear()
+    assert list(JsonlJournal(path).open_records()) == records(15)
+    assert starts == [path.stat().st_size]
+
+
+def test_appends_to_indexed_journal_are_saved_on_close(tmp_path, monkeypatch):
+    path = tmp_path / "tx.jsonl"
+    journal = JsonlJournal(path)
+    journal.open_records()
+    journal.append_many(records(4))
+    journal.append(records(1, start=4)[0])
+    journal.close()
+    starts = scan_starts(monkeypatch)
+    assert list(JsonlJournal(path).open_records()) == records(5)
+    assert starts == [path.stat().st_size]
+
+
+def test_index_of_replaced_journal_is_ignored(tmp_path, monkeypatch):
+    path = tmp_path / "tx.jsonl"
+    write_lines(path, records(10))
+    JsonlJournal(path).open_records()
+    # Другой файл на месте журнала (новый inode) - индекс к нему не подходит.
+    replacement = tmp_path / "other.jsonl"
+    write_lines(replacement, records(12, start=100))
+    os.replace(replacement, path)
+    starts = scan_starts(monkeypatch)
+    assert list(JsonlJournal(path).open_records()) == records(12, start=100)
+    assert starts == [0]
+
+
+def test_index_of_rewritten_journal_is_ignored(tmp_path, monkeypatch):
+    path = tmp_path / "tx.jsonl"
+    write_lines(path, records(10))
+    JsonlJournal(path).open_records()
+    # Тот же inode, но содержимое переписано: граница индекса не на конце строки.
+    with open(path, "r+b") as f:
+        f.truncate(0)
+        f.write(b"\n".join(json.dumps({"id": i, "pad": "x" * i}).encode() for i in range(30)))
+        f.write(b"\n")
+    starts = scan_starts(monkeypatch)
+    result = list(JsonlJournal(path).open_records())
+    assert result == [{"id": i, "pad": "x" * i} for i in range(30)]
+    assert starts == [0]
+
+
+def test_damaged_index_file_is_rebuilt(tmp_path):
+    path = tmp_path / "tx.jsonl"
+    write_lines(path, records(10))
+    JsonlJournal(path).open_records()
+    index_path = path.with_suffix(".jsonl.idx")
+    index_path.write_bytes(index_path.read_bytes()[:-3])
+    assert list(JsonlJournal(path).open_records()) == records(10)
+    assert list(JsonlJournal(path).open_records()) == records(10)
+
+
+# --- Ленивое чтение ---
+
+
+def test_journal_records_sequence(tmp_path):
+    path = tmp_path / "tx.jsonl"
+    write_lines(path, records(7))
+    items = JsonlJournal(path).open_records()
+    assert len(items) == 7
+    assert items[0] == records(1)[0]
+    assert items[-1] == records(1, start=6)[0]
+    assert items[2:5] == records(3, start=2)
+    assert items[::-3] == [records(7)[i] for i in (6, 3, 0)]
+    with pytest.raises(IndexError):
+        items[7]
+    with pytest.raises(IndexError):
+        items[-8]
+
+
+def test_empty_journal(tmp_path):
+    path = tmp_path / "tx.jsonl"
+    items = JsonlJournal(path).open_records()
+    assert len(items) == 0
+    assert list(items) == []
+    assert JsonlJournal(path).recover() == []
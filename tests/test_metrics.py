@@ -0,0 +1,50 @@
+"""
+/metrics: gauge-функции (в режиме SQLite - запросы к базе) выполняются
+вне цикла событий; число транзакций SQLite берётся из счётчика агрегатов.
+"""
+
+import asyncio
+from datetime import datetime
+
+import httpx
+
+from backend import db
+from backend.main import app
+from backend.storage.sqlite_store import SqliteTransactionStore
+
+
+class LoopCheckingStore(list):
+    """Хранилище, запоминающее, вызывался ли len() в цикле событий."""
+
+    def __len__(self):
+        try:
+            asyncio.get_running_loop()
+            self.calls.append("loop")
+        except RuntimeError:
+            self.calls.append("thread")
+        return super().__len__()
+
+
+def test_gauges_are_collected_off_the_loop(monkeypatch):
+    store = LoopCheckingStore([{"order_id": 1}, {"order_id": 2}])
+    store.calls = []
+    monkeypatch.setattr(db, "TRANSACTIONS_DB", store)
+
+    async def scrape():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/metrics")
+
+    response = asyncio.run(scrape())
+    assert response.status_code == 200
+    assert "shop_transactions_stored 2" in response.text
+    assert store.calls == ["thread"]
+
+
+def test_sqlite_length_comes_from_rollup_counter(tmp_path):
+    store = SqliteTransactionStore(tmp_path / "tx.sqlite3")
+    store.append({"order_id": 1, "payment_method": "cash", "timestamp": datetime(2026, 1, 1)})
+    store.append_many([{"order_id": i, "payment_method": "card"} for i in range(2, 6)])
+    count = store._conn().execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    assert len(store) == count == 5
+    assert len(SqliteTransactionStore(tmp_path / "empty.sqlite3")) == 0
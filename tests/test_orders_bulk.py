@@ -0,0 +1,143 @@
+"""
+POST /api/orders/bulk: результат по каждой строке NDJSON (ошибки в одних
+строках не мешают принять остальные), строки, разрезанные между кусками
+тела, и ограничения размера тела, числа строк и длины строки (413).
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from backend import db
+from backend.main import app
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """Транзакции, которые пакет записал бы в хранилище."""
+    saved = []
+    monkeypatch.setattr(db, "append_transactions", saved.extend)
+    monkeypatch.setattr(db, "BANK_LATENCY_SECONDS", 0)
+    return saved
+
+
+def order_line(quantity=1, **overrides):
+    product = db.PRODUCTS_DB[0]
+    order = {
+        "user_name": "Иван",
+        "user_email": "ivan@example.com",
+        "payment_method": "cash",
+        "items": [{"product_id": product["id"], "name": product["name"], "quantity": quantity}],
+        "total_amount": product["price"] * quantity,
+    }
+    order.update(overrides)
+    return json.dumps(order, ensure_ascii=False).encode()
+
+
+def post_bulk(body, chunk_size=None):
+    """Отправляет тело целиком или потоком кусков по chunk_size байт."""
+
+    async def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start : start + chunk_size]
+
+    async def send():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(
+                "/api/orders/bulk", content=chunks() if chunk_size else body
+            )
+
+    return asyncio.run(send())
+
+
+def test_errors_are_reported_per_line(saved):
+    body = b"\n".join(
+        [
+            order_line(quantity=2),
+            b"{not json",
+            b"",
+            order_line(user_email="not-an-email"),
+            order_line(total_amount=1.0),
+            order_line(payment_method="card"),
+            order_line(quantity=3),
+        ]
+    )
+    response = post_bulk(body)
+    assert response.status_code == 200
+    payload = response.json()
+    assert (payload["accepted"], payload["rejected"]) == (2, 4)
+    results = payload["results"]
+    # Пустая строка пропускается, но нумерация строк сохраняется.
+    assert [(r["line"], r["status"]) for r in results] == [
+        (1, "success"),
+        (2, "error"),
+        (4, "error"),
+        (5, "error"),
+        (6, "error"),
+        (7, "success"),
+    ]
+    assert "JSON" in results[1]["detail"]
+    assert "не совпадает" in results[3]["detail"]
+    assert "карты" in results[4]["detail"]
+    price = db.PRODUCTS_DB[0]["price"]
+    assert [r["total_amount"] for r in (results[0], results[5])] == [price * 2, price * 3]
+    assert [t["order_id"] for t in saved] == [results[0]["order_id"], results[5]["order_id"]]
+
+
+def test_lines_split_between_chunks(saved):
+    lines = [order_line(quantity=q) for q in (1, 2, 3, 4)]
+    body = b"\n".join(lines) + b"\n"
+    for chunk_size in (1, 7, len(lines[0]), len(body)):
+        saved.clear()
+        response = post_bulk(body, chunk_size=chunk_size)
+        assert response.status_code == 200
+        assert response.json()["accepted"] == 4
+        assert [t["amount"] for t in saved] == [db.PRODUCTS_DB[0]["price"] * q for q in (1, 2, 3, 4)]
+
+
+def test_body_size_limit(saved, monkeypatch):
+    body = b"\n".join(order_line() for _ in range(10))
+    monkeypatch.setattr(db, "ORDERS_BULK_MAX_BYTES", len(body))
+    assert post_bulk(body, chunk_size=100).status_code == 200
+    saved.clear()
+    monkeypatch.setattr(db, "ORDERS_BULK_MAX_BYTES", len(body) - 1)
+    response = post_bulk(body, chunk_size=100)
+    assert response.status_code == 413
+    assert "большой пакет" in response.json()["detail"]
+    assert saved == []
+
+
+def test_line_count_limit(saved, monkeypatch):
+    monkeypatch.setattr(db, "ORDERS_BULK_MAX_LINES", 3)
+    assert post_bulk(b"\n".join(order_line() for _ in range(3))).status_code == 200
+    saved.clear()
+    for body in (
+        b"\n".join(order_line() for _ in range(4)),
+        b"\n".join(order_line() for _ in range(4)) + b"\n",
+    ):
+        response = post_bulk(body, chunk_size=50)
+        assert response.status_code == 413
+        assert "много строк" in response.json()["detail"]
+    assert saved == []
+
+
+def test_line_length_limit(saved, monkeypatch):
+    line = order_line()
+    monkeypatch.setattr(db, "ORDERS_BULK_MAX_LINE_BYTES", len(line))
+    assert post_bulk(line + b"\n" + line).status_code == 200
+    saved.clear()
+    long_line = order_line(user_name="Иван" * 10)
+    # Длинная строка в середине пакета, в конце без перевода строки
+    # и незавершённая строка, растущая от куска к куску.
+    for body, chunk_size in (
+        (line + b"\n" + long_line + b"\n" + line, None),
+        (line + b"\n" + long_line, None),
+        (line + b"\n" + long_line, 16),
+    ):
+        response = post_bulk(body, chunk_size=chunk_size)
+        assert response.status_code == 413
+        assert "длинная строка" in response.json()["detail"]
+    assert saved == []
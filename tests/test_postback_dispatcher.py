@@ -0,0 +1,194 @@
+"""
+Доставка постбэков через PostbackDispatcher с заглушкой вместо Admitad
+(httpx.MockTransport): отправка, повторы, dead-letter и досылка после
+перезапуска из outbox.
+"""
+
+import asyncio
+import json
+import sqlite3
+
+import httpx
+
+from backend.admitad_postback_plugin.postback_dispatcher import PostbackDispatcher
+
+URL = "http://admitad.test/tt"
+SECRET = "s3cret"
+
+
+class StubAdmitad:
+    """Заглушка Admitad: отвечает статусами из `statuses` по очереди (последний повторяется)."""
+
+    def __init__(self, *statuses, error=None):
+        self.statuses = list(statuses) or [200]
+        self.error = error
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if self.error is not None:
+            raise self.error("stub is down", request=request)
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        return httpx.Response(status)
+
+    def order_ids(self):
+        return [r.url.params["order_id"] for r in self.requests]
+
+
+def make_dispatcher(tmp_path, stub, **kwargs):
+    options = dict(
+        outbox_path=str(tmp_path / "outbox.sqlite3"),
+        transport=httpx.MockTransport(stub),
+        retry_base_delay=0.01,
+        retry_max_delay=0.05,
+        poll_interval=0.01,
+        batch_window=0.01,
+        secret_params={"postback_key": SECRET},
+    )
+    options.update(kwargs)
+    return PostbackDispatcher(**options)
+
+
+def outbox_rows(tmp_path):
+    with sqlite3.connect(tmp_path / "outbox.sqlite3") as db:
+        return db.execute("SELECT order_id, status, attempts, params FROM outbox").fetchall()
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_delivers_and_keeps_secret_out_of_outbox(tmp_path):
+    stub = StubAdmitad(200)
+    seen_in_outbox = []
+
+    async def scenario():
+        dispatcher = make_dispatcher(tmp_path, stub)
+        await dispatcher.start()
+        await dispatcher.submit(URL, {"order_id": "1", "postback_key": SECRET, "uid": None}, "1")
+        seen_in_outbox.extend(outbox_rows(tmp_path))
+        await wait_for(lambda: stub.requests and not outbox_rows(tmp_path))
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+    assert len(seen_in_outbox) == 1
+    assert SECRET not in seen_in_outbox[0][3]
+    params = stub.requests[0].url.params
+    assert params["postback_key"] == SECRET
+    assert "uid" not in params
+
+
+def test_retries_server_errors_until_delivered(tmp_path):
+    stub = StubAdmitad(503, 500, 200)
+
+    async def scenario():
+        dispatcher = make_dispatcher(tmp_path, stub)
+        await dispatcher.start()
+        await dispatcher.submit(URL, {"order_id": "7"}, "7")
+        await wait_for(lambda: len(stub.requests) == 3 and not outbox_rows(tmp_path))
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+    assert stub.order_ids() == ["7", "7", "7"]
+
+
+def test_client_error_goes_to_dead_letter_immediately(tmp_path):
+    stub = StubAdmitad(400)
+
+    async def scenario():
+        dispatcher = make_dispatcher(tmp_path, stub)
+        await dispatcher.start()
+        await dispatcher.submit(URL, {"order_id": "8"}, "8")
+        await wait_for(lambda: outbox_rows(tmp_path)[0][1] == "dead")
+        await asyncio.sleep(0.1)
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+    assert len(stub.requests) == 1
+    assert outbox_rows(tmp_path)[0][:3] == ("8", "dead", 1)
+
+
+def test_gives_up_after_max_attempts(tmp_path):
+    stub = StubAdmitad(500)
+
+    async def scenario():
+        dispatcher = make_dispatcher(tmp_path, stub, max_attempts=3)
+        await dispatcher.start()
+        await dispatcher.submit(URL, {"order_id": "9"}, "9")
+        await wait_for(lambda: outbox_rows(tmp_path)[0][1] == "dead")
+        await asyncio.sleep(0.1)
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+    assert len(stub.requests) == 3
+    assert outbox_rows(tmp_path)[0][:3] == ("9", "dead", 3)
+
+
+def test_undelivered_postbacks_survive_restart(tmp_path):
+    down = StubAdmitad(error=httpx.ConnectError)
+    up = StubAdmitad(200)
+
+    async def first_run():
+        dispatcher = make_dispatcher(tmp_path, down, retry_base_delay=0.2, retry_max_delay=0.2)
+        await dispatcher.start()
+        for order_id in ("10", "11"):
+            await dispatcher.submit(URL, {"order_id": order_id}, order_id)
+        await wait_for(lambda: len(down.requests) == 2)
+        await dispatcher.stop()
+
+    async def second_run():
+        dispatcher = make_dispatcher(tmp_path, up)
+        await dispatcher.start()
+        await wait_for(lambda: not outbox_rows(tmp_path))
+        await dispatcher.stop()
+
+    asyncio.run(first_run())
+    assert [row[:3] for row in outbox_rows(tmp_path)] == [("10", "pending", 1), ("11", "pending", 1)]
+    asyncio.run(second_run())
+    assert sorted(up.order_ids()) == ["10", "11"]
+    assert all(r.url.params["postback_key"] == SECRET for r in up.requests)
+
+
+def test_secret_is_removed_from_rows_of_older_versions(tmp_path):
+    path = tmp_path / "outbox.sqlite3"
+    make_dispatcher(tmp_path, StubAdmitad(), secret_params={})
+    with sqlite3.connect(path) as db:
+        db.execute(
+            "INSERT INTO outbox (order_id, url, params, next_attempt_at, created_at) "
+            "VALUES ('1', ?, ?, 0, 0)",
+            (URL, json.dumps({"order_id": "1", "postback_key": SECRET})),
+        )
+    make_dispatcher(tmp_path, StubAdmitad())
+    assert json.loads(outbox_rows(tmp_path)[0][3]) == {"order_id": "1"}
+
+
+def test_expired_leases_of_queued_entries_are_not_sent_twice(tmp_path):
+    # Медленный Admitad и один слот отправки: записи ждут семафор дольше
+    # аренды, а второй "воркер" в это время ищет записи с истёкшей арендой.
+    sent = []
+
+    async def slow_admitad(request):
+        await asyncio.sleep(0.03)
+        sent.append(request.url.params["order_id"])
+        return httpx.Response(200)
+
+    async def scenario():
+        workers = [
+            make_dispatcher(tmp_path, None, transport=httpx.MockTransport(slow_admitad), max_concurrency=1)
+            for _ in range(2)
+        ]
+        for dispatcher in workers:
+            dispatcher.lease_seconds = 0.05
+            await dispatcher.start()
+        for order_id in range(10):
+            await workers[0].submit(URL, {"order_id": str(order_id)}, str(order_id))
+        await wait_for(lambda: not outbox_rows(tmp_path))
+        await asyncio.sleep(0.2)
+        for dispatcher in workers:
+            await dispatcher.stop()
+
+    asyncio.run(scenario())
+    assert sorted(sent, key=int) == [str(i) for i in range(10)]
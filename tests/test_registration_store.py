@@ -0,0 +1,159 @@
+"""
+EventRegistrationStore: лимит мест, повторная запись, отмена с
+освобождением места, перенос старых записей и одновременные записи
+из нескольких соединений (воркеров); освобождение места в
+order_service, если транзакцию записи сохранить не удалось.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from backend.models import EventRegistration
+from backend.storage.registration_store import (
+    DuplicateRegistrationError,
+    EventFullError,
+    EventRegistrationStore,
+)
+
+
+def registration(email, event="Забег 10 км", registration_id=None):
+    return {
+        "registration_id": registration_id or abs(hash(email)),
+        "user_name": "Иван",
+        "user_email": email,
+        "event_name": event,
+    }
+
+
+def test_capacity_limit(tmp_path):
+    store = EventRegistrationStore(tmp_path / "reg.sqlite3", capacities={"Забег 10 км": 2})
+    assert store.register(registration("a@x.io"))["remaining"] == 1
+    assert store.register(registration("b@x.io"))["remaining"] == 0
+    with pytest.raises(EventFullError):
+        store.register(registration("c@x.io"))
+    # Ключ мероприятия - без учёта регистра и лишних пробелов.
+    with pytest.raises(EventFullError):
+        store.register(registration("c@x.io", event="  забег   10 КМ"))
+    assert store.event_stats("Забег 10 км") == {
+        "event_name": "Забег 10 км",
+        "capacity": 2,
+        "registered": 2,
+        "remaining": 0,
+    }
+    assert len(store) == 2
+
+
+def test_unlimited_event(tmp_path):
+    store = EventRegistrationStore(tmp_path / "reg.sqlite3")
+    for i in range(20):
+        store.register(registration(f"u{i}@x.io"))
+    assert store.event_stats("Забег 10 км")["remaining"] is None
+    assert store.event_stats("Другое")["registered"] == 0
+
+
+def test_duplicate_is_rejected_without_taking_a_seat(tmp_path):
+    store = EventRegistrationStore(tmp_path / "reg.sqlite3", default_capacity=5)
+    store.register(registration("a@x.io"))
+    with pytest.raises(DuplicateRegistrationError):
+        store.register(registration(" A@X.io ", registration_id=2))
+    # Тот же email на другое мероприятие - можно.
+    store.register(registration("a@x.io", event="Заплыв"))
+    assert store.event_stats("Забег 10 км")["registered"] == 1
+
+
+def test_cancel_releases_the_seat(tmp_path):
+    store = EventRegistrationStore(tmp_path / "reg.sqlite3", default_capacity=1)
+    first = registration("a@x.io", registration_id=1)
+    store.register(first)
+    # Отменяется только запись с тем же registration_id.
+    assert store.cancel(registration("a@x.io", registration_id=2)) is False
+    assert store.event_stats("Забег 10 км")["registered"] == 1
+    assert store.cancel(first) is True
+    assert store.cancel(first) is False
+    assert store.event_stats("Забег 10 км")["registered"] == 0
+    # Освободившееся место можно занять, после чего мест снова нет.
+    assert store.register(registration("b@x.io"))["remaining"] == 0
+    with pytest.raises(EventFullError):
+        store.register(registration("c@x.io"))
+    # Отменивший может записаться снова.
+    store.cancel(registration("b@x.io"))
+    store.register(first)
+
+
+def test_import_if_empty(tmp_path):
+    path = tmp_path / "reg.sqlite3"
+    legacy = [
+        registration("a@x.io"),
+        registration("A@x.io"),  # повтор - пропускается
+        registration("b@x.io", event="Заплыв"),
+        {"user_email": "c@x.io"},  # без мероприятия - пропускается
+    ]
+    store = EventRegistrationStore(path, default_capacity=1)
+    assert store.import_if_empty(legacy) == 2
+    assert store.event_stats("Забег 10 км")["registered"] == 1
+    assert store.event_stats("Заплыв")["registered"] == 1
+    # Повторный перенос (следующий запуск) ничего не меняет.
+    assert EventRegistrationStore(path).import_if_empty(legacy) == 0
+    assert len(store) == 2
+    with pytest.raises(EventFullError):
+        store.register(registration("d@x.io"))
+    rows, cursor = store.query(event_name="заплыв")
+    assert [row["user_email"] for row in rows] == ["b@x.io"] and cursor is None
+
+
+def test_concurrent_registrations_never_exceed_capacity(tmp_path):
+    path = tmp_path / "reg.sqlite3"
+    capacity = 5
+    # Два "воркера" - два объекта хранилища над одной базой; в каждом
+    # потоке своё соединение.
+    workers = [EventRegistrationStore(path, default_capacity=capacity) for _ in range(2)]
+    start = threading.Barrier(24)
+    results = []
+
+    def attempt(i):
+        start.wait()
+        try:
+            workers[i % 2].register(registration(f"u{i}@x.io"))
+            results.append("ok")
+        except EventFullError:
+            results.append("full")
+
+    threads = [threading.Thread(target=attempt, args=(i,)) for i in range(24)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count("ok") == capacity
+    assert results.count("full") == 24 - capacity
+    assert workers[0].event_stats("Забег 10 км")["registered"] == capacity
+    rows, _ = workers[1].query(limit=100)
+    assert len(rows) == capacity
+
+
+def test_failed_transaction_save_releases_the_seat(tmp_path, monkeypatch):
+    from backend import db
+    from backend.services import order_service
+
+    store = EventRegistrationStore(tmp_path / "reg.sqlite3", default_capacity=1)
+    monkeypatch.setattr(db, "EVENT_REGISTRATIONS_DB", store)
+    monkeypatch.setattr(db, "BANK_LATENCY_SECONDS", 0)
+
+    def broken_save(transaction):
+        raise OSError("диск заполнен")
+
+    request = EventRegistration(user_name="Иван", user_email="a@x.io", event_name="Забег 10 км")
+    with monkeypatch.context() as patch:
+        patch.setattr(db, "append_transaction", broken_save)
+        with pytest.raises(OSError):
+            asyncio.run(order_service.process_event_registration(request))
+    assert store.event_stats("Забег 10 км")["registered"] == 0
+
+    # Повторная попытка не получает отказ "уже записаны".
+    saved = []
+    monkeypatch.setattr(db, "append_transaction", saved.append)
+    result = asyncio.run(order_service.process_event_registration(request))
+    assert result["seats_remaining"] == 0
+    assert [t["order_id"] for t in saved] == [result["registration_id"]]
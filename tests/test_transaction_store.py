@@ -0,0 +1,349 @@
+"""
+TransactionStore против перебора списка словарей: колонки отдают те же
+записи, что были добавлены (в форме модели Transaction), а страницы по
+курсору, фильтры, диапазоны времени и order_id и агрегаты продаж
+совпадают с простым проходом по исходным записям.
+"""
+
+import itertools
+import random
+from datetime import date, datetime, timedelta
+from enum import Enum
+
+import pytest
+
+from backend.models import PaymentMethod
+from backend.storage import rollups
+from backend.storage.journal import JsonlJournal
+from backend.storage.rollups import UNKNOWN_DAY, SalesRollup
+from backend.storage.transaction_store import TransactionStore
+
+START = datetime(2026, 3, 1, 9, 30)
+
+
+def make_records(size=400, seed=3, gaps=True, legacy=False):
+    rng = random.Random(seed)
+    records = []
+    for i in range(size):
+        moment = START + timedelta(hours=7 * i, seconds=rng.randrange(3600), microseconds=i)
+        record = {
+            "order_id": 10_000 + i,
+            "status": rng.choice(["pending", "paid", "canceled", "failed", None]),
+            "payment_method": rng.choice([PaymentMethod.CARD, "cash", "event_registration"]),
+            "user_email": rng.choice(["a@x.io", "B@x.io", "b@x.io", None]),
+            "amount": rng.choice([round(rng.uniform(0, 5000), 2), 10, 0.1, None]),
+            "timestamp": rng.choice([moment, moment.isoformat(sep=" "), moment.isoformat()]),
+        }
+        if rng.random() < 0.3:
+            record["admitad_uid"] = f"uid{rng.randrange(3)}"
+        if record["payment_method"] is PaymentMethod.CARD:
+            # Номера транзакций банка повторяются - они хранятся кодами.
+            record["transaction_id"] = str(rng.randrange(100000, 100020))
+        if gaps and rng.random() < 0.05:
+            record["timestamp"] = rng.choice([None, "вчера"])
+        if gaps and rng.random() < 0.03:
+            del record["timestamp"]
+        if rng.random() < 0.05:
+            record["note"] = "поле старой версии"
+        if legacy and rng.random() < 0.2:
+            # Старые записи: order_id строкой, float, мусором, без order_id,
+            # и не по возрастанию.
+            record["order_id"] = rng.choice(
+                [str(record["order_id"]), float(record["order_id"]), "abc", None, 5, 2**70]
+            )
+        records.append(record)
+    return records
+
+
+# --- Эталон: прямой проход по словарям ---
+
+
+def parse_time(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def as_int(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, str) and value.isdigit():
+        value = int(value)
+    return value if isinstance(value, int) and -(2**63) < value < 2**63 else None
+
+
+def expected_row(record):
+    row = {}
+    for field, value in record.items():
+        if value is None:
+            continue
+        if isinstance(value, Enum):
+            value = value.value
+        if field == "amount":
+            value = round(value * 100) / 100
+        elif field == "timestamp":
+            value = parse_time(value)
+            if value is None:
+                continue
+        elif field == "order_id" and as_int(value) is not None:
+            value = as_int(value)
+        row[field] = value
+    return row
+
+
+def matches(record, filters, time_from, time_to, id_from, id_to):
+    row = expected_row(record)
+    for field, value in filters.items():
+        if value is None:
+            continue  # незаданный фильтр API
+        actual = row.get(field)
+        if field == "user_email":
+            actual, value = actual and actual.lower(), value.lower()
+        if actual != value:
+            return False
+    if time_from is not None or time_to is not None:
+        moment = row.get("timestamp")
+        if moment is None:
+            return False
+        if (time_from and moment < time_from) or (time_to and moment >= time_to):
+            return False
+    if id_from is not None or id_to is not None:
+        order_id = as_int(record.get("order_id"))
+        if order_id is None:
+            return False
+        if (id_from is not None and order_id < id_from) or (id_to is not None and order_id >= id_to):
+            return False
+    return True
+
+
+def brute_force(records, filters=None, time_from=None, time_to=None, id_from=None, id_to=None):
+    return [
+        expected_row(r)
+        for r in records
+        if matches(r, filters or {}, time_from, time_to, id_from, id_to)
+    ]
+
+
+# --- Хранилища ---
+
+
+def eager_store(tmp_path, records):
+    return TransactionStore(records)
+
+
+def lazy_store(tmp_path, records):
+    """Ленивое хранилище поверх журнала и хвост записей, добавленных до построения индексов."""
+    journal = JsonlJournal(tmp_path / "tx.jsonl")
+    head, tail = records[: len(records) * 3 // 4], records[len(records) * 3 // 4 :]
+    journal.compact(head)
+    store = TransactionStore(journal.open_records(), journal=journal, lazy=True)
+    for record in tail[:10]:
+        store.append(record)
+    store.append_many(tail[10:])
+    return store
+
+
+STORES = [eager_store, lazy_store]
+
+
+def all_pages(store, limit, **filters):
+    rows, cursor, pages = [], None, 0
+    while True:
+        page, cursor = store.query(cursor=cursor, limit=limit, **filters)
+        rows.extend(page)
+        pages += 1
+        assert pages < 1000
+        if cursor is None:
+            return rows
+
+
+FILTER_CASES = [
+    {},
+    {"filters": {"status": "paid"}},
+    {"filters": {"status": "paid", "payment_method": PaymentMethod.CARD}},
+    {"filters": {"user_email": "B@X.IO"}},
+    {"filters": {"admitad_uid": "uid1", "status": None}},
+    {"filters": {"admitad_uid": "uid1", "status": "pending"}},
+    {"filters": {"status": "unknown-status"}},
+    {"time_from": START + timedelta(days=20)},
+    {"time_to": START + timedelta(days=30)},
+    {"time_from": START + timedelta(days=10), "time_to": START + timedelta(days=40)},
+    {"time_from": START + timedelta(days=10), "time_to": START + timedelta(days=10)},
+    {"time_from": START + timedelta(days=500)},
+    {"time_from": START + timedelta(days=5), "filters": {"payment_method": "cash"}},
+    {"id_from": 10_050},
+    {"id_to": 10_100},
+    {"id_from": 10_050, "id_to": 10_300, "filters": {"user_email": "a@x.io"}},
+    {"id_from": 10_050, "time_to": START + timedelta(days=60)},
+]
+
+
+# --- Тесты ---
+
+
+@pytest.mark.parametrize("legacy", [False, True])
+@pytest.mark.parametrize("make_store", STORES)
+def test_rows_round_trip(tmp_path, make_store, legacy):
+    records = make_records(legacy=legacy)
+    store = make_store(tmp_path, records)
+    expected = [expected_row(r) for r in records]
+    assert len(store) == len(records)
+    assert store[0] == expected[0]
+    assert store[-1] == expected[-1]
+    assert store[5:9] == expected[5:9]
+    assert list(store) == expected
+    store.ensure_indexes()
+    assert list(store) == expected
+    with pytest.raises(IndexError):
+        store[len(records)]
+
+
+@pytest.mark.parametrize("gaps, legacy", [(False, False), (True, False), (True, True)])
+@pytest.mark.parametrize("make_store", STORES)
+def test_query_and_iter_match_brute_force(tmp_path, make_store, gaps, legacy):
+    records = make_records(gaps=gaps, legacy=legacy)
+    store = make_store(tmp_path, records)
+    store.ensure_indexes()
+    # Без пропусков колонки упорядочены и диапазоны ищутся бинарным поиском,
+    # с пропусками и старыми order_id - проверяются по каждой записи.
+    assert store._timestamps.is_sorted is not gaps
+    assert store._order_ids.is_sorted is not legacy
+    for case, limit in itertools.product(FILTER_CASES, (1, 7, 50, 1000)):
+        expected = brute_force(records, **case)
+        assert all_pages(store, limit, **case) == expected[::-1], (case, limit)
+        assert list(store.iter_matching(**case)) == expected, case
+
+
+def test_cursor_pages_do_not_overlap(tmp_path):
+    records = make_records()
+    store = TransactionStore(records)
+    first, cursor = store.query(limit=10)
+    second, _ = store.query(cursor=cursor, limit=10)
+    assert first == [expected_row(r) for r in records[-10:]][::-1]
+    assert second == [expected_row(r) for r in records[-20:-10]][::-1]
+    assert store.query(cursor=0, limit=10) == ([], None)
+
+
+def test_legacy_order_ids_are_converted_or_kept(tmp_path):
+    store = TransactionStore(
+        [{"order_id": "42"}, {"order_id": 7.0}, {"order_id": "abc"}, {"order_id": 2**70}, {}]
+    )
+    assert list(store) == [
+        {"order_id": 42},
+        {"order_id": 7},
+        {"order_id": "abc"},
+        {"order_id": 2**70},
+        {},
+    ]
+    assert [r["order_id"] for r in store.iter_matching(id_from=0)] == [42, 7]
+
+
+def test_transaction_ids_are_interned():
+    store = TransactionStore([{"order_id": i, "transaction_id": str(i % 3)} for i in range(30)])
+    assert len(store._transaction_ids.values) == 4  # None и три номера
+    assert [r["transaction_id"] for r in store][:4] == ["0", "1", "2", "0"]
+
+
+# --- Агрегаты продаж ---
+
+
+def expected_summary(records, group_by=None, day_from=None, day_to=None):
+    groups = {}
+    for record in records:
+        row = expected_row(record)
+        moment = row.get("timestamp")
+        day = moment.date().isoformat() if moment else UNKNOWN_DAY
+        if day == UNKNOWN_DAY and (day_from or day_to):
+            continue
+        if moment and ((day_from and moment.date() < day_from) or (day_to and moment.date() >= day_to)):
+            continue
+        key = {
+            "day": day,
+            "payment_method": row.get("payment_method"),
+            "status": row.get("status"),
+            "admitad": bool(row.get("admitad_uid")),
+        }.get(group_by)
+        totals = groups.setdefault(
+            key,
+            dict(transactions=0, orders=0, registrations=0, revenue=0,
+                 conversions=0, conversion_revenue=0),
+        )
+        cents = round(record["amount"] * 100) if record.get("amount") is not None else 0
+        revenue = 0
+        totals["transactions"] += 1
+        if row["payment_method"] == "event_registration":
+            totals["registrations"] += 1
+        else:
+            totals["orders"] += 1
+            if row.get("status") not in ("canceled", "failed"):
+                revenue = cents
+            totals["revenue"] += revenue
+        if row.get("admitad_uid"):
+            totals["conversions"] += 1
+            totals["conversion_revenue"] += revenue
+    for totals in groups.values():
+        totals["revenue"] /= 100
+        totals["conversion_revenue"] /= 100
+    return groups
+
+
+@pytest.mark.parametrize("make_store", STORES)
+def test_rollups_match_brute_force(tmp_path, make_store):
+    records = make_records()
+    assert any(expected_row(r).get("timestamp") is None for r in records)
+    store = make_store(tmp_path, records)
+    cells = store.rollup_cells()
+    periods = [
+        (None, None),
+        (date(2026, 3, 10), None),
+        (None, date(2026, 4, 1)),
+        (date(2026, 3, 10), date(2026, 3, 20)),
+        (date(2027, 1, 1), None),
+    ]
+    for group_by, (day_from, day_to) in itertools.product(
+        (None, *rollups.DIMENSIONS), periods
+    ):
+        rows = rollups.summarize(cells, group_by, day_from, day_to)
+        expected = expected_summary(records, group_by, day_from, day_to)
+        if group_by is None:
+            assert len(rows) == 1
+            assert rows[0] == expected.get(None, rows[0] if not expected else None)
+            if not expected:
+                assert rows[0]["transactions"] == 0
+        else:
+            assert {row.pop(group_by): row for row in rows} == expected, (group_by, day_from)
+
+
+def test_rollup_unknown_day_only_in_all_time_totals():
+    records = [
+        {"order_id": 1, "amount": 5, "payment_method": "cash", "status": "paid"},
+        {"order_id": 2, "amount": 7, "payment_method": "cash", "status": "paid",
+         "timestamp": "не дата"},
+        {"order_id": 3, "amount": 11, "payment_method": "cash", "status": "paid",
+         "timestamp": START},
+    ]
+    cells = TransactionStore(records).rollup_cells()
+    assert {key[0] for key, _, _ in cells} == {UNKNOWN_DAY, START.date().isoformat()}
+    assert rollups.summarize(cells)[0]["revenue"] == 23
+    assert rollups.summarize(cells, day_from=date(2000, 1, 1))[0]["revenue"] == 11
+    assert rollups.summarize(cells, day_to=date(2100, 1, 1))[0]["revenue"] == 11
+    by_day = rollups.summarize(cells, "day")
+    assert [row["day"] for row in by_day] == [START.date().isoformat(), UNKNOWN_DAY]
+
+
+def test_sales_rollup_days_in_any_order():
+    rng = random.Random(5)
+    rollup = SalesRollup()
+    expected = {}
+    base = START.timestamp()
+    moments = [base + rng.uniform(-5, 5) * 86400 for _ in range(500)] + [None, 0.0]
+    for moment in moments:
+        rollup.add_transaction(moment, "cash", "paid", False, 100)
+        day = datetime.fromtimestamp(moment).date().isoformat() if moment else UNKNOWN_DAY
+        expected[day] = expected.get(day, 0) + 1
+    assert {key[0]: count for key, count, _ in rollup.cells()} == expected
@@ -0,0 +1,168 @@
+"""
+VisitLog: кольцевой буфер с вытеснением старых визитов, запись пачкой
+одним INSERT ... FROM json_each, выборка визитов без admitad_uid,
+повтор пачки после ошибки записи и чтение visits_for из памяти и базы
+без повторов.
+"""
+
+import sqlite3
+import threading
+import time
+import types
+
+import pytest
+
+from backend.admitad_postback_plugin import visit_log as visit_log_module
+from backend.admitad_postback_plugin.visit_log import VisitLog
+
+
+@pytest.fixture
+def make_log(tmp_path):
+    logs = []
+
+    def make(**kwargs):
+        log = VisitLog(str(tmp_path / "visits.sqlite3"), **kwargs)
+        logs.append(log)
+        return log
+
+    yield make
+    for log in logs:
+        log.stop()
+
+
+def freeze_time(monkeypatch, now):
+    """Время визитов в журнале: now() вызывается на каждый визит."""
+    monkeypatch.setattr(
+        visit_log_module, "time", types.SimpleNamespace(time=now, perf_counter=time.perf_counter)
+    )
+
+
+def stored(log):
+    return [
+        row[0]
+        for row in log._conn().execute("SELECT pid FROM visits ORDER BY id").fetchall()
+    ]
+
+
+def test_ring_buffer_drops_oldest(make_log):
+    log = make_log(buffer_size=3)
+    for i in range(5):
+        assert log.record(admitad_uid="uid", pid=str(i)) is True
+    stats = log.stats()
+    assert (stats["recorded"], stats["dropped"], stats["buffered"]) == (5, 2, 3)
+    log.flush()
+    assert stored(log) == ["2", "3", "4"]
+    assert log.stats()["buffered"] == 0
+
+
+def test_batch_is_one_insert_statement(make_log):
+    log = make_log()
+    for i in range(50):
+        log.record(admitad_uid=f"uid{i % 3}", pid=str(i), utm_source="ads", gclid=None)
+    db = log._connect()
+    statements = []
+    db.set_trace_callback(statements.append)
+    log.flush(db)
+    db.close()
+    assert sum(s.lstrip().upper().startswith("INSERT") for s in statements) == 1
+    assert stored(log) == [str(i) for i in range(50)]
+    row = log._conn().execute(
+        "SELECT admitad_uid, pid, utm_source, gclid, length(visit_id) FROM visits WHERE pid = '4'"
+    ).fetchone()
+    assert row == ("uid1", "4", "ads", None, 32)
+    stats = log.stats()
+    assert (stats["flushed"], stats["last_flush_size"]) == (50, 50)
+
+
+def test_sampling_keeps_attributed_visits(make_log):
+    log = make_log(sample_rate=0.0)
+    assert log.record(pid="1") is False
+    assert log.record(admitad_uid="uid", pid="2") is True
+    assert log.stats()["sampled_out"] == 1
+
+    threads = [
+        threading.Thread(target=lambda: [log.record(pid="x") for _ in range(2000)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert log.stats()["sampled_out"] == 1 + 4 * 2000
+
+
+def test_failed_batch_is_retried(make_log):
+    log = make_log()
+    log.record(admitad_uid="uid", pid="1")
+    broken = log._connect()
+    broken.close()
+    log.flush(broken)
+    stats = log.stats()
+    assert (stats["flush_errors"], stats["pending_retry"], stats["flushed"]) == (1, 1, 0)
+    # Незаписанный визит по-прежнему виден.
+    assert [v["pid"] for v in log.visits_for("uid")] == ["1"]
+    log.record(admitad_uid="uid", pid="2")
+    log.flush()
+    assert stored(log) == ["1", "2"]
+    assert log.stats()["pending_retry"] == 0
+
+
+def test_visits_for_merges_memory_and_disk(make_log, monkeypatch):
+    log = make_log()
+    clock = iter(range(1000, 2000))
+    freeze_time(monkeypatch, lambda: next(clock))
+    for i in range(4):
+        log.record(admitad_uid="uid", pid=str(i))
+    log.record(admitad_uid="other", pid="x")
+    log.flush()
+    for i in range(4, 6):
+        log.record(admitad_uid="uid", pid=str(i))
+    assert [v["pid"] for v in log.visits_for("uid")] == ["5", "4", "3", "2", "1", "0"]
+    assert [v["pid"] for v in log.visits_for("uid", limit=3)] == ["5", "4", "3"]
+    assert log.visits_for("uid")[0].keys() == set(visit_log_module.VISIT_FIELDS)
+    assert log.visits_for("nobody") == []
+
+
+def test_visit_in_memory_and_on_disk_is_returned_once(make_log, monkeypatch):
+    log = make_log()
+    # Два разных визита в одно и то же время - оба должны остаться.
+    freeze_time(monkeypatch, lambda: 1000.0)
+    log.record(admitad_uid="uid", pid="same")
+    log.record(admitad_uid="uid", pid="same")
+    batch = list(log._buffer)
+    log.flush()
+    # Пачка записана, но ещё числится в памяти (COMMIT прошёл между
+    # чтением памяти и базы в visits_for).
+    log._flushing = batch
+    assert len(log.visits_for("uid")) == 2
+
+
+def test_old_journal_gets_visit_id_column(tmp_path, make_log):
+    path = tmp_path / "visits.sqlite3"
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE visits (id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, "
+        "admitad_uid TEXT, pid TEXT, utm_source TEXT, gclid TEXT, fbclid TEXT, source TEXT)"
+    )
+    db.execute("INSERT INTO visits (ts, admitad_uid, pid) VALUES (1, 'uid', 'old')")
+    db.commit()
+    db.close()
+    log = make_log()
+    log.record(admitad_uid="uid", pid="new")
+    log.flush()
+    assert [v["pid"] for v in log.visits_for("uid")] == ["new", "old"]
+
+
+def test_background_thread_flushes_full_batches(make_log):
+    log = make_log(flush_interval=60, flush_batch_size=10)
+    log.start()
+    for i in range(10):
+        log.record(admitad_uid="uid", pid=str(i))
+    deadline = time.monotonic() + 5
+    while log.stats()["flushed"] < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert log.stats()["flushed"] == 10
+    # Остаток буфера дописывается при остановке.
+    log.record(admitad_uid="uid", pid="last")
+    log.stop()
+    assert stored(log)[-1] == "last"